@@ -669,6 +669,15 @@ def populate_factory_descript(work_dir,
 
         glidein_dict.add('ProcessLogs', str(params.log_retention['process_logs']))
 
+        # the schedd limits are added only if configured
+        for lel in (("submit",'Submit'),("remove",'Remove'),("release",'Release')):
+            param_aname,str_aname=lel
+            if params.schedd_limits[param_aname].rate!=None:
+                glidein_dict.add('Schedd%sRate'%str_aname,params.schedd_limits[param_aname].rate)
+                glidein_dict.add('Schedd%sBurst'%str_aname,params.schedd_limits[param_aname].burst)
+                if param_aname=="submit":
+                    glidein_dict.add('ScheddSubmitTargetLatency',params.schedd_limits.submit.target_latency)
+
 #######################
 def populate_job_descript(work_dir, job_descript_dict, 
                           sub_name, sub_params):
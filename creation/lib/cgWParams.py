@@ -170,6 +170,17 @@ class GlideinParams(cWParams.CommonParams):
         self.defaults['restart_attempts'] = ('3', 'NR', 'Max allowed NR restarts every restart_interval before shutting down', None)
         self.defaults['restart_interval'] = ('1800', 'NR', 'Time interval NR sec which allow max restart attempts', None)
 
+        schedd_limit_defaults = cWParams.commentedOrderedDict()
+        schedd_limit_defaults["rate"] = [None, "nr", "Max glideins per second, shared by all the entries using the same schedd (no limit if not set)", None]
+        schedd_limit_defaults["burst"] = ['500', "nr", "Max glideins acted upon at once, after a quiet period", None]
+        schedd_limits_defaults = cWParams.commentedOrderedDict()
+        schedd_limits_defaults["submit"] = copy.deepcopy(schedd_limit_defaults)
+        schedd_limits_defaults["submit"]["burst"][0] = '200'
+        schedd_limits_defaults["submit"]["target_latency"] = ['10', "seconds", "The submit rate is reduced when condor_submit takes longer than this", None]
+        schedd_limits_defaults["remove"] = copy.deepcopy(schedd_limit_defaults)
+        schedd_limits_defaults["release"] = copy.deepcopy(schedd_limit_defaults)
+        self.defaults["schedd_limits"] = schedd_limits_defaults
+
         stage_defaults = cWParams.commentedOrderedDict()
         stage_defaults["base_dir"] = ("/var/www/html/glidefactory/stage", "base_dir", "Stage base dir", None)
         stage_defaults["web_base_url"] = ("http://%s/glidefactory/stage" % socket.gethostname(), 'base_url', 'Base Web server URL', None)
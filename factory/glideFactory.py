@@ -93,6 +93,67 @@ def write_descript(glideinDescript, frontendDescript, monitor_dir):
     # end add
 
 
+############################################################
+def write_schedd_snapshots(snapshot_dir, schedd_entries):
+    """
+    Query each schedd once for the glideins of all the entries,
+    and write the per-entry snapshots the entries will read instead of
+    running their own condor_q
+
+    @type snapshot_dir: String 
+    @param snapshot_dir: Where to write the snapshot files
+    @type schedd_entries: dict
+    @param schedd_entries: schedd_name => list of entry names
+    """
+    for schedd_name in schedd_entries.keys():
+        try:
+            snapshot_time = time.time()
+            condorq = glideFactoryLib.getCondorQFactoryData(schedd_name)
+            glideFactoryLib.writeCondorQSnapshot(snapshot_dir, schedd_name, schedd_entries[schedd_name],
+                                                 condorq, snapshot_time)
+            logSupport.log.info("Schedd %s snapshot: %i glideins for %i entries (%.1fs)" % (schedd_name, len(condorq.fetchStored()),
+                                                                                            len(schedd_entries[schedd_name]),
+                                                                                            time.time() - snapshot_time))
+        except:
+            # the entries will fall back to querying the schedd themselves
+            logSupport.log.exception("Failed to snapshot schedd %s: " % schedd_name)
+
+############################################################
+def write_group_work(work_dir, glideinDescript, entries):
+    """
+    Find the work requests of all the entries with a single collector query,
+    decrypt them once and write the per-entry work files
+    the entries will read instead of querying the collector themselves
+
+    @type work_dir: String 
+    @param work_dir: Where to write the work files
+    @type glideinDescript: glideFactoryConfig.GlideinDescript
+    @param glideinDescript: Factory config's glidein description object, provides the keys
+    @type entries: list
+    @param entries: names of the entries
+    """
+    pub_key_objs = [glideinDescript.data['PubKeyObj']]
+    if glideinDescript.data['OldPubKeyObj'] != None:
+        # still using the old key in this cycle
+        pub_key_objs.append(glideinDescript.data['OldPubKeyObj'])
+
+    try:
+        fetch_time = time.time()
+        group_work = glideFactoryInterface.findGroupWork(glideinDescript.data['FactoryName'],
+                                                         glideinDescript.data['GlideinName'],
+                                                         entries,
+                                                         glideFactoryLib.factoryConfig.supported_signtypes,
+                                                         pub_key_objs)
+        glideFactoryInterface.writeGroupWork(work_dir, group_work, fetch_time)
+        nr_tasks = 0
+        for entry_name in group_work.keys():
+            nr_tasks += len(group_work[entry_name])
+        logSupport.log.info("Found %i tasks for %i entries (%.1fs)" % (nr_tasks, len(entries), time.time() - fetch_time))
+        logSupport.log.info("Sym key cache: %s" % glideFactoryInterface.getSymKeyCacheStats())
+    except:
+        # the entries will fall back to querying the collector themselves
+        logSupport.log.exception("Failed to find work for the entries: ")
+
 ############################################################
 def is_crashing_often(startup_time, restart_interval, restart_attempts):
     crashing_often = True
@@ -204,6 +265,24 @@ def spawn(sleep_time, advertize_rate, startup_dir,
 
     factory_downtimes = glideFactoryDowntimeLib.DowntimeFile(glideinDescript.data['DowntimesFile'])
 
+    # group the entries by schedd, so that each schedd is queried only once per cycle
+    schedd_entries = {}
+    for entry_name in entries:
+        schedd_name = glideFactoryConfig.JobDescript(entry_name).data['Schedd']
+        if not schedd_entries.has_key(schedd_name):
+            schedd_entries[schedd_name] = []
+        schedd_entries[schedd_name].append(entry_name)
+    snapshot_dir = os.path.join(startup_dir, "schedd_snapshot")
+    if not os.path.isdir(snapshot_dir):
+        os.mkdir(snapshot_dir)
+    work_dir = os.path.join(startup_dir, "group_work")
+    if not os.path.isdir(work_dir):
+        os.mkdir(work_dir, 0700)
+    # the state is kept across restarts, so that they do not flood the schedds
+    limits_dir = os.path.join(startup_dir, "schedd_limits")
+    if not os.path.isdir(limits_dir):
+        os.mkdir(limits_dir)
+
     logSupport.log.info("Starting entries %s" % entries)
     try:
         for entry_name in entries:
@@ -278,6 +357,9 @@ def spawn(sleep_time, advertize_rate, startup_dir,
                 update_time = curr_time + remove_old_cred_freq
                 
             curr_time = time.time()
+
+            logSupport.log.info("Taking schedd snapshots for %s" % schedd_entries.keys())
+            write_schedd_snapshots(snapshot_dir, schedd_entries)
                                 
             logSupport.log.info("Checking for credentials %s" % entries)
     
@@ -295,6 +377,8 @@ def spawn(sleep_time, advertize_rate, startup_dir,
                 except:
                     logSupport.log.exception("Error occurred processing the globals classads: ")
 
+            logSupport.log.info("Finding work for entries %s" % entries)
+            write_group_work(work_dir, glideinDescript, entries)
             
             logSupport.log.info("Checking entries %s" % entries)
             for entry_name in childs.keys():
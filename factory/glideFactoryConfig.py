@@ -9,6 +9,7 @@ import string
 import os
 import os.path
 import shutil
+import configCache
 
 ############################################################
 #
@@ -39,6 +40,29 @@ factoryConfig=FactoryConfig()
 #
 ############################################################
 
+# Returns a dictionary from a file composed of
+#   NAME VAL
+def parse_config_file(fname,convert_function):
+    data={}
+    fd=open(fname,"r")
+    try:
+        lines=fd.readlines()
+        for line in lines:
+            if line[0]=="#":
+                continue # comment
+            if len(string.strip(line))==0:
+                continue # empty line
+            larr=string.split(line,None,1)
+            lname=larr[0]
+            if len(larr)==1:
+                lval=""
+            else:
+                lval=larr[1][:-1] #strip newline
+            exec("data['%s']=%s"%(lname,convert_function(lval)))
+    finally:
+        fd.close()
+    return data
+
 # loads a file composed of
 #   NAME VAL
 # and creates
@@ -51,24 +75,11 @@ class ConfigFile:
         self.load(config_file,convert_function)
 
     def load(self,fname,convert_function):
-        self.data={}
-        fd=open(fname,"r")
-        try:
-            lines=fd.readlines()
-            for line in lines:
-                if line[0]=="#":
-                    continue # comment
-                if len(string.strip(line))==0:
-                    continue # empty line
-                larr=string.split(line,None,1)
-                lname=larr[0]
-                if len(larr)==1:
-                    lval=""
-                else:
-                    lval=larr[1][:-1] #strip newline
-                exec("self.data['%s']=%s"%(lname,convert_function(lval)))
-        finally:
-            fd.close()
+        # the parsed files are cached, and read again only if changed
+        data=configCache.config_cache.get(fname,
+                                          lambda f:parse_config_file(f,convert_function),
+                                          configCache.func_key(convert_function))
+        self.data=data.copy()
 
     def has_key(self, key_name):
         return self.data.has_key(key_name)
@@ -376,20 +387,26 @@ class SignatureFile(ConfigFile):
                 line[2]_descript = line[1]
 
         """
-        self.data = {}
-        fd = open(fname,"r")
-        try:
-            lines = fd.readlines()
-            for line in lines:
-                if line[0] == "#":
-                    continue # comment
-                if len(string.strip(line)) == 0:
-                    continue # empty line
-                larr = string.split(line, None)
-                lsign = larr[0]
-                ldescript = larr[1]
-                lname = larr[2]
-                self.data["%s_sign" % str(lname)] = str(lsign)
-                self.data["%s_descript" % str(lname)] = str(ldescript)
-        finally:
-            fd.close()
+        data = configCache.config_cache.get(fname, parse_signature_file, 'signatures')
+        self.data = data.copy()
+
+# Returns the dictionary described in SignatureFile.load
+def parse_signature_file(fname):
+    data = {}
+    fd = open(fname,"r")
+    try:
+        lines = fd.readlines()
+        for line in lines:
+            if line[0] == "#":
+                continue # comment
+            if len(string.strip(line)) == 0:
+                continue # empty line
+            larr = string.split(line, None)
+            lsign = larr[0]
+            ldescript = larr[1]
+            lname = larr[2]
+            data["%s_sign" % str(lname)] = str(lsign)
+            data["%s_descript" % str(lname)] = str(ldescript)
+    finally:
+        fd.close()
+    return data
@@ -11,6 +11,7 @@ import binascii
 import traceback
 
 import glideFactoryLib
+import glideFactoryInterface
 import condorPrivsep
 import condorMonitor
 
@@ -200,7 +201,7 @@ def get_key_obj(pub_key_obj, classad):
     """
     if classad.has_key('ReqEncKeyCode'):
         try:
-            sym_key_obj = pub_key_obj.extract_sym_key(classad['ReqEncKeyCode'])
+            sym_key_obj = glideFactoryInterface.extract_sym_key(pub_key_obj, classad['ReqEncKeyCode'])
             return sym_key_obj
         except:
             tb = traceback.format_exception(sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2])
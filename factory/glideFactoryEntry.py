@@ -158,7 +158,7 @@ def perform_work(entry_name, condorQ,
     log_stats[credential_username+":"+client_int_name] = glideFactoryLogParser.dirSummaryTimingsOut(glideFactoryLib.factoryConfig.get_client_log_dir(entry_name, credential_username),
                                                                               logSupport.log_dir, client_int_name, credential_username)
     # should not need privsep for reading logs
-    log_stats[credential_username+":"+client_int_name].load()
+    load_log_stats(log_stats[credential_username+":"+client_int_name])
     glideFactoryLib.logStats(condorQ, client_int_name, client_security_name, credential_security_class)
     client_log_name = glideFactoryLib.secClass2Name(client_security_name, credential_security_class)
     glideFactoryLib.factoryConfig.log_stats.logSummary(client_log_name, log_stats) #@UndefinedVariable
@@ -190,6 +190,26 @@ def perform_work(entry_name, condorQ,
 
     return 0
 
+############################################################
+# Load the client condor logs, in parallel if configured so,
+# and log how long it took
+def load_log_stats(dir_summary):
+    dir_summary.load(nr_workers=glideFactoryLib.factoryConfig.log_parse_workers)
+    stats = dir_summary.load_stats
+    file_durations = stats['files']
+    if len(file_durations) == 0:
+        return
+    total_duration = 0.0
+    for fname in file_durations.keys():
+        total_duration += file_durations[fname]
+        logSupport.log.debug("Parsed %s in %.3fs" % (fname, file_durations[fname]))
+    if stats['nr_workers'] == 1:
+        # serial, there is no speedup to talk about
+        logSupport.log.debug("Parsed %i log files in %.3fs" % (len(file_durations), stats['duration']))
+        return
+    speedup = total_duration / max(stats['duration'], 0.001)
+    logSupport.log.info("Parsed %i log files in %.3fs using %i processes (%.3fs per file sum, speedup %.1f)" % (len(file_durations), stats['duration'], stats['nr_workers'], total_duration, speedup))
+
 ############################################################
 # only allow simple strings
 def is_str_safe(s):
@@ -266,7 +286,12 @@ def find_and_perform_work(in_downtime, glideinDescript, frontendDescript, jobDes
 
     # ===========  Get queue data for all clients  ==========
     try:
-        condorQ = glideFactoryLib.getCondorQData(entry_name, None, schedd_name)
+        # use the factory-wide snapshot if recent enough, else query the schedd
+        condorQ = glideFactoryLib.getCondorQSnapshotData(entry_name, schedd_name)
+        if condorQ != None:
+            logSupport.log.info("Using the factory snapshot of schedd %s" % schedd_name)
+        else:
+            condorQ = glideFactoryLib.getCondorQData(entry_name, None, schedd_name)
     except glideFactoryLib.condorExe.ExeError, e:
         logSupport.log.info("Schedd %s not responding, skipping" % schedd_name)
         logSupport.log.exception("getCondorQData failed:" )
@@ -300,6 +325,10 @@ def find_and_perform_work(in_downtime, glideinDescript, frontendDescript, jobDes
     
     # Initialize entry and frontend limit dicts
     glidein_totals = glideFactoryLib.GlideinTotals(entry_name, frontendDescript, jobDescript, condorQ)
+
+    # status of the glideins of each client:security_class, counted in a single pass
+    client_qc_status = glideFactoryLib.getQStatusGroups(condorQ, [glideFactoryLib.factoryConfig.client_schedd_attribute,
+                                                                  glideFactoryLib.factoryConfig.credential_secclass_schedd_attribute])
     
     if glidein_totals.has_entry_exceeded_max_idle():
         logSupport.log.warning("Entry %s has hit the limit for idle glideins, cannot submit any more" % entry_name)
@@ -315,40 +344,47 @@ def find_and_perform_work(in_downtime, glideinDescript, frontendDescript, jobDes
         
     # ===========  Finding work requests  ==========
     logSupport.log.info("Finding work")
-    # Find requests that we have the key to decrypt
-    additional_constraints = '((ReqPubKeyID=?="%s") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined))' % pub_key_obj.get_pub_key_id() 
-    #logSupport.log.info("Find work")
-    work = glideFactoryInterface.findWork(
-               glideFactoryLib.factoryConfig.factory_name,
-               glideFactoryLib.factoryConfig.glidein_name,
-               entry_name,
-               glideFactoryLib.factoryConfig.supported_signtypes,
-               pub_key_obj,additional_constraints)
-    
-    logSupport.log.info("Found %s tasks to work on using existing factory key." % len(work))
-
-    # If old key is valid, find the work using old key as well and append it
-    # to existing work dictionary
-    if (old_pub_key_obj != None):
-        work_oldkey = {}
-        # still using the old key in this cycle
-        logSupport.log.info("Old factory key is still valid. Trying to find work using old factory key.")
-        additional_constraints = '((ReqPubKeyID=?="%s") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined))' % old_pub_key_obj.get_pub_key_id() 
-        work_oldkey = glideFactoryInterface.findWork(
+    # use the work the factory found for all the entries, if recent enough
+    work = glideFactoryInterface.loadGroupWork(entry_name)
+    if work != None:
+        logSupport.log.info("Found %s tasks to work on in the factory work file." % len(work))
+    else:
+        # Find requests that we have the key to decrypt
+        additional_constraints = '((ReqPubKeyID=?="%s") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined))' % pub_key_obj.get_pub_key_id() 
+        #logSupport.log.info("Find work")
+        work = glideFactoryInterface.findWork(
                    glideFactoryLib.factoryConfig.factory_name,
-                   glideFactoryLib.factoryConfig.glidein_name, 
+                   glideFactoryLib.factoryConfig.glidein_name,
                    entry_name,
                    glideFactoryLib.factoryConfig.supported_signtypes,
-                   old_pub_key_obj,additional_constraints)
-        logSupport.log.info("Found %s tasks to work on using old factory key" % len(work_oldkey))
-
-        # Merge the work_oldkey with work
-        for w in work_oldkey.keys():
-            if work.has_key(w):
-                # This should not happen but still as a safeguard warn
-                logSupport.log.warning("Work task for %s exists using existing key and old key. Ignoring the work from old key." % w)
-                continue
-            work[w] = work_oldkey[w]
+                   pub_key_obj,additional_constraints)
+        
+        logSupport.log.info("Found %s tasks to work on using existing factory key." % len(work))
+
+        # If old key is valid, find the work using old key as well and append it
+        # to existing work dictionary
+        if (old_pub_key_obj != None):
+            work_oldkey = {}
+            # still using the old key in this cycle
+            logSupport.log.info("Old factory key is still valid. Trying to find work using old factory key.")
+            additional_constraints = '((ReqPubKeyID=?="%s") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined))' % old_pub_key_obj.get_pub_key_id() 
+            work_oldkey = glideFactoryInterface.findWork(
+                       glideFactoryLib.factoryConfig.factory_name,
+                       glideFactoryLib.factoryConfig.glidein_name, 
+                       entry_name,
+                       glideFactoryLib.factoryConfig.supported_signtypes,
+                       old_pub_key_obj,additional_constraints)
+            logSupport.log.info("Found %s tasks to work on using old factory key" % len(work_oldkey))
+
+            # Merge the work_oldkey with work
+            for w in work_oldkey.keys():
+                if work.has_key(w):
+                    # This should not happen but still as a safeguard warn
+                    logSupport.log.warning("Work task for %s exists using existing key and old key. Ignoring the work from old key." % w)
+                    continue
+                work[w] = work_oldkey[w]
+
+    logSupport.log.info("Sym key cache: %s" % glideFactoryInterface.getSymKeyCacheStats())
 
     if len(work.keys())==0:
         logSupport.log.info("No work found")
@@ -837,7 +873,7 @@ def find_and_perform_work(in_downtime, glideinDescript, frontendDescript, jobDes
                 log_stats[credential_username + ":" + client_int_name] = glideFactoryLogParser.dirSummaryTimingsOut(glideFactoryLib.factoryConfig.get_client_log_dir(entry_name, credential_username),
                                                                                           logSupport.log_dir, client_int_name, credential_username)
                 # should not need privsep for reading logs
-                log_stats[credential_username + ":" + client_int_name].load()
+                load_log_stats(log_stats[credential_username + ":" + client_int_name])
                                          
                 # Should log here or in perform_work
                 glideFactoryLib.logWorkRequest(client_int_name, client_security_name, submit_credentials.security_class,
@@ -846,7 +882,12 @@ def find_and_perform_work(in_downtime, glideinDescript, frontendDescript, jobDes
                 all_security_names.add((client_security_name, credential_security_class))
                 entry_condorQ = glideFactoryLib.getQProxSecClass(condorQ, client_int_name, submit_credentials.security_class)
                 
-                glideFactoryLib.logStats(entry_condorQ, client_int_name, client_security_name, submit_credentials.security_class) 
+                client_key = (client_int_name, submit_credentials.security_class)
+                if client_qc_status.has_key(client_key):
+                    qc_status = client_qc_status[client_key]
+                else:
+                    qc_status = {} # no glideins yet
+                glideFactoryLib.logStats(entry_condorQ, client_int_name, client_security_name, submit_credentials.security_class, qc_status)
                 client_log_name = glideFactoryLib.secClass2Name(client_security_name, submit_credentials.security_class)
                 glideFactoryLib.factoryConfig.log_stats.logSummary(client_log_name, log_stats) #@UndefinedVariable
 
@@ -1027,6 +1068,9 @@ def iterate_one(do_advertize,in_downtime,
     
     done_something=0
     jobAttributes.data['GLIDEIN_In_Downtime']=in_downtime
+
+    # prepare the submit environments again, once per cycle
+    glideFactoryLib.clear_submit_env_cache()
     
     
     # Process requests from the frontends
@@ -1239,6 +1283,26 @@ def main(parent_pid, sleep_time, advertize_rate, startup_dir, entry_name):
     glideFactoryLib.factoryConfig.max_releases = int(jobDescript.data['MaxReleaseRate'])
     glideFactoryLib.factoryConfig.release_sleep = float(jobDescript.data['ReleaseSleep'])
 
+    # the factory refreshes the schedd snapshot every sleep_time
+    glideFactoryLib.factoryConfig.schedd_snapshot_dir = os.path.join(startup_dir, "schedd_snapshot")
+    glideFactoryLib.factoryConfig.schedd_snapshot_max_age = 2 * sleep_time
+    # the schedd limits are shared by all the entries
+    # there is no limit on an action unless its rate is configured
+    glideFactoryLib.factoryConfig.schedd_limits_dir = os.path.join(startup_dir, "schedd_limits")
+    if glideinDescript.data.has_key('ScheddSubmitRate'):
+        glideFactoryLib.factoryConfig.schedd_submit_rate = float(glideinDescript.data['ScheddSubmitRate'])
+        glideFactoryLib.factoryConfig.schedd_submit_burst = int(glideinDescript.data['ScheddSubmitBurst'])
+        glideFactoryLib.factoryConfig.schedd_submit_target_latency = float(glideinDescript.data['ScheddSubmitTargetLatency'])
+    if glideinDescript.data.has_key('ScheddRemoveRate'):
+        glideFactoryLib.factoryConfig.schedd_remove_rate = float(glideinDescript.data['ScheddRemoveRate'])
+        glideFactoryLib.factoryConfig.schedd_remove_burst = int(glideinDescript.data['ScheddRemoveBurst'])
+    if glideinDescript.data.has_key('ScheddReleaseRate'):
+        glideFactoryLib.factoryConfig.schedd_release_rate = float(glideinDescript.data['ScheddReleaseRate'])
+        glideFactoryLib.factoryConfig.schedd_release_burst = int(glideinDescript.data['ScheddReleaseBurst'])
+    # and the work requests as well
+    glideFactoryInterface.factoryConfig.group_work_dir = os.path.join(startup_dir, "group_work")
+    glideFactoryInterface.factoryConfig.group_work_max_age = 2 * sleep_time
+
     logSupport.log.debug("Adding directory cleaners")
     cleaner = cleanupSupport.PrivsepDirCleanupWSpace(None, logSupport.log_dir,
                                       "(condor_activity_.*\.log\..*\.ftstpk)",
@@ -20,6 +20,7 @@ import time
 import string
 import logSupport
 import fcntl
+import cPickle
 
 ############################################################
 #
@@ -69,6 +70,8 @@ class FactoryConfig:
         self.advertise_use_tcp = False
         # Should we use the new -multiple for condor_advertise?
         self.advertise_use_multi = False
+        # Max condor_advertise commands running at the same time
+        self.advertise_max_parallel = 4
 
 
         # warning log files
@@ -78,6 +81,15 @@ class FactoryConfig:
         # Location of lock directory
         self.lock_dir = "."
 
+        # Where the factory writes the work found for each entry
+        # None means each entry queries the collector itself
+        self.group_work_dir = None
+        # Ignore work files older than this (in seconds)
+        self.group_work_max_age = 600
+
+        # How many sym keys extracted from the requests to remember
+        self.sym_key_cache_size = 1000
+
 
 # global configuration of the module
 factoryConfig = FactoryConfig()
@@ -99,6 +111,83 @@ class MultiExeError(condorExe.ExeError):
         
         condorExe.ExeError.__init__(self, error_str)
 
+############################################################
+#
+# Sym key cache
+#
+# Extracting the sym key from a request is an RSA decryption,
+# and the frontends keep using the same ReqEncKeyCode for many cycles
+#
+############################################################
+
+class SymKeyCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # (pub_key_id, enc_sym_key) -> [prev, next, key, sym_key_obj]
+        # the nodes form a circular list, least recently used first
+        self.data = {}
+        self.root = [None, None, None, None]
+        self.root[0] = self.root
+        self.root[1] = self.root
+
+    # same semantics as pub_key_obj.extract_sym_key
+    # failures are not cached
+    def extract_sym_key(self, pub_key_obj, enc_sym_key):
+        key = (pub_key_obj.get_pub_key_id(), enc_sym_key)
+        root = self.root
+        if self.data.has_key(key):
+            self.hits += 1
+            node = self.data[key]
+            # unlink and move to the most recently used end
+            node[0][1] = node[1]
+            node[1][0] = node[0]
+            last = root[0]
+            node[0] = last
+            node[1] = root
+            last[1] = node
+            root[0] = node
+            return node[3]
+
+        self.misses += 1
+        sym_key_obj = pub_key_obj.extract_sym_key(enc_sym_key)
+        if self.max_size <= 0:
+            return sym_key_obj # caching disabled
+
+        last = root[0]
+        node = [last, root, key, sym_key_obj]
+        last[1] = node
+        root[0] = node
+        self.data[key] = node
+        if len(self.data) > self.max_size:
+            # drop the least recently used one
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self.data[oldest[2]]
+        return sym_key_obj
+
+    def __len__(self):
+        return len(self.data)
+
+    def get_stats_str(self):
+        return "%i sym keys cached, %i hits, %i misses" % (len(self.data), self.hits, self.misses)
+
+# created on first use, so that the size can be configured
+sym_key_cache = None
+
+def extract_sym_key(pub_key_obj, enc_sym_key):
+    global factoryConfig, sym_key_cache
+    if sym_key_cache == None:
+        sym_key_cache = SymKeyCache(factoryConfig.sym_key_cache_size)
+    return sym_key_cache.extract_sym_key(pub_key_obj, enc_sym_key)
+
+def getSymKeyCacheStats():
+    if sym_key_cache == None:
+        return "sym key cache not used"
+    return sym_key_cache.get_stats_str()
+
 ############################################################
 #
 # User functions
@@ -169,74 +258,208 @@ def findWork(factory_name, glidein_name, entry_name,
 
     data = status.fetchStored()
 
-    reserved_names = ("ReqName", "ReqGlidein", "ClientName", "FrontendName", "GroupName", "ReqPubKeyID", "ReqEncKeyCode", "ReqEncIdentity", "AuthenticatedIdentity")
-
     out = {}
 
     # copy over requests and parameters
+    for k in data.keys():
+        el = decodeWorkRequest(k, data[k], pub_key_obj)
+        if el != None:
+            out[k] = el
+
+    return out
+
+def findGroupWork(factory_name, glidein_name, entry_names,
+                  supported_signtypes,
+                  pub_key_objs):
+    """
+    Find the request classAds of all the entries of the factory with a single collector query,
+    and decrypt them once.
+    Only requests encrypted with one of pub_key_objs are returned.
+
+    @type entry_names: list
+    @param entry_names: names of the factory entries
+    @type pub_key_objs: list
+    @param pub_key_objs: the factory keys in use (current and, if still valid, old)
+
+    @return: dictionary, each key is an entry name, each value is the dictionary findWork would return for that entry
+    """
+
+    global factoryConfig
+    logSupport.log.debug("Querying collector for requests of all entries")
+
+    req_glideins = []
+    for entry_name in entry_names:
+        req_glideins.append("%s@%s@%s" % (entry_name, glidein_name, factory_name))
+
+    key_objs = {}
+    for pub_key_obj in pub_key_objs:
+        key_objs[pub_key_obj.get_pub_key_id()] = pub_key_obj
+
+    status_constraint = '(GlideinMyType=?="%s") && stringListMember(ReqGlidein,"%s")' % (factoryConfig.client_id, string.join(req_glideins, ","))
+    status_constraint += ' && stringListMember(ReqPubKeyID,"%s") && (ReqEncKeyCode=!=Undefined) && (ReqEncIdentity=!=Undefined)' % string.join(key_objs.keys(), ",")
+
+    if supported_signtypes != None:
+        status_constraint += ' && stringListMember(%s%s,"%s")' % (factoryConfig.client_web_prefix, factoryConfig.client_web_signtype_suffix, string.join(supported_signtypes, ","))
+
+    status = condorMonitor.CondorStatus("any")
+    status.require_integrity(True) #important, this dictates what gets submitted
+    status.glidein_name = glidein_name
+    # single process doing the query, no need to serialize
+    status.load(status_constraint)
+
+    data = status.fetchStored()
+
+    out = {}
+    for entry_name in entry_names:
+        out[entry_name] = {}
+
     for k in data.keys():
         kel = data[k]
-        el = {"requests":{}, "web":{}, "params":{}, "params_decrypted":{}, "monitor":{}, "internals":{}}
-        for (key, prefix) in (("requests", factoryConfig.client_req_prefix),
-                             ("web", factoryConfig.client_web_prefix),
-                             ("params", factoryConfig.glidein_param_prefix),
-                             ("monitor", factoryConfig.glidein_monitor_prefix)):
-            plen = len(prefix)
-            for attr in kel.keys():
-                if attr in reserved_names:
-                    continue # skip reserved names
-                if attr[:plen] == prefix:
-                    el[key][attr[plen:]] = kel[attr]
-        if pub_key_obj != None:
-            if kel.has_key('ReqPubKeyID'):
-                try:
-                    sym_key_obj = pub_key_obj.extract_sym_key(kel['ReqEncKeyCode'])
-                except:
-                    continue # bad key, ignore entry
-            else:
-                sym_key_obj = None # no key used, will not decrypt
-        else:
-            sym_key_obj = None # have no key, will not decrypt
+        entry_name = string.split(kel['ReqGlidein'], '@')[0]
+        if not out.has_key(entry_name):
+            continue # should never happen, the constraint selects only my entries
+        if not key_objs.has_key(kel['ReqPubKeyID']):
+            continue # should never happen, the constraint selects only my keys
+        el = decodeWorkRequest(k, kel, key_objs[kel['ReqPubKeyID']])
+        if el != None:
+            out[entry_name][k] = el
+
+    return out
+
+def decodeWorkRequest(k, kel, pub_key_obj):
+    """
+    Convert a single request classAd into a work request.
 
-        if sym_key_obj != None:
-            # this is verifying that the identity that the client claims to be is the identity that Condor thinks it is
+    @type k: string
+    @param k: name of the request classAd
+    @type kel: dictionary
+    @param kel: request classAd
+    @type pub_key_obj: GlideinKey
+    @param pub_key_obj: key to use for decryption, can be None
+
+    @return: dictionary with 'requests', 'web', 'params', 'params_decrypted', 'monitor' and 'internals' keys, None if the request must be ignored
+    """
+
+    global factoryConfig
+
+    reserved_names = ("ReqName", "ReqGlidein", "ClientName", "FrontendName", "GroupName", "ReqPubKeyID", "ReqEncKeyCode", "ReqEncIdentity", "AuthenticatedIdentity")
+
+    el = {"requests":{}, "web":{}, "params":{}, "params_decrypted":{}, "monitor":{}, "internals":{}}
+    for (key, prefix) in (("requests", factoryConfig.client_req_prefix),
+                         ("web", factoryConfig.client_web_prefix),
+                         ("params", factoryConfig.glidein_param_prefix),
+                         ("monitor", factoryConfig.glidein_monitor_prefix)):
+        plen = len(prefix)
+        for attr in kel.keys():
+            if attr in reserved_names:
+                continue # skip reserved names
+            if attr[:plen] == prefix:
+                el[key][attr[plen:]] = kel[attr]
+    if pub_key_obj != None:
+        if kel.has_key('ReqPubKeyID'):
             try:
-                enc_identity = sym_key_obj.decrypt_hex(kel['ReqEncIdentity'])
+                sym_key_obj = extract_sym_key(pub_key_obj, kel['ReqEncKeyCode'])
             except:
-                logSupport.log.warning("Client %s provided invalid ReqEncIdentity, could not decode. Skipping for security reasons." % k)
-                continue # corrupted classad
-            if enc_identity != kel['AuthenticatedIdentity']:
-                logSupport.log.warning("Client %s provided invalid ReqEncIdentity(%s!=%s). Skipping for security reasons." % (k, enc_identity, kel['AuthenticatedIdentity']))
-                continue # uh oh... either the client is misconfigured, or someone is trying to cheat
-            
+                return None # bad key, ignore entry
+        else:
+            sym_key_obj = None # no key used, will not decrypt
+    else:
+        sym_key_obj = None # have no key, will not decrypt
 
-        invalid_classad = False
-        for (key, prefix) in (("params_decrypted", factoryConfig.encrypted_param_prefix),):
-            plen = len(prefix)
-            for attr in kel.keys():
-                if attr in reserved_names:
-                    continue # skip reserved names
-                if attr[:plen] == prefix:
-                    el[key][attr[plen:]] = None # define it even if I don't understand the content
-                    if sym_key_obj != None:
-                        try:
-                            el[key][attr[plen:]] = sym_key_obj.decrypt_hex(kel[attr])
-                        except:
-                            invalid_classad = True
-                            break # I don't understand it -> invalid
-        if invalid_classad:
-            logSupport.log.warning("At least one of the encrypted parameters for client %s cannot be decoded. Skipping for security reasons." % k)
-            continue # need to go this way as I may have problems in an inner loop
+    if sym_key_obj != None:
+        # this is verifying that the identity that the client claims to be is the identity that Condor thinks it is
+        try:
+            enc_identity = sym_key_obj.decrypt_hex(kel['ReqEncIdentity'])
+        except:
+            logSupport.log.warning("Client %s provided invalid ReqEncIdentity, could not decode. Skipping for security reasons." % k)
+            return None # corrupted classad
+        if enc_identity != kel['AuthenticatedIdentity']:
+            logSupport.log.warning("Client %s provided invalid ReqEncIdentity(%s!=%s). Skipping for security reasons." % (k, enc_identity, kel['AuthenticatedIdentity']))
+            return None # uh oh... either the client is misconfigured, or someone is trying to cheat
+
+    for (key, prefix) in (("params_decrypted", factoryConfig.encrypted_param_prefix),):
+        plen = len(prefix)
+        for attr in kel.keys():
+            if attr in reserved_names:
+                continue # skip reserved names
+            if attr[:plen] == prefix:
+                el[key][attr[plen:]] = None # define it even if I don't understand the content
+                if sym_key_obj != None:
+                    try:
+                        el[key][attr[plen:]] = sym_key_obj.decrypt_hex(kel[attr])
+                    except:
+                        # I don't understand it -> invalid
+                        logSupport.log.warning("At least one of the encrypted parameters for client %s cannot be decoded. Skipping for security reasons." % k)
+                        return None
+
+    for attr in kel.keys():
+        if attr in ("ClientName", "FrontendName", "GroupName", "ReqName", "LastHeardFrom", "ReqPubKeyID", "AuthenticatedIdentity"):
+            el["internals"][attr] = kel[attr]
+
+    return el
 
+############################################################
+#
+# Group work files
+#
+# The factory finds the work of all the entries (findGroupWork)
+# and hands it over to each entry through a file
+#
+############################################################
 
-        for attr in kel.keys():
-            if attr in ("ClientName", "FrontendName", "GroupName", "ReqName", "LastHeardFrom", "ReqPubKeyID", "AuthenticatedIdentity"):
-                el["internals"][attr] = kel[attr]
-        
-        out[k] = el
+GROUP_WORK_VERSION = 1
 
-    return out
+def writeGroupWork(work_dir, group_work, fetch_time):
+    """
+    Atomically write one work file per entry.
+    The files contain decrypted parameters, so only the owner can read them.
+
+    @type group_work: dictionary
+    @param group_work: as returned by findGroupWork
+    @type fetch_time: float
+    @param fetch_time: when the query was started
+    """
+    for entry_name in group_work.keys():
+        work_data = {'version':GROUP_WORK_VERSION,
+                     'time':fetch_time,
+                     'work':group_work[entry_name]}
+        fname = os.path.join(work_dir, "work_%s.pkl" % entry_name)
+        tmp_fname = "%s.tmp" % fname
+        if os.path.exists(tmp_fname):
+            os.unlink(tmp_fname) # left over, make sure the mode below is used
+        fd = os.fdopen(os.open(tmp_fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600), "wb")
+        try:
+            cPickle.dump(work_data, fd, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fd.close()
+        os.rename(tmp_fname, fname) # atomic, readers never see a partial file
+
+def loadGroupWork(entry_name):
+    """
+    Load the work the factory found for this entry.
+
+    @return: dictionary, same as findWork; None if not available or too old
+    """
+
+    global factoryConfig
+
+    if factoryConfig.group_work_dir == None:
+        return None # not enabled
 
+    fname = os.path.join(factoryConfig.group_work_dir, "work_%s.pkl" % entry_name)
+    try:
+        fd = open(fname, "rb")
+        try:
+            work_data = cPickle.load(fd)
+        finally:
+            fd.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+    if (type(work_data) != type({})) or (work_data.get('version') != GROUP_WORK_VERSION):
+        return None
+    if (time.time() - work_data['time']) > factoryConfig.group_work_max_age:
+        return None # the factory is not refreshing it
+    return work_data['work']
 
 ############################################################
 
@@ -492,21 +715,25 @@ class MultiAdvertizeGlideinClientMonitoring:
         
     # INTERNAL
     def do_advertize_iterate(self):
-        error_arr = []
-
         # get a 9 digit number that will stay 9 digit for the next 25 years
         short_time = time.time() - 1.05e9
-        tmpnam = "/tmp/gfi_agcm_%li_%li" % (short_time, os.getpid())
 
-        for el in self.client_data:
-            createGlideinClientMonitoringFile(tmpnam, self.factory_name, self.glidein_name, self.entry_name,
-                                              el['client_name'], el['client_int_name'], el['client_int_req'],
-                                              self.glidein_attrs, el['client_params'], el['client_monitors'])
-            try:
-                advertizeGlideinClientMonitoringFromFile(tmpnam, remove_file=True)
-            except condorExe.ExeError, e:
-                error_arr.append(e)
+        fname_list = []
+        try:
+            for el in self.client_data:
+                tmpnam = "/tmp/gfi_agcm_%li_%li_%i" % (short_time, os.getpid(), len(fname_list))
+                createGlideinClientMonitoringFile(tmpnam, self.factory_name, self.glidein_name, self.entry_name,
+                                                  el['client_name'], el['client_int_name'], el['client_int_req'],
+                                                  self.glidein_attrs, el['client_params'], el['client_monitors'])
+                fname_list.append(tmpnam)
+
+            # advertize them all in parallel
+            batch = exe_condor_advertise_batch(fname_list, "UPDATE_LICENSE_AD")
+        finally:
+            for fname in fname_list:
+                os.remove(fname)
 
+        error_arr = batch.get_errors()
         if len(error_arr) > 0:
             raise MultiExeError, error_arr
         
@@ -661,8 +888,24 @@ def deadvertizeFactoryClientMonitoring(factory_name, glidein_name):
 # these is a single Collector anyhow
 def exe_condor_advertise(fname, command,
                          is_multi=False):
+    batch = exe_condor_advertise_batch([fname], command, is_multi)
+    r = batch.results[0]
+    if r.error != None:
+        raise r.error
+    return r.output
+
+# Advertize all the files in fname_list, with at most
+# factoryConfig.advertise_max_parallel condor_advertise running at a time
+# Returns the condorExe.ExeBatch, with the results of each (keyed by fname)
+def exe_condor_advertise_batch(fname_list, command,
+                               is_multi=False):
     global factoryConfig
 
+    batch = condorExe.ExeBatch(max_per_target=factoryConfig.advertise_max_parallel)
+    for fname in fname_list:
+        batch.add(condorManager.condorAdvertiseCmd(fname, command, factoryConfig.advertise_use_tcp, is_multi),
+                  target="collector", key=fname)
+
     lock_fname=os.path.join(factoryConfig.lock_dir,"gfi_advertize.lock")
     if not os.path.exists(lock_fname): #create a lock file if needed
         try:
@@ -676,12 +919,12 @@ def exe_condor_advertise(fname, command,
     try:
         fcntl.flock(fd,fcntl.LOCK_EX)
         try:
-            ret = condorManager.condorAdvertise(fname, command, factoryConfig.advertise_use_tcp, is_multi)
+            batch.run()
         finally:
             fcntl.flock(fd,fcntl.LOCK_UN)
     finally:
         fd.close()
 
-    return ret
+    return batch
     
 
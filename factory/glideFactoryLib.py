@@ -25,10 +25,12 @@ import logSupport
 import condorMonitor
 import condorManager
 import glideFactoryConfig
+import tokenBucket
 import base64
 import string
 import timeConversion
 import traceback
+import cPickle
 
 
 from tarSupport import GlideinTar
@@ -85,6 +87,40 @@ class FactoryConfig:
         self.max_removes = 5
         self.max_releases = 20
 
+        # Max jobs acted upon by a single condor_rm/condor_release
+        self.max_bulk_chunk = 100
+        # Max condor_submit running at the same time against a schedd
+        self.max_parallel_submits = 4
+
+        # Processes parsing the client condor logs of an entry
+        # 1 parses them serially; the entries already run in parallel,
+        # so raise it only if there are many more cores than entries
+        # (None means one per core)
+        self.log_parse_workers = 1
+
+        # Factory-wide limits per schedd, shared by all the entries
+        # The state is kept in this directory; if None, there are no shared limits
+        self.schedd_limits_dir = None
+        # glideins per second, and max burst
+        # a rate of None means no limit for that action (the default)
+        self.schedd_submit_rate = None
+        self.schedd_submit_burst = 200
+        self.schedd_remove_rate = None
+        self.schedd_remove_burst = 500
+        self.schedd_release_rate = None
+        self.schedd_release_burst = 500
+        # the submit rate is reduced when condor_submit takes longer than this (in seconds)
+        self.schedd_submit_target_latency = 10.0
+
+        # Shared schedd snapshot, written by the factory and read by the entries
+        # If None, the entries will always query the schedd themselves
+        self.schedd_snapshot_dir = None
+        # Snapshots older than this (in seconds) are ignored
+        self.schedd_snapshot_max_age = 600
+        # Time of the last submit/remove/release done by this process
+        # Snapshots taken before it are ignored, since they do not reflect it
+        self.last_queue_change = 0
+
         # monitoring objects
         # create them for the logging to occur
         self.client_internals = None
@@ -167,29 +203,95 @@ def getCondorQData(entry_name,
     else:
         client_constraint = ' && (%s =?= "%s")' % (factoryConfig.client_schedd_attribute, client_name)
 
-    q_glidein_constraint = '(%s =?= "%s") && (%s =?= "%s") && (%s =?= "%s")%s && (%s =!= UNDEFINED)' % \
-        (factoryConfig.factory_schedd_attribute,
-         factoryConfig.factory_name,
-         factoryConfig.glidein_schedd_attribute,
-         factoryConfig.glidein_name,
+    q_glidein_constraint = '%s && (%s =?= "%s")%s' % \
+        (get_glidein_constraint(),
          factoryConfig.entry_schedd_attribute,
          entry_name,
-         client_constraint,
-         factoryConfig.credential_id_schedd_attribute)
-    q_glidein_format_list = [("JobStatus", "i"), ("GridJobStatus", "s"), ("ServerTime", "i"), ("EnteredCurrentStatus", "i"),
-                             (factoryConfig.credential_id_schedd_attribute, "s"), ("HoldReasonCode", "i"), ("HoldReasonSubCode", "i"),
-                             (factoryConfig.frontend_name_attribute, "s"),
-                             (factoryConfig.client_schedd_attribute, "s"),
-                             (factoryConfig.credential_secclass_schedd_attribute, "s")]
+         client_constraint)
+
+    q = new_entry_condorq(entry_name, client_name, schedd_name)
+    q.load(q_glidein_constraint, get_glidein_format_list())
+    return q
+
+def getCondorQSnapshotData(entry_name, schedd_name):
+    """
+    Same as getCondorQData(entry_name, None, schedd_name),
+    but use the entry slice of the shared schedd snapshot written by the factory.
+
+    Returns None if the snapshot is disabled, missing, too old,
+    or older than the last change this process did to the queue.
+    In that case, the caller should fall back to getCondorQData.
+    """
+
+    global factoryConfig
+
+    if factoryConfig.schedd_snapshot_dir == None:
+        return None
+
+    snapshot = load_schedd_snapshot(os.path.join(factoryConfig.schedd_snapshot_dir, "entry_%s.pkl" % entry_name))
+    if snapshot == None:
+        return None
+    if ((snapshot['schedd'] != schedd_name) or
+        (snapshot['time'] < factoryConfig.last_queue_change) or
+        ((time.time() - snapshot['time']) > factoryConfig.schedd_snapshot_max_age)):
+        return None
+
+    q = new_entry_condorq(entry_name, None, schedd_name)
+    q.stored_data = snapshot['data']
+    return q
+
+def getCondorQFactoryData(schedd_name):
+    """ 
+    Get Condor data for all the entries of this factory using schedd_name
+    Used by the factory to create the shared schedd snapshot
+    """
+
+    global factoryConfig
+
+    q_glidein_format_list = get_glidein_format_list() + [(factoryConfig.entry_schedd_attribute, "s")]
 
     q = condorMonitor.CondorQ(schedd_name)
-    q.factory_name = factoryConfig.factory_name
-    q.glidein_name = factoryConfig.glidein_name
-    q.entry_name = entry_name
-    q.client_name = client_name
-    q.load(q_glidein_constraint, q_glidein_format_list)
+    q.load(get_glidein_constraint(), q_glidein_format_list)
     return q
 
+def writeCondorQSnapshot(snapshot_dir, schedd_name, entry_names, condorq, snapshot_time):
+    """
+    Split the output of getCondorQFactoryData by entry,
+    and atomically write one snapshot file per entry.
+    Entries without glideins get an empty one.
+
+    @type snapshot_time: float
+    @param snapshot_time: when the query was started
+    """
+
+    global factoryConfig
+
+    entry_data = {}
+    for entry_name in entry_names:
+        entry_data[entry_name] = {}
+    data = condorq.fetchStored()
+    for k in data.keys():
+        el = data[k]
+        if el.has_key(factoryConfig.entry_schedd_attribute):
+            entry_name = el[factoryConfig.entry_schedd_attribute]
+            if entry_data.has_key(entry_name):
+                del el[factoryConfig.entry_schedd_attribute]
+                entry_data[entry_name][k] = el
+
+    for entry_name in entry_names:
+        snapshot = {'version':SCHEDD_SNAPSHOT_VERSION,
+                    'schedd':schedd_name,
+                    'time':snapshot_time,
+                    'data':entry_data[entry_name]}
+        fname = os.path.join(snapshot_dir, "entry_%s.pkl" % entry_name)
+        tmp_fname = "%s.tmp" % fname
+        fd = open(tmp_fname, "wb")
+        try:
+            cPickle.dump(snapshot, fd, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fd.close()
+        os.rename(tmp_fname, fname) # atomic, readers never see a partial file
+
 def getCondorQCredentialList():
     """ 
     Returns a list of all currently used proxies based on the glideins in the queue.
@@ -240,13 +342,13 @@ def getQProxSecClass(condorq, client_name, proxy_security_class,
     else:
         xsa_str = credential_secclass_schedd_attribute
 
-    entry_condorQ = condorMonitor.SubQuery(condorq, lambda d:(d.has_key(csa_str) and (d[csa_str] == client_name) and
-                                                           d.has_key(xsa_str) and (d[xsa_str] == proxy_security_class)))
+    entry_condorQ = condorMonitor.IndexedSubQuery(condorq, [csa_str, xsa_str], [client_name, proxy_security_class])
     entry_condorQ.schedd_name = condorq.schedd_name
     entry_condorQ.factory_name = condorq.factory_name
     entry_condorQ.glidein_name = condorq.glidein_name
     entry_condorQ.entry_name = condorq.entry_name
     entry_condorQ.client_name = condorq.client_name
+    entry_condorQ.index_on([factoryConfig.credential_id_schedd_attribute])
     entry_condorQ.load()
     return entry_condorQ
 
@@ -254,6 +356,13 @@ def getQStatus(condorq):
     qc_status = condorMonitor.Summarize(condorq, hash_status).countStored()
     return qc_status
 
+# Same as getQStatus, for each set of values of group_attrs,
+# in a single pass over the queue
+# Returns a dictionary of group values (tuples if more than one attr) -> qc_status
+def getQStatusGroups(condorq, group_attrs):
+    qc_status_groups = condorMonitor.Summarize(condorq, hash_status).countStoredGroups(group_attrs)
+    return qc_status_groups
+
 def getQStatusStale(condorq):
     qc_status = condorMonitor.Summarize(condorq, hash_statusStale).countStored()
     return qc_status
@@ -434,7 +543,7 @@ def keepIdleGlideins(client_condorq, client_int_name,
 
     # Filter out everything but the proper credential identifier.  Need to determine how many more glideins are needed to match this
     #    request min_idle and max_glidiens
-    condorq = condorMonitor.SubQuery(client_condorq, lambda d:(d[factoryConfig.credential_id_schedd_attribute] == submit_credentials.id))
+    condorq = condorMonitor.IndexedSubQuery(client_condorq, [factoryConfig.credential_id_schedd_attribute], [submit_credentials.id])
     condorq.schedd_name = client_condorq.schedd_name
     condorq.factory_name = client_condorq.factory_name
     condorq.glidein_name = client_condorq.glidein_name
@@ -507,9 +616,10 @@ def keepIdleGlideins(client_condorq, client_int_name,
 
     try:
         logSupport.log.debug("Submitting %i glideins" % add_glideins)
-        submitGlideins(condorq.entry_name, client_int_name, add_glideins, frontend_name, submit_credentials, client_web, params)
-        glidein_totals.add_idle_glideins(add_glideins, frontend_name)
-        return add_glideins # exit, some submitted
+        # the schedd limits may let fewer be submitted
+        nr_submitted = len(submitGlideins(condorq.entry_name, client_int_name, add_glideins, frontend_name, submit_credentials, client_web, params))
+        glidein_totals.add_idle_glideins(nr_submitted, frontend_name)
+        return nr_submitted # exit, some submitted
     except RuntimeError, e:
         logSupport.log.warning("%s" % e)
         return 0 # something is wrong... assume 0 and exit
@@ -666,14 +776,19 @@ def sanitizeGlideins(condorq):
 
     return
 
-def logStats(condorq, client_int_name, client_security_name, proxy_security_class):
+# qc_status - if not None, the status of the glideins in condorq, as returned by getQStatus
+#             (e.g. from getQStatusGroups), so that the queue is not scanned again
+def logStats(condorq, client_int_name, client_security_name, proxy_security_class, qc_status=None):
     global factoryConfig
     #
     # First check if we have enough glideins in the queue
     #
 
     # Count glideins by status
-    qc_status = getQStatus(condorq)
+    if qc_status == None:
+        qc_status = getQStatus(condorq)
+    else:
+        qc_status = qc_status.copy() # will be changed by sum_idle_count
     sum_idle_count(qc_status)
     
     
@@ -716,6 +831,58 @@ def logWorkRequest(client_int_name, client_security_name, proxy_security_class,
 #condor_status_strings = {0:"Wait",1:"Idle", 2:"Running", 3:"Removed", 4:"Completed", 5:"Held", 6:"Suspended", 7:"Assigned"}
 #myvm_status_strings = {-1:"Unclaimed}
 
+#
+# Entry queue helpers
+#
+
+def get_glidein_constraint():
+    global factoryConfig
+    return '(%s =?= "%s") && (%s =?= "%s") && (%s =!= UNDEFINED)' % \
+        (factoryConfig.factory_schedd_attribute,
+         factoryConfig.factory_name,
+         factoryConfig.glidein_schedd_attribute,
+         factoryConfig.glidein_name,
+         factoryConfig.credential_id_schedd_attribute)
+
+def get_glidein_format_list():
+    global factoryConfig
+    return [("JobStatus", "i"), ("GridJobStatus", "s"), ("ServerTime", "i"), ("EnteredCurrentStatus", "i"),
+            (factoryConfig.credential_id_schedd_attribute, "s"), ("HoldReasonCode", "i"), ("HoldReasonSubCode", "i"),
+            (factoryConfig.frontend_name_attribute, "s"),
+            (factoryConfig.client_schedd_attribute, "s"),
+            (factoryConfig.credential_secclass_schedd_attribute, "s")]
+
+# create an empty CondorQ object, as used by the entry
+def new_entry_condorq(entry_name, client_name, schedd_name):
+    global factoryConfig
+    q = condorMonitor.CondorQ(schedd_name)
+    q.factory_name = factoryConfig.factory_name
+    q.glidein_name = factoryConfig.glidein_name
+    q.entry_name = entry_name
+    q.client_name = client_name
+    # the entry queue is narrowed by frontend and by client:security class
+    # many times per cycle, so keep it indexed
+    q.index_on([factoryConfig.frontend_name_attribute])
+    q.index_on([factoryConfig.client_schedd_attribute, factoryConfig.credential_secclass_schedd_attribute])
+    return q
+
+# Bump it every time the content of the snapshot changes
+SCHEDD_SNAPSHOT_VERSION = 1
+
+# Returns None if not there or not compatible
+def load_schedd_snapshot(fname):
+    try:
+        fd = open(fname, "rb")
+        try:
+            snapshot = cPickle.load(fd)
+        finally:
+            fd.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+    if (type(snapshot) != type({})) or (snapshot.get('version') != SCHEDD_SNAPSHOT_VERSION):
+        return None
+    return snapshot
+
 #
 # Hash functions
 #
@@ -956,33 +1123,39 @@ def submitGlideins(entry_name, client_name, nr_glideins, frontend_name,
     submitted_jids = []
 
     try:
-        exe_env = get_submit_environment(entry_name, client_name, submit_credentials, client_web, params)
+        exe_env = get_cached_submit_environment(entry_name, client_name, submit_credentials, client_web, params)
     except Exception, e:
-        msg = "Failed to setup execution environment.  Error:" % str(e)
+        msg = "Failed to setup execution environment.  Error: %s" % str(e)
         logSupport.log.error(msg)
         raise RuntimeError, msg
 
-    try:
-        nr_submitted = 0
-        while (nr_submitted < nr_glideins):
-            if nr_submitted != 0:
-                time.sleep(factoryConfig.submit_sleep)
+    # ask the factory-wide scheduler
+    nr_glideins = request_schedd_capacity("submit", schedd, nr_glideins)
 
-            nr_to_submit = (nr_glideins - nr_submitted)
-            if nr_to_submit > factoryConfig.max_cluster_size:
-                nr_to_submit = factoryConfig.max_cluster_size
+    # split in clusters
+    cluster_sizes = []
+    nr_left = nr_glideins
+    while nr_left > 0:
+        nr_to_submit = min(nr_left, factoryConfig.max_cluster_size)
+        cluster_sizes.append(nr_to_submit)
+        nr_left -= nr_to_submit
 
-            exe_env.append('GLIDEIN_COUNT=%s' % nr_to_submit)
-            exe_env.append('GLIDEIN_FRONTEND_NAME=%s' % frontend_name)
+    try:
+        # check to see if the username for the proxy is the same as the factory username
+        if username != MY_USERNAME:
+            # no? use privsep, one cluster at a time
+            for i in range(len(cluster_sizes)):
+                if i != 0:
+                    time.sleep(factoryConfig.submit_sleep)
+
+                cluster_env = exe_env + ['GLIDEIN_COUNT=%s' % cluster_sizes[i],
+                                         'GLIDEIN_FRONTEND_NAME=%s' % frontend_name]
 
-            # check to see if the username for the proxy is the same as the factory username
-            if username != MY_USERNAME:
-                # no? use privsep
                 # need to push all the relevant env variables through
                 for var in os.environ.keys():
                     if ((var in ('PATH', 'LD_LIBRARY_PATH', 'X509_CERT_DIR')) or (var[:8] == '_CONDOR_') or (var[:7] == 'CONDOR_')):
                         if os.environ.has_key(var):
-                            exe_env.append('%s=%s' % (var, os.environ[var]))
+                            cluster_env.append('%s=%s' % (var, os.environ[var]))
                 try:
                     args = ["condor_submit", "-name", schedd, "entry_%s/job.condor" % entry_name]
 
@@ -992,10 +1165,12 @@ def submitGlideins(entry_name, client_name, nr_glideins, frontend_name,
                           "   command: condor_submit\n" \
                           "   args: %s\n" \
                           "   exe_env: %s\n" \
-                          "" % (username, factoryConfig.submit_dir, str(args), str(exe_env))
+                          "" % (username, factoryConfig.submit_dir, str(args), str(cluster_env))
                     logSupport.log.debug(msg)
 
-                    submit_out = condorPrivsep.condor_execute(username, factoryConfig.submit_dir, "condor_submit", args, env=exe_env)
+                    start_time = time.time()
+                    submit_out = condorPrivsep.condor_execute(username, factoryConfig.submit_dir, "condor_submit", args, env=cluster_env)
+                    report_schedd_latency("submit", schedd, time.time() - start_time)
                 except condorPrivsep.ExeError, e:
                     submit_out = []
                     msg = "condor_submit failed (user %s): %s" % (username, str(e))
@@ -1008,31 +1183,107 @@ def submitGlideins(entry_name, client_name, nr_glideins, frontend_name,
                     logSupport.log.error(msg)
                     logSupport.log.warning(msg)
                     raise RuntimeError, msg
-            else:
-                # avoid using privsep, if possible
+
+                cluster, count = extractJobId(submit_out)
+                for j in range(count):
+                    submitted_jids.append((cluster, j))
+        else:
+            # avoid using privsep, if possible
+            # and submit the clusters in parallel, passing the env directly
+            batch = condorExe.ExeBatch(max_per_target=factoryConfig.max_parallel_submits)
+            for nr_to_submit in cluster_sizes:
+                cluster_env = env_list2dict(exe_env + ['GLIDEIN_COUNT=%s' % nr_to_submit,
+                                                       'GLIDEIN_FRONTEND_NAME=%s' % frontend_name])
+                cmd = condorExe.get_exe_cmd("condor_submit", ["-name", schedd, "entry_%s/job.condor" % entry_name])
+                batch.add(condorExe.ExeCmd(cmd, env=cluster_env), target=schedd)
+            batch.run()
+
+            error_arr = []
+            for r in batch.results:
+                if r.duration != None:
+                    report_schedd_latency("submit", schedd, r.duration)
                 try:
-                    env = "; ".join(exe_env)
-                    submit_out = condorExe.iexe_cmd("%s; condor_submit -name %s entry_%s/job.condor" % (env, schedd, entry_name))
+                    if r.error != None:
+                        raise r.error
+                    cluster, count = extractJobId(r.output)
+                    for j in range(count):
+                        submitted_jids.append((cluster, j))
                 except condorExe.ExeError, e:
-                    submit_out = []
-                    msg = "condor_submit failed: %s" % str(e)
-                    logSupport.log.error(msg)
-                    raise RuntimeError, msg
-                except Exception, e:
-                    submit_out = []
-                    msg = "condor_submit failed: Unknown error: %s" % str(e)
-                    logSupport.log.error(msg)
-                    raise RuntimeError, msg
-
-
-            cluster, count = extractJobId(submit_out)
-            for j in range(count):
-                submitted_jids.append((cluster, j))
-            nr_submitted += count
+                    error_arr.append(str(e))
+            if len(error_arr) > 0:
+                msg = "condor_submit failed %i times: %s" % (len(error_arr), string.join(error_arr, "\n"))
+                logSupport.log.error(msg)
+                raise RuntimeError, msg
     finally:
+        # give back the capacity not used
+        release_schedd_capacity("submit", schedd, nr_glideins - len(submitted_jids))
+
         # write out no matter what
+        if len(submitted_jids) > 0:
+            factoryConfig.last_queue_change = time.time()
         logSupport.log.info("Submitted %i glideins to %s: %s" % (len(submitted_jids), schedd, submitted_jids))
 
+    return submitted_jids
+
+############################################################
+#
+# Factory-wide scheduler
+# The entries sharing a schedd draw the submit/remove/release
+# capacity from the same token bucket (see tokenBucket)
+#
+############################################################
+
+# Returns the bucket for action ("submit", "remove" or "release")
+# on schedd_name, or None if there is no shared limit for it
+def get_schedd_bucket(action, schedd_name):
+    if factoryConfig.schedd_limits_dir == None:
+        return None
+    target_latency = None
+    if action == "submit":
+        rate = factoryConfig.schedd_submit_rate
+        burst = factoryConfig.schedd_submit_burst
+        target_latency = factoryConfig.schedd_submit_target_latency
+    elif action == "remove":
+        rate = factoryConfig.schedd_remove_rate
+        burst = factoryConfig.schedd_remove_burst
+    elif action == "release":
+        rate = factoryConfig.schedd_release_rate
+        burst = factoryConfig.schedd_release_burst
+    else:
+        raise ValueError, "Unknown schedd action %s" % action
+    if rate == None:
+        return None
+    fname = os.path.join(factoryConfig.schedd_limits_dir, "%s_%s" % (action, schedd_name.replace('/', '_')))
+    return tokenBucket.SharedTokenBucket(fname, rate, burst, target_latency)
+
+# Returns how many of the nr glideins can be acted upon now
+def request_schedd_capacity(action, schedd_name, nr):
+    bucket = get_schedd_bucket(action, schedd_name)
+    if (bucket == None) or (nr <= 0):
+        return nr
+    granted = bucket.acquire(nr)
+    if granted < nr:
+        logSupport.log.info("Schedd %s busy, %s limited to %i of %i glideins" % (schedd_name, action, granted, nr))
+    return granted
+
+def release_schedd_capacity(action, schedd_name, nr):
+    bucket = get_schedd_bucket(action, schedd_name)
+    if (bucket != None) and (nr > 0):
+        bucket.release(nr)
+
+def report_schedd_latency(action, schedd_name, latency):
+    bucket = get_schedd_bucket(action, schedd_name)
+    if bucket != None:
+        bucket.report_latency(latency)
+
+# ['key=val',...] -> {key:val}
+def env_list2dict(env_list):
+    env = {}
+    for el in env_list:
+        k, v = el.split('=', 1)
+        env[k] = v
+    return env
+
 # remove the glideins in the list
 def removeGlideins(schedd_name, jid_list, force=False):
     ####
@@ -1043,36 +1294,31 @@ def removeGlideins(schedd_name, jid_list, force=False):
 
     global factoryConfig
 
-    removed_jids = []
-
-    is_not_first = 0
-    for jid in jid_list:
-
-        # Respect the max_removes limit and exit right away if required
-        if len(removed_jids) >= factoryConfig.max_removes:
-            break # limit reached, stop
-
-        if is_not_first:
-            is_not_first = 1
-            time.sleep(factoryConfig.remove_sleep)
-
-        try:
-            condorManager.condorRemoveOne("%li.%li" % (jid[0], jid[1]), schedd_name)
-            removed_jids.append(jid)
-
-            # Force the removal if requested
-            if force == True:
-                try:
-                    logSupport.log.info("Forcing the removal of glideins in X state")
-                    condorManager.condorRemoveOne("%li.%li" % (jid[0], jid[1]), schedd_name, do_forcex=True)
-                except condorExe.ExeError, e:
-                    logSupport.log.warning("Forcing the removal of glideins in %s.%s state failed" % (jid[0], jid[1]))
-
-        except condorExe.ExeError, e:
-            # silently ignore errors, and try next one
-            logSupport.log.warning("removeGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], e))
-
-
+    # Respect the max_removes limit, and the factory-wide one
+    jid_list = jid_list[:factoryConfig.max_removes]
+    jid_list = jid_list[:request_schedd_capacity("remove", schedd_name, len(jid_list))]
+
+    removed_ids, errors = condorManager.condorRemoveList(jids2ids(jid_list), schedd_name,
+                                                        max_chunk=factoryConfig.max_bulk_chunk,
+                                                        sleep_time=factoryConfig.remove_sleep)
+    for e in errors:
+        # silently ignore errors
+        logSupport.log.warning("removeGlideins(%s): %s" % (schedd_name, e))
+    removed_jids = ids2jids(removed_ids, jid_list)
+    # give back the capacity of the ones that failed
+    release_schedd_capacity("remove", schedd_name, len(jid_list) - len(removed_jids))
+
+    # Force the removal if requested
+    if force and (len(removed_ids) > 0):
+        logSupport.log.info("Forcing the removal of glideins in X state")
+        forced_ids, errors = condorManager.condorRemoveList(removed_ids, schedd_name, do_forcex=True,
+                                                           max_chunk=factoryConfig.max_bulk_chunk,
+                                                           sleep_time=factoryConfig.remove_sleep)
+        for e in errors:
+            logSupport.log.warning("Forcing the removal of glideins in X state failed: %s" % e)
+
+    if len(removed_jids) > 0:
+        factoryConfig.last_queue_change = time.time()
     logSupport.log.info("Removed %i glideins on %s: %s" % (len(removed_jids), schedd_name, removed_jids))
 
 # release the glideins in the list
@@ -1085,22 +1331,65 @@ def releaseGlideins(schedd_name, jid_list):
 
     global factoryConfig
 
-    released_jids = []
+    # Respect the max_releases limit, and the factory-wide one
+    jid_list = jid_list[:factoryConfig.max_releases]
+    jid_list = jid_list[:request_schedd_capacity("release", schedd_name, len(jid_list))]
+
+    released_ids, errors = condorManager.condorReleaseList(jids2ids(jid_list), schedd_name,
+                                                           max_chunk=factoryConfig.max_bulk_chunk,
+                                                           sleep_time=factoryConfig.release_sleep)
+    for e in errors:
+        logSupport.log.warning("releaseGlideins(%s): %s" % (schedd_name, e))
+    released_jids = ids2jids(released_ids, jid_list)
+    # give back the capacity of the ones that failed
+    release_schedd_capacity("release", schedd_name, len(jid_list) - len(released_jids))
+
+    if len(released_jids) > 0:
+        factoryConfig.last_queue_change = time.time()
+    logSupport.log.info("Released %i glideins on %s: %s" % (len(released_jids), schedd_name, released_jids))
 
-    is_not_first = 0
+# (cluster,proc) -> "cluster.proc"
+def jids2ids(jid_list):
+    id_list = []
     for jid in jid_list:
-        if is_not_first:
-            is_not_first = 1
-            time.sleep(factoryConfig.release_sleep)
-        try:
-            condorManager.condorReleaseOne("%li.%li" % (jid[0], jid[1]), schedd_name)
-            released_jids.append(jid)
-        except condorExe.ExeError, e:
-            logSupport.log.warning("releaseGlidein(%s,%li.%li): %s" % (schedd_name, jid[0], jid[1], e))
+        id_list.append("%li.%li" % (jid[0], jid[1]))
+    return id_list
+
+# the elements of jid_list found in id_list
+def ids2jids(id_list, jid_list):
+    id_dict = {}
+    for el in id_list:
+        id_dict[el] = True
+    out_list = []
+    for jid in jid_list:
+        if id_dict.has_key("%li.%li" % (jid[0], jid[1])):
+            out_list.append(jid)
+    return out_list
 
-        if len(released_jids) >= factoryConfig.max_releases:
-            break # limit reached, stop
-    logSupport.log.info("Released %i glideins on %s: %s" % (len(released_jids), schedd_name, released_jids))
+# The submit environment does not change during a cycle,
+# so it is prepared only once per (entry, client, credential)
+# Keys are (entry_name, client_name, credential id, client args and params)
+submit_env_cache = {}
+
+# to be called at the beginning of each cycle
+def clear_submit_env_cache():
+    submit_env_cache.clear()
+
+# Same as get_submit_environment, but cached for the cycle
+# Returns a new list, so the caller can extend it
+def get_cached_submit_environment(entry_name, client_name, submit_credentials, client_web, params):
+    client_args = None
+    if client_web != None:
+        client_args = tuple(client_web.get_glidein_args())
+    params_list = params.items()
+    params_list.sort()
+    key = (entry_name, client_name, submit_credentials.id, client_args, tuple(params_list))
+    if not submit_env_cache.has_key(key):
+        exe_env = get_submit_environment(entry_name, client_name, submit_credentials, client_web, params)
+        if exe_env == None:
+            raise RuntimeError, "Could not create the submit environment"
+        submit_env_cache[key] = exe_env
+    return list(submit_env_cache[key])
 
 def get_submit_environment(entry_name, client_name, submit_credentials, client_web, params):
     try:
@@ -1395,18 +1684,16 @@ class GlideinTotals:
                 el_list = el.split(";")
                 self.frontend_limits[el_list[0]]['max_held'] = int(el_list[1])
 
+        # Count the glideins by status for all frontend:security_class (GLIDEIN_FRONTEND_NAME)
+        # in a single pass
+        fe_qc_status = getQStatusGroups(entry_condorQ, [factoryConfig.frontend_name_attribute])
+
         # Initialize frontend totals
         for fe_sec_class in self.frontend_limits:
-            # Filter the queue for all glideins for this frontend:security_class (GLIDEIN_FRONTEND_NAME)
-            fe_condorQ = condorMonitor.SubQuery(entry_condorQ, lambda d:(d[factoryConfig.frontend_name_attribute] == fe_sec_class))
-            fe_condorQ.schedd_name = entry_condorQ.schedd_name
-            fe_condorQ.factory_name = entry_condorQ.factory_name
-            fe_condorQ.glidein_name = entry_condorQ.glidein_name
-            fe_condorQ.entry_name = entry_condorQ.entry_name
-            fe_condorQ.load()
-
-            # Count glideins by status
-            qc_status = getQStatus(fe_condorQ)
+            if fe_qc_status.has_key(fe_sec_class):
+                qc_status = fe_qc_status[fe_sec_class]
+            else:
+                qc_status = {} # no glideins for this frontend
             fe_running = 0
             fe_held = 0
             fe_idle = 0
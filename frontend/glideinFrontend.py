@@ -35,6 +35,8 @@ import glideinFrontendPidLib
 import glideinFrontendConfig
 import glideinFrontendMonitorAggregator
 import glideinFrontendMonitoring
+import glideinFrontendLib
+import condorMonitor
 
 ############################################################
 # KEL remove this method and just call the monitor aggregator method directly below?  we don't use the results
@@ -43,6 +45,67 @@ def aggregate_stats():
 
     return
 
+############################################################
+# Query each schedd once for all the groups using the same env,
+# with the union of the attributes they asked for
+# (see glideinFrontendLib.getCondorQFromSnapshots)
+def write_condorq_snapshots(work_dir, groups, snapshot_dir):
+    requests = {}
+    for group_name in groups:
+        request = glideinFrontendLib.loadCondorQRequest(os.path.join(work_dir, "group_%s" % group_name, "condorq_request.pkl"))
+        if request == None:
+            continue # this group is not using the snapshots
+        requests[group_name] = request
+    merged_requests = glideinFrontendLib.mergeCondorQRequests(requests)
+
+    request_keys = merged_requests.keys()
+    request_keys.sort()
+    query_list = []
+    query_requests = []
+    for key in request_keys:
+        request = merged_requests[key]
+        try:
+            query_list.append(glideinFrontendLib.getCondorQSnapshotQuery(request['schedd'], request['format_list'], request['env']))
+            query_requests.append(request)
+        except KeyboardInterrupt:
+            raise # this is an exit signal, pass through
+        except:
+            logSupport.log.exception("Failed to snapshot schedd %s for groups %s: " % (request['schedd'], request['groups']))
+            remove_condorq_snapshot(snapshot_dir, request)
+
+    # all the schedds are queried in parallel
+    snapshot_time = time.time()
+    errors = condorMonitor.loadMulti(query_list, glideinFrontendLib.queryConfig.max_parallel, glideinFrontendLib.queryConfig.timeout)
+    for i in range(len(query_list)):
+        request = query_requests[i]
+        if errors[i] != None:
+            logSupport.log.warning("Failed to snapshot schedd %s for groups %s: %s" % (request['schedd'], request['groups'], errors[i]))
+            remove_condorq_snapshot(snapshot_dir, request)
+            continue
+        condorq = query_list[i][0]
+        glideinFrontendLib.writeCondorQSnapshot(snapshot_dir, request['schedd'], request['format_list'],
+                                                condorq, snapshot_time, request['env'])
+        logSupport.log.info("Schedd %s snapshot for groups %s: %i jobs, %i attributes" % (request['schedd'], request['groups'],
+                                                                                           len(condorq.fetchStored()),
+                                                                                           len(request['format_list'])))
+    logSupport.log.info("Schedd snapshots done in %.1fs" % (time.time() - snapshot_time))
+
+    # remove the snapshots nobody asked for
+    fnames = {}
+    for request in merged_requests.values():
+        fnames[os.path.basename(glideinFrontendLib.getCondorQSnapshotFname(snapshot_dir, request['schedd'], request['env']))] = True
+    for fname in os.listdir(snapshot_dir):
+        if fname[:8] != "condorq_":
+            continue
+        if not fnames.has_key(fname):
+            os.unlink(os.path.join(snapshot_dir, fname))
+
+# do not leave an old snapshot around, the groups will query the schedd themselves
+def remove_condorq_snapshot(snapshot_dir, request):
+    fname = glideinFrontendLib.getCondorQSnapshotFname(snapshot_dir, request['schedd'], request['env'])
+    if os.path.exists(fname):
+        os.unlink(fname)
+
 ############################################################
 def is_crashing_often(startup_time, restart_interval, restart_attempts):
     crashing_often = True
@@ -150,6 +213,10 @@ def spawn(sleep_time,advertize_rate,work_dir,
                 fl = fcntl.fcntl(fd, fcntl.F_GETFL)
                 fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
+        snapshot_dir = os.path.join(work_dir, "condorq_snapshots")
+        if not os.path.isdir(snapshot_dir):
+            os.mkdir(snapshot_dir)
+
         while 1:
             logSupport.log.info("Checking groups %s" % groups)
             for group_name in childs.keys():
@@ -192,6 +259,15 @@ def spawn(sleep_time,advertize_rate,work_dir,
                             fl = fcntl.fcntl(fd, fcntl.F_GETFL)
                             fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
                         logSupport.log.warning("Group's startup/restart times: %s" % childs_uptime)
+            logSupport.log.info("Query the schedds for the groups")
+            try:
+                write_condorq_snapshots(work_dir, groups, snapshot_dir)
+            except KeyboardInterrupt:
+                raise # this is an exit signal, pass through
+            except:
+                # the groups can query the schedds themselves
+                logSupport.log.exception("Failed to write the condor_q snapshots: ")
+
             logSupport.log.info("Aggregate monitoring data")
             # KEL - can we just call the monitor aggregator method directly?  see above
             aggregate_stats()
@@ -261,6 +337,9 @@ def main(work_dir):
         restart_attempts = int(frontendDescript.data['RestartAttempts'])
         restart_interval = int(frontendDescript.data['RestartInterval'])
 
+        # do not let a hung schedd stall the frontend forever
+        glideinFrontendLib.queryConfig.timeout = 10 * sleep_time
+
         groups = string.split(frontendDescript.data['Groups'], ',')
         groups.sort()
 
@@ -1,6 +1,7 @@
 import string
 import os.path
 import urllib
+import configCache
 
 #
 # Project:
@@ -71,13 +72,36 @@ class ConfigFile:
         if validate!=None:
             import hashCrypto
             vhash=hashCrypto.get_hash(validate[0],data)
-            self.hash_value=vhash
-            if (validate[1]!=None) and (vhash!=validate[1]):
-                raise IOError, "Failed validation of '%s'. Hash %s computed to '%s', expected '%s'"%(fname,validate[0],vhash,validate[1])
+            self.check_hash(vhash,validate,fname)
+
+    def check_hash(self,vhash,validate,fname):
+        self.hash_value=vhash
+        if (validate[1]!=None) and (vhash!=validate[1]):
+            raise IOError, "Failed validation of '%s'. Hash %s computed to '%s', expected '%s'"%(fname,validate[0],vhash,validate[1])
 
     def load(self,fname,convert_function,
              validate=None): # if defined, must be (hash_algo,value)
+        if (fname[:5]=="http:") or (fname[:6]=="https:") or (fname[:4]=="ftp:"):
+            self.parse(fname,convert_function,validate)
+            return
+
+        # local files are cached, and read again only if changed
+        if validate!=None:
+            hash_algo=validate[0]
+        else:
+            hash_algo=None
+        data,hash_value=configCache.config_cache.get(fname,
+                                                     lambda f:self.parse(f,convert_function,validate),
+                                                     (self.split_func.im_func,configCache.func_key(convert_function),hash_algo))
+        if validate!=None:
+            self.check_hash(hash_value,validate,fname)
+        self.data=data.copy()
+
+    # Returns (self.data,hash_value)
+    def parse(self,fname,convert_function,
+              validate=None): # if defined, must be (hash_algo,value)
         self.data={}
+        self.hash_value=None
         fd=self.open(fname)
         try:
             data=fd.read()
@@ -92,6 +116,7 @@ class ConfigFile:
                 self.split_func(line,convert_function)
         finally:
             fd.close()
+        return (self.data,self.hash_value)
 
     def split_func(self,line,convert_function):
         larr=string.split(line,None,1)
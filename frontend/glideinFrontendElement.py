@@ -26,6 +26,10 @@ import time
 import string
 import logging
 import cPickle
+import cStringIO
+import tempfile
+import mmap
+import struct
 sys.path.append(os.path.join(sys.path[0], "../lib"))
 
 import pubCrypto
@@ -90,33 +94,141 @@ def log_factory_header():
 
 ###############################
 # to be used with fork clients
+#
+# The results are returned by the children either
+#  - pickled over a pipe (default), or
+#  - pickled into a file in fork_result_dir (ideally a tmpfs, like /dev/shm),
+#    that the parent maps in memory and unpickles in place
+#
+fork_result_dir=None
+
+# to be called before forking
+# Returns the fork_ids to be used by the child in send_fork_result
+# and by the parent in parent_fork_ids
+def prepare_fork_result():
+    if fork_result_dir!=None:
+        (fd,fname)=tempfile.mkstemp(prefix="fork_",suffix=".pkl",dir=fork_result_dir)
+        os.close(fd)
+        return {'fname':fname}
+    else:
+        r,w=os.pipe()
+        return {'r':r,'w':w}
+
+# to be called by the parent if the fork failed
+def cleanup_fork_result(fork_ids):
+    if fork_ids.has_key('fname'):
+        try:
+            os.unlink(fork_ids['fname'])
+        except OSError:
+            pass # already gone
+    else:
+        os.close(fork_ids['r'])
+        os.close(fork_ids['w'])
+
+# to be called by the parent after forking
+# Returns the element to put in pipe_ids (see fetch_fork_result_list)
+def parent_fork_ids(fork_ids,pid):
+    if fork_ids.has_key('fname'):
+        return {'fname':fork_ids['fname'],'pid':pid}
+    else:
+        os.close(fork_ids['w'])
+        return {'r':fork_ids['r'],'pid':pid}
+
+# to be called by the child to return its output
+# The time spent serializing is sent after the output
+def send_fork_result(fork_ids,out):
+    start_time=time.time()
+    if fork_ids.has_key('fname'):
+        fd=open(fork_ids['fname'],"wb")
+        try:
+            pickler=cPickle.Pickler(fd,cPickle.HIGHEST_PROTOCOL)
+            pickler.dump(out)
+            pickler.dump(time.time()-start_time)
+        finally:
+            fd.close()
+    else:
+        os.close(fork_ids['r'])
+        try:
+            data=cPickle.dumps(out,cPickle.HIGHEST_PROTOCOL)
+            data+=cPickle.dumps(time.time()-start_time,cPickle.HIGHEST_PROTOCOL)
+            offset=0
+            while offset<len(data):
+                offset+=os.write(fork_ids['w'],buffer(data,offset))
+        finally:
+            os.close(fork_ids['w'])
+
 # Args:
 #  r    - input pipe
 #  pid - pid of the child
+# Returns (out,timings)
 def fetch_fork_result(r,pid):
     try:
-        rin=""
+        rin=[]
         s=os.read(r,1024*1024)
         while (s!=""): # "" means EOF
-            rin+=s
+            rin.append(s)
             s=os.read(r,1024*1024) 
     finally:
         os.close(r)
         os.waitpid(pid,0)
+    fetch_time=time.time()
 
-    out=cPickle.loads(rin)
-    return out
+    rin=string.join(rin,"")
+    unpickler=cPickle.Unpickler(cStringIO.StringIO(rin))
+    out=unpickler.load()
+    serialize_time=unpickler.load()
+    return (out,{'serialize':serialize_time,'fetch':fetch_time,'load':time.time()-fetch_time,'size':len(rin)})
 
-# in: pipe_is - dictionary, each element is {'r':r,'pid':pid} - see above
+# Args:
+#  fname - file written by the child
+#  pid - pid of the child
+# Returns (out,timings)
+def fetch_fork_result_file(fname,pid):
+    try:
+        os.waitpid(pid,0)
+        return load_fork_result_file(fname,"Child %i"%pid)
+    finally:
+        os.unlink(fname)
+
+# Args:
+#  fname - file written by send_fork_result
+#  who - used in the error messages
+# Returns (out,timings)
+def load_fork_result_file(fname,who):
+    fetch_time=time.time()
+    fd=open(fname,"rb")
+    try:
+        size=os.fstat(fd.fileno()).st_size
+        if size==0:
+            raise RuntimeError, "%s did not return any result"%who
+        mm=mmap.mmap(fd.fileno(),size,mmap.MAP_SHARED,mmap.PROT_READ)
+        try:
+            # cStringIO reads straight from the mapped pages, no copy
+            unpickler=cPickle.Unpickler(cStringIO.StringIO(buffer(mm)))
+            out=unpickler.load()
+            serialize_time=unpickler.load()
+        finally:
+            mm.close()
+    finally:
+        fd.close()
+    return (out,{'serialize':serialize_time,'fetch':fetch_time,'load':time.time()-fetch_time,'size':size})
+
+# in: pipe_is - dictionary, each element is {'r':r,'pid':pid} or {'fname':fname,'pid':pid} - see above
 # out: dictionary of fork_results
 def fetch_fork_result_list(pipe_ids):
     out={}
     failures=0
+    start_time=time.time()
     for k in pipe_ids.keys():
         try:
             # now collect the results
-            rin=fetch_fork_result(pipe_ids[k]['r'],pipe_ids[k]['pid'])
+            if pipe_ids[k].has_key('fname'):
+                rin,timings=fetch_fork_result_file(pipe_ids[k]['fname'],pipe_ids[k]['pid'])
+            else:
+                rin,timings=fetch_fork_result(pipe_ids[k]['r'],pipe_ids[k]['pid'])
             out[k]=rin
+            logSupport.log.info("Child %s result: %i bytes, serialize %.3fs, done after %.3fs, load %.3fs" % (k,timings['size'],timings['serialize'],
+                                                                                                              timings['fetch']-start_time,timings['load']))
         except Exception:
             logSupport.log.exception("Exception in %s occurred: " % k)
             failures+=1
@@ -127,6 +239,223 @@ def fetch_fork_result_list(pipe_ids):
     return out
         
 
+###############################
+# Persistent workers
+#
+# The queries are run by long lived children, forked once
+# and reused in every iteration, so they keep their warm state
+# (e.g. the condorMonitor schedd lookup cache)
+#
+# Each worker runs a single function, bound before forking,
+# so only the location of the result travels over the task pipe
+# The results are returned like for the fork clients,
+# either in a file in fork_result_dir or over the result pipe
+#
+
+# write a length prefixed message
+def write_message(fd,data):
+    data=struct.pack("!I",len(data))+data
+    offset=0
+    while offset<len(data):
+        offset+=os.write(fd,buffer(data,offset))
+
+# read exactly size bytes
+# Raise EOFError if the other side went away
+def read_bytes(fd,size):
+    rin=[]
+    while size>0:
+        s=os.read(fd,min(size,1024*1024))
+        if s=="": # "" means EOF
+            raise EOFError, "Pipe closed"
+        rin.append(s)
+        size-=len(s)
+    return string.join(rin,"")
+
+# read a message written by write_message
+def read_message(fd):
+    size=struct.unpack("!I",read_bytes(fd,4))[0]
+    return read_bytes(fd,size)
+
+class ElementWorker:
+    def __init__(self,name,function):
+        self.name=name
+        self.function=function
+        self.pid=None
+        self.task_w=None
+        self.res_r=None
+
+    # other_fds - parent side fds of the other workers
+    #             the child must not keep them open
+    def start(self,other_fds=[]):
+        task_r,task_w=os.pipe()
+        res_r,res_w=os.pipe()
+        pid=os.fork()
+        if pid==0:
+            # this is the child... serve until the parent goes away
+            try:
+                os.close(task_w)
+                os.close(res_r)
+                for fd in other_fds:
+                    os.close(fd)
+                self.serve(task_r,res_w)
+            finally:
+                # hard kill myself... don't want any cleanup, the parent owns all the state
+                os.kill(os.getpid(),signal.SIGKILL)
+        # this is the original
+        os.close(task_r)
+        os.close(res_w)
+        self.pid=pid
+        self.task_w=task_w
+        self.res_r=res_r
+
+    # close the task pipe, the worker will exit
+    def stop(self):
+        if self.pid==None:
+            return # not running
+        os.close(self.task_w)
+        os.close(self.res_r)
+        try:
+            os.kill(self.pid,signal.SIGKILL)
+        except OSError:
+            pass # already dead
+        os.waitpid(self.pid,0)
+        self.pid=None
+
+    def get_fds(self):
+        if self.pid==None:
+            return []
+        return [self.task_w,self.res_r]
+
+    # child side
+    # The messages are pickled (fname,) tasks, with fname==None meaning use the pipe
+    # The answers start with a status character
+    #  F - result written in fname
+    #  P - the pickled result follows
+    #  E - the function failed, the exception was logged
+    def serve(self,task_r,res_w):
+        while 1:
+            try:
+                (fname,)=cPickle.loads(read_message(task_r))
+            except EOFError:
+                return # parent is gone
+            try:
+                out=self.function()
+            except Exception:
+                logSupport.log.exception("Exception in worker %s occurred: " % self.name)
+                write_message(res_w,"E")
+                continue
+
+            if fname!=None:
+                send_fork_result({'fname':fname},out)
+                write_message(res_w,"F")
+            else:
+                start_time=time.time()
+                data=cPickle.dumps(out,cPickle.HIGHEST_PROTOCOL)
+                data+=cPickle.dumps(time.time()-start_time,cPickle.HIGHEST_PROTOCOL)
+                write_message(res_w,"P"+data)
+            del out
+
+    # Returns the task_id to be used in fetch_result
+    def send_task(self):
+        task_id={'fname':None}
+        if fork_result_dir!=None:
+            task_id=prepare_fork_result()
+        try:
+            write_message(self.task_w,cPickle.dumps((task_id['fname'],)))
+        except:
+            if task_id['fname']!=None:
+                os.unlink(task_id['fname'])
+            raise
+        return task_id
+
+    # Returns (out,timings)
+    # Raise EOFError if the worker died
+    def fetch_result(self,task_id):
+        try:
+            msg=read_message(self.res_r)
+            fetch_time=time.time()
+            if msg[0]=="F":
+                return load_fork_result_file(task_id['fname'],"Worker %s"%self.name)
+            elif msg[0]=="P":
+                unpickler=cPickle.Unpickler(cStringIO.StringIO(buffer(msg,1)))
+                out=unpickler.load()
+                serialize_time=unpickler.load()
+                return (out,{'serialize':serialize_time,'fetch':fetch_time,'load':time.time()-fetch_time,'size':len(msg)-1})
+            else:
+                raise RuntimeError, "Worker %s failed"%self.name
+        finally:
+            if task_id['fname']!=None:
+                try:
+                    os.unlink(task_id['fname'])
+                except OSError:
+                    pass # already removed, or never created
+
+class ElementWorkerPool:
+    # functions - dictionary of name:function
+    #             the functions take no arguments
+    def __init__(self,functions):
+        self.workers={}
+        for k in functions.keys():
+            self.workers[k]=ElementWorker(k,functions[k])
+        for k in self.workers.keys():
+            self.start_worker(k)
+
+    def start_worker(self,k):
+        other_fds=[]
+        for ok in self.workers.keys():
+            if ok!=k:
+                other_fds+=self.workers[ok].get_fds()
+        self.workers[k].start(other_fds)
+
+    def restart_worker(self,k):
+        logSupport.log.warning("Restarting worker %s" % k)
+        self.workers[k].stop()
+        self.start_worker(k)
+
+    def stop(self):
+        for k in self.workers.keys():
+            try:
+                self.workers[k].stop()
+            except:
+                pass # just ignore errors... this was cleanup
+
+    # Run the named tasks in parallel
+    # Same semantics as fetch_fork_result_list:
+    #  returns a dictionary with the results
+    #  or raises RuntimeError, once all the tasks ended, if any failed
+    # Workers that died are restarted, and will be used from the next run
+    def run(self,names):
+        out={}
+        failures=0
+        start_time=time.time()
+        task_ids={}
+        for k in names:
+            try:
+                task_ids[k]=self.workers[k].send_task()
+            except Exception:
+                logSupport.log.exception("Failed to send task to worker %s: " % k)
+                failures+=1
+                self.restart_worker(k)
+
+        for k in task_ids.keys():
+            try:
+                rin,timings=self.workers[k].fetch_result(task_ids[k])
+                out[k]=rin
+                logSupport.log.info("Worker %s result: %i bytes, serialize %.3fs, done after %.3fs, load %.3fs" % (k,timings['size'],timings['serialize'],
+                                                                                                                   timings['fetch']-start_time,timings['load']))
+            except EOFError:
+                logSupport.log.warning("Worker %s died" % k)
+                failures+=1
+                self.restart_worker(k)
+            except Exception:
+                logSupport.log.exception("Exception in %s occurred: " % k)
+                failures+=1
+
+        if failures>0:
+            raise RuntimeError, "Found %i errors"%failures
+
+        return out
+
 ######################
 # expand $$(attribute)
 def expand_DD(qstr,attr_dict):
@@ -149,7 +478,96 @@ def expand_DD(qstr,attr_dict):
     
 
 ############################################################
-def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatureDescript, x509_proxy_plugin, stats, history_obj):
+# The queries run by the persistent workers
+# (see ElementWorkerPool)
+
+# If set, use the condor_q snapshots written by the frontend
+# (see glideinFrontendLib.getCondorQFromSnapshots)
+condorq_snapshot_dir=None
+condorq_snapshot_max_age=600
+# where to tell the frontend what the snapshots must contain
+condorq_request_fname=None
+
+def query_entries(elementDescript, attr_dict, signatureDescript):
+    glidein_dict = {}
+    factory_constraint=expand_DD(elementDescript.merged_data['FactoryQueryExpr'],attr_dict)
+    factory_pools=elementDescript.merged_data['FactoryCollectors']
+    for factory_pool in factory_pools:
+        factory_pool_node = factory_pool[0]
+        factory_identity = factory_pool[1]
+        my_identity_at_factory_pool = factory_pool[2]
+        try:
+            factory_glidein_dict = glideinFrontendInterface.findGlideins(factory_pool_node, None, signatureDescript.signature_type, factory_constraint)
+        except RuntimeError:
+            # failed to talk, like empty... maybe the next factory will have something
+            if factory_pool_node != None:
+                logSupport.log.exception("Failed to talk to factory_pool %s for entry info: %s" % factory_pool_node)
+            else:
+                logSupport.log.exception("Failed to talk to factory_pool for entry info: ")
+            factory_glidein_dict = {}
+
+        for glidename in factory_glidein_dict.keys():
+            if (not factory_glidein_dict[glidename]['attrs'].has_key('AuthenticatedIdentity')) or (factory_glidein_dict[glidename]['attrs']['AuthenticatedIdentity'] != factory_identity):
+                logSupport.log.warning("Found an untrusted factory %s at %s; ignoring." % (glidename, factory_pool_node))
+                if factory_glidein_dict[glidename]['attrs'].has_key('AuthenticatedIdentity'):
+                    logSupport.log.warning("Found an untrusted factory %s at %s; identity mismatch '%s'!='%s'" % (glidename, factory_pool_node, factory_glidein_dict[glidename]['attrs']['AuthenticatedIdentity'], factory_identity))
+            else:
+                glidein_dict[(factory_pool_node, glidename, my_identity_at_factory_pool)] = factory_glidein_dict[glidename]
+
+    return glidein_dict
+
+def query_jobs(elementDescript, attr_dict, x509_proxy_plugin):
+    try:
+        condorq_format_list = elementDescript.merged_data['JobMatchAttrs']
+        if x509_proxy_plugin != None:
+            condorq_format_list = list(condorq_format_list) + list(x509_proxy_plugin.get_required_job_attributes())
+
+        ### Add in elements to help in determining if jobs have voms creds
+        condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFirstFQAN','s'),))
+        condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFQAN','s'),))
+        job_constraint = expand_DD(elementDescript.merged_data['JobQueryExpr'],attr_dict)
+        if condorq_snapshot_dir!=None:
+            # tell the frontend what we need, and use what it already fetched
+            # with our own credentials
+            condorq_env = {'_CONDOR_CERTIFICATE_MAPFILE':elementDescript.element_data['MapFile'],
+                           'X509_USER_PROXY':elementDescript.frontend_data['ClassAdProxy']}
+            glideinFrontendLib.writeCondorQRequest(condorq_request_fname,
+                                                   elementDescript.merged_data['JobSchedds'],
+                                                   job_constraint, condorq_format_list,
+                                                   condorq_env)
+            condorq_dict = glideinFrontendLib.getCondorQFromSnapshots(condorq_snapshot_dir, condorq_snapshot_max_age,
+                                                                      elementDescript.merged_data['JobSchedds'],
+                                                                      job_constraint,
+                                                                      condorq_format_list,
+                                                                      compact_results=True,
+                                                                      env=condorq_env)
+        else:
+            condorq_dict = glideinFrontendLib.getCondorQ(elementDescript.merged_data['JobSchedds'],
+                                                         job_constraint,
+                                                         condorq_format_list,
+                                                         compact_results=True)
+    except Exception:
+        logSupport.log.exception("In query schedd worker, exception:")
+        raise
+
+    return condorq_dict
+
+def query_startds(elementDescript, x509_proxy_plugin):
+    frontend_name = elementDescript.frontend_data['FrontendName']
+    group_name = elementDescript.element_data['GroupName']
+
+    status_format_list=[]
+    if x509_proxy_plugin!=None:
+        status_format_list=list(status_format_list)+list(x509_proxy_plugin.get_required_classad_attributes())
+
+    # use the main collector... all adds must go there
+    status_dict=glideinFrontendLib.getCondorStatus([None],
+                                                   'GLIDECLIENT_Name=?="%s.%s"'%(frontend_name,group_name),
+                                                   status_format_list)
+    return status_dict
+
+############################################################
+def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatureDescript, x509_proxy_plugin, stats, history_obj, worker_pool):
     frontend_name = elementDescript.frontend_data['FrontendName']
     group_name = elementDescript.element_data['GroupName']
     security_name = elementDescript.merged_data['SecurityName']
@@ -157,12 +575,10 @@ def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatu
     web_url = elementDescript.frontend_data['WebURL']
     monitoring_web_url=elementDescript.frontend_data['MonitoringWebURL']
 
-    pipe_ids={}
-
     factory_constraint = elementDescript.merged_data['FactoryQueryExpr']
     factory_pools = elementDescript.merged_data['FactoryCollectors']
     
-    logSupport.log.info("Querying schedd, entry, and glidein status using child processes.") 
+    logSupport.log.info("Querying schedd, entry, and glidein status using worker processes.") 
           
     # query globals
     # We can't fork this since the M2Crypto key objects are not pickle-able.  Not much to gain by forking anyway.
@@ -203,128 +619,16 @@ def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatu
                 logSupport.log.info("Factory '%s@%s': unsupported pub key type '%s'" % (globalid[1], globalid[0], globals_el['attrs']['PubKeyType']))
                         
                 
-    # query entries
-    r,w=os.pipe()
-    pid=os.fork()
-    if pid==0:
-        # this is the child... return output as a pickled object via the pipe
-        os.close(r)
-        try:
-            glidein_dict = {}
-            factory_constraint=expand_DD(elementDescript.merged_data['FactoryQueryExpr'],attr_dict)
-            factory_pools=elementDescript.merged_data['FactoryCollectors']
-            for factory_pool in factory_pools:
-                factory_pool_node = factory_pool[0]
-                factory_identity = factory_pool[1]
-                my_identity_at_factory_pool = factory_pool[2]
-                try:
-                    factory_glidein_dict = glideinFrontendInterface.findGlideins(factory_pool_node, None, signatureDescript.signature_type, factory_constraint)
-                except RuntimeError:
-                    # failed to talk, like empty... maybe the next factory will have something
-                    if factory_pool_node != None:
-                        logSupport.log.exception("Failed to talk to factory_pool %s for entry info: %s" % factory_pool_node)
-                    else:
-                        logSupport.log.exception("Failed to talk to factory_pool for entry info: ")
-                    factory_glidein_dict = {}
-        
-                for glidename in factory_glidein_dict.keys():
-                    if (not factory_glidein_dict[glidename]['attrs'].has_key('AuthenticatedIdentity')) or (factory_glidein_dict[glidename]['attrs']['AuthenticatedIdentity'] != factory_identity):
-                        logSupport.log.warning("Found an untrusted factory %s at %s; ignoring." % (glidename, factory_pool_node))
-                        if factory_glidein_dict[glidename]['attrs'].has_key('AuthenticatedIdentity'):
-                            logSupport.log.warning("Found an untrusted factory %s at %s; identity mismatch '%s'!='%s'" % (glidename, factory_pool_node, factory_glidein_dict[glidename]['attrs']['AuthenticatedIdentity'], factory_identity))
-                    else:
-                        glidein_dict[(factory_pool_node, glidename, my_identity_at_factory_pool)] = factory_glidein_dict[glidename]
-    
-            os.write(w,cPickle.dumps(glidein_dict))
-        finally:
-            os.close(w)
-            # hard kill myself... don't want any cleanup, since i was created just for this calculation
-            os.kill(os.getpid(),signal.SIGKILL) 
-    else:
-        # this is the original
-        # just remember what you did for now
-        os.close(w)
-        pipe_ids['entries']={'r':r,'pid':pid}
-    
-    ## schedd
-    r,w=os.pipe()
-    pid=os.fork()
-    if pid==0:
-        # this is the child... return output as a pickled object via the pipe
-        os.close(r)
-        try:
-            #condorq_format_list = elementDescript.merged_data['JobMatchAttrs']
-            #if x509_proxy_plugin != None:
-            #    condorq_format_list = list(condorq_format_list) + list(x509_proxy_plugin.get_required_job_attributes())
-        
-            ### Add in elements to help in determining if jobs have voms creds
-            #condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFirstFQAN','s'),))
-            #condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFQAN','s'),))
-            #condorq_dict = glideinFrontendLib.getCondorQ(elementDescript.merged_data['JobSchedds'],
-            #                                           elementDescript.merged_data['JobQueryExpr'],
-            #                                           condorq_format_list)
-            try:
-                condorq_format_list = elementDescript.merged_data['JobMatchAttrs']
-                if x509_proxy_plugin != None:
-                    condorq_format_list = list(condorq_format_list) + list(x509_proxy_plugin.get_required_job_attributes())
-            
-                ### Add in elements to help in determining if jobs have voms creds
-                condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFirstFQAN','s'),))
-                condorq_format_list=list(condorq_format_list)+list((('x509UserProxyFQAN','s'),))
-                condorq_dict = glideinFrontendLib.getCondorQ(elementDescript.merged_data['JobSchedds'],
-                                                       expand_DD(elementDescript.merged_data['JobQueryExpr'],attr_dict),
-                                                       condorq_format_list)
-            except Exception:
-                logSupport.log.exception("In query schedd child, exception:")
-                
-        
-            os.write(w,cPickle.dumps(condorq_dict))
-        finally:
-            os.close(w)
-            # hard kill myself... don't want any cleanup, since i was created just for this calculation
-            os.kill(os.getpid(),signal.SIGKILL) 
-    else:
-        # this is the original
-        # just remember what you did for now
-        os.close(w)
-        pipe_ids['jobs']={'r':r,'pid':pid} 
-
-    ## resource
-    r,w=os.pipe()
-    pid=os.fork()
-    if pid==0:
-        # this is the child... return output as a pickled object via the pipe
-        os.close(r)
-        try:
-            status_format_list=[]
-            if x509_proxy_plugin!=None:
-                status_format_list=list(status_format_list)+list(x509_proxy_plugin.get_required_classad_attributes())
-
-            # use the main collector... all adds must go there
-            status_dict=glideinFrontendLib.getCondorStatus([None],
-                                                           'GLIDECLIENT_Name=?="%s.%s"'%(frontend_name,group_name),
-                                                           status_format_list)
-
-            os.write(w,cPickle.dumps(status_dict))
-        finally:
-            os.close(w)
-            # hard kill myself... don't want any cleanup, since i was created just for this calculation
-            os.kill(os.getpid(),signal.SIGKILL) 
-    else:
-        # this is the original
-        # just remember what you did for now
-        os.close(w)
-        pipe_ids['startds']={'r':r,'pid':pid} 
- 
-    
+    # query entries, schedds and resources
+    # the queries are run by the persistent workers, in parallel
     try:
-        pipe_out=fetch_fork_result_list(pipe_ids)
+        pipe_out=worker_pool.run(['entries','jobs','startds'])
     except RuntimeError, e:
         # expect all errors logged already
         logSupport.log.info("Missing schedd, factory entry, and/or current glidein state information. " \
                             "Unable to calculate required glideins, terminating loop.")
         return
-    logSupport.log.info("All children terminated")
+    logSupport.log.info("All workers done")
 
     glidein_dict=pipe_out['entries']
     condorq_dict=pipe_out['jobs']
@@ -420,17 +724,27 @@ def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatu
     for f in elementDescript.merged_data['JobMatchAttrs']:
         condorq_match_list.append(f[0])
 
+    # match results are remembered across iterations
+    if not history_obj.has_key('match_cache'):
+        history_obj['match_cache'] = glideinFrontendLib.MatchCache()
+    match_cache = history_obj['match_cache']
+
     #logSupport.log.debug("realcount: %s\n\n" % glideinFrontendLib.countRealRunning(elementDescript.merged_data['MatchExprCompiledObj'],condorq_dict_running,glidein_dict))
 
     logSupport.log.info("Counting subprocess created")
     pipe_ids={}
-    for dt in condorq_dict_types.keys()+['Real','Glidein']:
+    # all the job types are counted in the same process,
+    # as they share the same match matrix
+    for dt in ['Match','Real','Glidein']:
         # will make calculations in parallel,using multiple processes
-        r,w=os.pipe()
-        pid=os.fork()
+        fork_ids=prepare_fork_result()
+        try:
+            pid=os.fork()
+        except:
+            cleanup_fork_result(fork_ids)
+            raise
         if pid==0:
-            # this is the child... return output as a pickled object via the pipe
-            os.close(r)
+            # this is the child... return output as a pickled object via fork_ids
             try:
                 if dt=='Real':
                     out=glideinFrontendLib.countRealRunning(elementDescript.merged_data['MatchExprCompiledObj'],condorq_dict_running,glidein_dict,attr_dict,condorq_match_list)
@@ -444,21 +758,26 @@ def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatu
                             c=glideinFrontendLib.getClientCondorStatus(status_dict_types[st]['dict'],frontend_name,group_name,request_name)
                             count_status_multi[request_name][st]=glideinFrontendLib.countCondorStatus(c)
                     out=count_status_multi
-                else:
-                    c,p,h=glideinFrontendLib.countMatch(elementDescript.merged_data['MatchExprCompiledObj'],condorq_dict_types[dt]['dict'],glidein_dict,attr_dict,condorq_match_list)
-                    t=glideinFrontendLib.countCondorQ(condorq_dict_types[dt]['dict'])
-                    out=(c,p,h,t)
-
-                os.write(w,cPickle.dumps(out))
+                else: # Match
+                    # evaluate the match expression once over all the jobs
+                    # all the job types are subsets of condorq_dict
+                    # glideins and jobs looking the same to the match expression are evaluated only once
+                    match_paths=glideinFrontendLib.getMatchPaths(elementDescript.merged_data['MatchExpr'])
+                    match_matrix=glideinFrontendLib.getMatchMatrix(elementDescript.merged_data['MatchExprCompiledObj'],condorq_dict,glidein_dict,attr_dict,condorq_match_list,match_paths,match_cache)
+                    out={'MatchCache':match_cache.get_update()}
+                    for t in condorq_dict_types.keys():
+                        c,p,h=glideinFrontendLib.countMatchMatrix(match_matrix,condorq_dict_types[t]['dict'])
+                        t_abs=glideinFrontendLib.countCondorQ(condorq_dict_types[t]['dict'])
+                        out[t]=(c,p,h,t_abs)
+
+                send_fork_result(fork_ids,out)
             finally:
-                os.close(w)
                 # hard kill myself... don't want any cleanup, since i was created just for this calculation
                 os.kill(os.getpid(),signal.SIGKILL) 
         else:
             # this is the original
             # just remember what you did for now
-            os.close(w)
-            pipe_ids[dt]={'r':r,'pid':pid} 
+            pipe_ids[dt]=parent_fork_ids(fork_ids,pid) 
 
     try:
         pipe_out=fetch_fork_result_list(pipe_ids)
@@ -471,7 +790,10 @@ def iterate_one(client_name, elementDescript, paramsDescript, attr_dict, signatu
     # TODO: PM Need to check if we are counting correctly after the merge
     for dt in condorq_dict_types.keys():
         el=condorq_dict_types[dt]
-        (el['count'], el['prop'], el['hereonly'], el['total'])=pipe_out[dt]
+        (el['count'], el['prop'], el['hereonly'], el['total'])=pipe_out['Match'][dt]
+
+    match_cache.apply_update(pipe_out['Match']['MatchCache'])
+    logSupport.log.info("Match cache: %s" % match_cache.get_stats_str())
 
     count_real=pipe_out['Real']
     count_status_multi=pipe_out['Glidein']
@@ -828,6 +1150,11 @@ def iterate(parent_pid, elementDescript, paramsDescript, attr_dict, signatureDes
     stats = {}
     history_obj = {}
 
+    # the queries are run by persistent workers, started once
+    worker_pool = ElementWorkerPool({'entries':lambda:query_entries(elementDescript, attr_dict, signatureDescript),
+                                     'jobs':lambda:query_jobs(elementDescript, attr_dict, x509_proxy_plugin),
+                                     'startds':lambda:query_startds(elementDescript, x509_proxy_plugin)})
+
     if not elementDescript.frontend_data.has_key('X509Proxy'):
         published_frontend_name = '%s.%s' % (frontend_name, group_name)
     else:
@@ -845,7 +1172,7 @@ def iterate(parent_pid, elementDescript, paramsDescript, attr_dict, signatureDes
                 # recreate every time (an easy way to start from a clean state)
                 stats['group'] = glideinFrontendMonitoring.groupStats()
 
-                done_something = iterate_one(published_frontend_name, elementDescript, paramsDescript, attr_dict, signatureDescript, x509_proxy_plugin, stats, history_obj)
+                done_something = iterate_one(published_frontend_name, elementDescript, paramsDescript, attr_dict, signatureDescript, x509_proxy_plugin, stats, history_obj, worker_pool)
                 logSupport.log.info("iterate_one status: %s" % str(done_something))
 
                 logSupport.log.info("Writing stats")
@@ -872,6 +1199,8 @@ def iterate(parent_pid, elementDescript, paramsDescript, attr_dict, signatureDes
             logSupport.log.info("Sleep")
             time.sleep(sleep_time)
     finally:
+        worker_pool.stop()
+
         logSupport.log.info("Deadvertize my ads")
         for factory_pool in factory_pools:
             factory_pool_node = factory_pool[0]
@@ -957,6 +1286,20 @@ def main(parent_pid, work_dir, group_name):
     os.environ['_CONDOR_CERTIFICATE_MAPFILE'] = elementDescript.element_data['MapFile']
     os.environ['X509_USER_PROXY'] = elementDescript.frontend_data['ClassAdProxy']
 
+    # the children return their results through a tmpfs, if available
+    global fork_result_dir
+    if os.path.isdir('/dev/shm'):
+        fork_result_dir = '/dev/shm'
+
+    # do not let a hung schedd or collector stall the group forever
+    glideinFrontendLib.queryConfig.timeout = 10 * int(elementDescript.frontend_data['LoopDelay'])
+
+    # the jobs are fetched by the frontend, once for all the groups
+    global condorq_snapshot_dir, condorq_snapshot_max_age, condorq_request_fname
+    condorq_snapshot_dir = os.path.join(work_dir, "condorq_snapshots")
+    condorq_snapshot_max_age = 2 * int(elementDescript.frontend_data['LoopDelay'])
+    condorq_request_fname = os.path.join(work_dir, "group_%s" % group_name, "condorq_request.pkl")
+
     # create lock file
     pid_obj = glideinFrontendPidLib.ElementPidSupport(work_dir, group_name)
 
@@ -72,6 +72,9 @@ class FrontendConfig:
         self.advertise_use_tcp = False
         # Should we use the new -multiple for condor_advertise?
         self.advertise_use_multi = False
+        # Max condor_advertise commands running at the same time
+        # against the same factory pool
+        self.advertise_max_parallel = 4
 
         self.condor_reserved_names = ("MyType", "TargetType", "GlideinMyType", "MyAddress", 'UpdatesHistory', 'UpdatesTotal', 'UpdatesLost', 'UpdatesSequenced', 'UpdateSequenceNumber', 'DaemonStartTime')
 
@@ -649,12 +652,13 @@ class MultiAdvertizeWork:
         # get a 9 digit number that will stay 9 digit for the next 25 years
         short_time = time.time() - 1.05e9
         idx = 0
+        # advertize to all the factory pools in parallel
+        batch = condorExe.ExeBatch(max_per_target=frontendConfig.advertise_max_parallel)
         for factory_pool in self.factory_queue.keys():
             idx = idx + 1
             self.unique_id=1
             self.adname = "/tmp/gfi_aw_%li_%li_%li" % (short_time, os.getpid(), idx)
 
-            # this should be done in parallel, but keep it serial for now
             filename_arr=[]
             if (frontendConfig.advertise_use_multi==True):
                 filename_arr.append(self.adname)
@@ -671,9 +675,22 @@ class MultiAdvertizeWork:
             # Advertize all the files (if multi, should only be one) 
             for filename in filename_arr:
                 try:
-                    advertizeWorkFromFile(factory_pool, filename, remove_file=True, is_multi=frontendConfig.advertise_use_multi)
+                    batch.add(get_condor_advertise_cmd(filename, "UPDATE_MASTER_AD", factory_pool, is_multi=frontendConfig.advertise_use_multi),
+                              target=factory_pool, key=filename)
                 except condorExe.ExeError:
                     logSupport.log.exception("Advertising request failed for factory pool %s: " % factory_pool)
+                    os.remove(filename)
+
+        try:
+            batch.run()
+        finally:
+            for filename in batch.keys:
+                os.remove(filename)
+        for r in batch.results:
+            if r.error != None:
+                logSupport.log.warning("Advertising request failed for factory pool %s: %s" % (r.target, r.error))
+            else:
+                logSupport.log.debug("Advertised %s to factory pool %s in %.2fs" % (r.key, r.target, r.duration))
 
         self.factory_queue = {} # clean queue
 
@@ -1007,6 +1024,14 @@ class ResourceClassadAdvertiser(classadSupport.ClassadAdvertiser):
 #
 ############################################################
 
+# Same as exe_condor_advertise, but return the condorExe.ExeCmd
+def get_condor_advertise_cmd(fname, command, pool, is_multi=False):
+    logSupport.log.debug("CONDOR ADVERTISE %s %s %s %s" % (fname, command,
+                                                           pool, is_multi))
+    return condorManager.condorAdvertiseCmd(fname, command,
+                                            frontendConfig.advertise_use_tcp,
+                                            is_multi, pool)
+
 def exe_condor_advertise(fname,command, pool, is_multi=False):
     logSupport.log.debug("CONDOR ADVERTISE %s %s %s %s" % (fname, command,
                                                            pool, is_multi))
@@ -14,12 +14,34 @@
 #
 
 import os.path
-import string,math
+import string,math,time
+import cPickle
 import condorMonitor,condorExe
+import classadExpr
+import marshal
+import exprParser
 import logSupport
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
 #############################################################################################
 
+#
+# Configuration of the schedd and collector queries
+#
+class QueryConfig:
+    def __init__(self):
+        # The schedds (and collectors) are queried in parallel,
+        # at most max_parallel at a time (None means all at once)
+        self.max_parallel = 16
+        # Queries taking longer than this (in seconds) are killed,
+        # and the schedd treated as unreachable (None means no limit)
+        self.timeout = None
+
+queryConfig = QueryConfig()
+
 #
 # Return a dictionary of schedds containing interesting jobs
 # Each element is a condorQ
@@ -27,10 +49,233 @@ import logSupport
 # If not all the jobs of the schedd has to be considered,
 # specify the appropriate constraint
 #
-def getCondorQ(schedd_names, constraint=None, format_list=None):
+# If compact_results is True, the jobs are stored as
+# condorMonitor.CompactClassAd objects (smaller and faster to pickle)
+#
+def getCondorQ(schedd_names, constraint=None, format_list=None, compact_results=False):
     if format_list != None:
-        format_list = condorMonitor.complete_format_list(format_list, [('JobStatus', 'i'), ('EnteredCurrentStatus', 'i'), ('ServerTime', 'i'), ('RemoteHost', 's')])
-    return getCondorQConstrained(schedd_names, "(JobStatus=?=1)||(JobStatus=?=2)", constraint, format_list)
+        format_list = condorMonitor.complete_format_list(format_list, CONDORQ_REQUIRED_FORMAT_LIST)
+    return getCondorQConstrained(schedd_names, CONDORQ_TYPE_CONSTRAINT, constraint, format_list, compact_results)
+
+#
+# Shared condor_q snapshots
+#
+# The frontend main process queries each schedd once per cycle,
+# asking for the union of the attributes needed by all the groups
+# (as published by writeCondorQRequest), and writes one snapshot per schedd
+# and environment, as the groups may use different credentials and mapfiles
+# The groups then apply their own constraint locally (see classadExpr)
+# and only query the schedds themselves when the snapshot cannot be used
+#
+
+# Bump it every time the content of the snapshots or requests changes
+CONDORQ_SNAPSHOT_VERSION = 3
+
+# Attributes always fetched by getCondorQ
+CONDORQ_REQUIRED_FORMAT_LIST = [('JobStatus', 'i'), ('EnteredCurrentStatus', 'i'), ('ServerTime', 'i'), ('RemoteHost', 's')]
+
+# The type constraint used by getCondorQ
+CONDORQ_TYPE_CONSTRAINT = "(JobStatus=?=1)||(JobStatus=?=2)"
+
+#
+# Same as getCondorQ(schedd_names, constraint, format_list, compact_results),
+# but use the snapshots in snapshot_dir where possible
+#
+# Only the snapshots taken with the same env are used
+# Snapshots older than max_age (in seconds), or missing any of the needed attributes,
+# are ignored and the schedd is queried directly
+#
+def getCondorQFromSnapshots(snapshot_dir, max_age, schedd_names, constraint=None, format_list=None, compact_results=False, env={}):
+    local_constraint = None
+    if constraint != None:
+        local_constraint = getLocalConstraint(constraint)
+        if local_constraint == None:
+            # condor has to evaluate it
+            return getCondorQ(schedd_names, constraint, format_list, compact_results)
+    if format_list == None:
+        # all the attributes needed, no snapshot can provide that
+        return getCondorQ(schedd_names, constraint, format_list, compact_results)
+
+    needed_attrs = getSnapshotAttrs(format_list, local_constraint)
+
+    out_condorq_dict = {}
+    missing_schedds = []
+    for schedd in schedd_names:
+        if schedd == '':
+            continue # getCondorQ will warn about it
+
+        snapshot = loadCondorQSnapshot(getCondorQSnapshotFname(snapshot_dir, schedd, env))
+        if ((snapshot == None) or (snapshot['schedd'] != schedd) or (snapshot['env_key'] != getCondorQEnvKey(env)) or
+            ((time.time() - snapshot['time']) > max_age)):
+            missing_schedds.append(schedd)
+            continue
+        snapshot_attrs = {}
+        for attr in snapshot['attrs']:
+            snapshot_attrs[attr.lower()] = True
+        found_all = True
+        for attr in needed_attrs:
+            if not snapshot_attrs.has_key(attr.lower()):
+                found_all = False
+                break
+        if not found_all:
+            missing_schedds.append(schedd)
+            continue
+
+        condorq = condorMonitor.StoredQuery()
+        if local_constraint != None:
+            try:
+                condorq.stored_data = condorMonitor.applyConstraint(snapshot['data'], local_constraint)
+            except classadExpr.NotEvaluable, e:
+                # some jobs have expressions only condor can evaluate
+                logSupport.log.debug("Cannot use the condor_q snapshot of %s: %s" % (schedd, e))
+                missing_schedds.append(schedd)
+                continue
+        else:
+            condorq.stored_data = snapshot['data']
+        if len(condorq.fetchStored()) > 0:
+            out_condorq_dict[schedd] = condorq
+
+    if len(missing_schedds) > 0:
+        logSupport.log.info("No usable condor_q snapshot for %s, querying directly" % missing_schedds)
+        out_condorq_dict.update(getCondorQ(missing_schedds, constraint, format_list, compact_results))
+    return out_condorq_dict
+
+# Returns a classadExpr.Constraint,
+# or None if the constraint cannot be evaluated in python
+# The constraints are compiled only once
+local_constraints = {}
+def getLocalConstraint(constraint):
+    if not local_constraints.has_key(constraint):
+        try:
+            local_constraints[constraint] = classadExpr.Constraint(constraint)
+        except ValueError, e:
+            logSupport.log.warning("Constraint cannot be evaluated locally: %s" % e)
+            local_constraints[constraint] = None
+    return local_constraints[constraint]
+
+# Returns the list of attributes a snapshot must have
+def getSnapshotAttrs(format_list, local_constraint=None):
+    attrs = []
+    for el in condorMonitor.complete_format_list(format_list, CONDORQ_REQUIRED_FORMAT_LIST):
+        attrs.append(el[0])
+    if local_constraint != None:
+        attrs += local_constraint.attrs
+    return attrs
+
+def getCondorQSnapshotFname(snapshot_dir, schedd_name, env={}):
+    return os.path.join(snapshot_dir, "condorq_%s_%s.pkl" % (schedd_name, getCondorQEnvKey(env)))
+
+# Returns a short string identifying the env
+def getCondorQEnvKey(env):
+    env_list = env.items()
+    env_list.sort()
+    return md5(repr(env_list)).hexdigest()[:16]
+
+#
+# Used by the groups to tell the frontend what to put in the snapshots
+#
+# env - environment to use when querying the schedds
+#
+def writeCondorQRequest(fname, schedd_names, constraint, format_list, env):
+    request_format_list = condorMonitor.complete_format_list(format_list, CONDORQ_REQUIRED_FORMAT_LIST)
+    if constraint != None:
+        local_constraint = getLocalConstraint(constraint)
+        if local_constraint == None:
+            # the snapshots cannot be used, do not ask for them
+            if os.path.exists(fname):
+                os.unlink(fname)
+            return
+        for attr in local_constraint.attrs:
+            # the type is not used with XML output
+            request_format_list = condorMonitor.complete_format_list(request_format_list, [(attr, 's')])
+
+    request = {'version':CONDORQ_SNAPSHOT_VERSION,
+               'schedds':list(schedd_names),
+               'format_list':request_format_list,
+               'env':env}
+    writePickle(fname, request)
+
+# Returns None if not there or not compatible
+def loadCondorQRequest(fname):
+    return loadVersionedPickle(fname)
+
+#
+# Used by the frontend to merge the requests of the groups
+# Only the groups using the same env share a query,
+# so that nobody sees jobs fetched with the credentials of another group
+#
+# requests - group_name -> request (see loadCondorQRequest)
+# Returns a dictionary of (schedd_name, env_key) -> {'schedd','env','format_list','groups'}
+#
+def mergeCondorQRequests(requests):
+    out = {}
+    group_names = requests.keys()
+    group_names.sort()
+    for group_name in group_names:
+        request = requests[group_name]
+        env_key = getCondorQEnvKey(request['env'])
+        for schedd_name in request['schedds']:
+            if schedd_name == '':
+                continue
+            key = (schedd_name, env_key)
+            if not out.has_key(key):
+                out[key] = {'schedd':schedd_name, 'env':request['env'],
+                            'format_list':[], 'groups':[]}
+            out[key]['format_list'] = condorMonitor.complete_format_list(out[key]['format_list'], request['format_list'])
+            out[key]['groups'].append(group_name)
+    return out
+
+#
+# Used by the frontend to query the schedds for all the groups
+# Returns the (query, constraint, format_list) to be used with condorMonitor.loadMulti
+#
+def getCondorQSnapshotQuery(schedd_name, format_list, env={}):
+    condorq = condorMonitor.CondorQ(schedd_name)
+    if len(env.keys()) > 0:
+        condorq.env = condorq.env.copy() # the original belongs to the schedd cache
+        condorq.env.update(env)
+    condorq.use_compact_results(True)
+    return (condorq, CONDORQ_TYPE_CONSTRAINT, condorMonitor.complete_format_list(format_list, CONDORQ_REQUIRED_FORMAT_LIST))
+
+#
+# snapshot_time - when the query was started
+#
+def writeCondorQSnapshot(snapshot_dir, schedd_name, format_list, condorq, snapshot_time, env={}):
+    snapshot = {'version':CONDORQ_SNAPSHOT_VERSION,
+                'schedd':schedd_name,
+                'env_key':getCondorQEnvKey(env),
+                'time':snapshot_time,
+                'attrs':[el[0] for el in condorMonitor.complete_format_list(format_list, CONDORQ_REQUIRED_FORMAT_LIST)],
+                'data':condorq.fetchStored()}
+    writePickle(getCondorQSnapshotFname(snapshot_dir, schedd_name, env), snapshot)
+
+# Returns None if not there or not compatible
+def loadCondorQSnapshot(fname):
+    return loadVersionedPickle(fname)
+
+# atomic, readers never see a partial file
+def writePickle(fname, data):
+    tmp_fname = "%s.tmp" % fname
+    fd = open(tmp_fname, "wb")
+    try:
+        cPickle.dump(data, fd, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fd.close()
+    os.rename(tmp_fname, fname)
+
+# Returns None if not there or not compatible
+def loadVersionedPickle(fname):
+    try:
+        fd = open(fname, "rb")
+        try:
+            data = cPickle.load(fd)
+        finally:
+            fd.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+    if (type(data) != type({})) or (data.get('version') != CONDORQ_SNAPSHOT_VERSION):
+        return None
+    return data
 
 def getIdleVomsCondorQ(condorq_dict):
     out={}
@@ -161,37 +406,52 @@ def getCondorQUsers(condorq_dict):
 #   that don't match any "real glidein name"
 
 def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, condorq_match_list=None):
-    out_glidein_counts = {}
-    #new_out_counts: keys are site indexes(numbers), 
-    #elements will be the number of real
-    #idle jobs associated with each site
-    new_out_counts = {}
-    glideindex = 0
+    match_matrix=getMatchMatrix(match_obj, condorq_dict, glidein_dict, attr_dict, condorq_match_list)
+    return countMatchMatrix(match_matrix, condorq_dict)
 
+#
+# Evaluate the match expression once for every (job cluster, glidein) pair
+#
+# Jobs with the same attributes (see hashJob) match the same glideins,
+# so the expression is evaluated only on the first job of each cluster
+#
+# Returns:
+#  (list_of_sites, job_masks)
+#    list_of_sites[site_index]=glidein name
+#    job_masks[schedd][jid]=bitmask of the site indexes the job matches
+#
+# The result can be used to count any subset of the jobs in condorq_dict
+# (see countMatchMatrix), without evaluating the expression again
+#
+def getMatchMatrix(match_obj, condorq_dict, glidein_dict, attr_dict, condorq_match_list=None, match_paths=None, match_cache=None):
     schedds=condorq_dict.keys()
-    nr_schedds=len(schedds)
 
-    # find max ProcId
-    max_procid=0
-    for scheddIdx in range(nr_schedds):
-        schedd=schedds[scheddIdx]
-        condorq=condorq_dict[schedd]
-        condorq_data=condorq.fetchStored()
-        for jid in condorq_data.keys():
-          procid=jid[1]
-          if procid>max_procid:
-           max_procid=procid
-    procid_mul=long(max_procid+1)
+    glidein_paths=None
+    if match_paths!=None:
+        (glidein_paths,job_paths)=match_paths
+        job_keys=getPathKeys(job_paths)
+        if job_keys!=None:
+            # only these attributes can make a difference
+            condorq_match_list=job_keys
+    if glidein_paths==None:
+        # no idea what is used, the whole glidein must be the same
+        glidein_paths=[()]
+
+    if match_cache!=None:
+        # results are valid only for the same expression and inputs
+        match_list_str=None
+        if condorq_match_list!=None:
+            match_list_str=repr(list(condorq_match_list))
+        attr_list=attr_dict.items()
+        attr_list.sort()
+        match_cache.start_iteration((marshal.dumps(match_obj),repr(attr_list),match_list_str))
 
     # dict of job clusters
     # group together those that have the same attributes
     cq_dict_clusters={}
-    # set of all jobs
-    cq_jobs=set()
-    for scheddIdx in range(nr_schedds):
-        schedd=schedds[scheddIdx]
-        cq_dict_clusters[scheddIdx]={}
-        cq_dict_clusters_el=cq_dict_clusters[scheddIdx]
+    for schedd in schedds:
+        cq_dict_clusters[schedd]={}
+        cq_dict_clusters_el=cq_dict_clusters[schedd]
         condorq=condorq_dict[schedd]
         condorq_data=condorq.fetchStored()
         for jid in condorq_data.keys():
@@ -199,87 +459,279 @@ def countMatch(match_obj, condorq_dict, glidein_dict, attr_dict, condorq_match_l
             if not cq_dict_clusters_el.has_key(jh):
                 cq_dict_clusters_el[jh]=[]
             cq_dict_clusters_el[jh].append(jid)
-            t=(jid[0]*procid_mul+jid[1])*nr_schedds+scheddIdx
-            cq_jobs.add(t)
 
-    list_of_all_jobs = []
+    #list_of_sites[site_index]=site
+    list_of_sites=glidein_dict.keys()
 
-    for glidename in glidein_dict:
-        glidein=glidein_dict[glidename]
-        glidein_count=0
-        jobs_arr=[]
-        for scheddIdx in range(nr_schedds):
-            schedd=schedds[scheddIdx]
-            cq_dict_clusters_el=cq_dict_clusters[scheddIdx]
+    # group together the glideins that have the same values
+    # for all the attributes the match expression looks at
+    # glidein_groups[signature]=[bitmask of the sites, first glidein]
+    glidein_groups={}
+    for site_index in range(len(list_of_sites)):
+        glidein=glidein_dict[list_of_sites[site_index]]
+        signature=getPathSignature(glidein,glidein_paths)
+        if not glidein_groups.has_key(signature):
+            glidein_groups[signature]=[0L,glidein]
+        glidein_groups[signature][0]|=1L<<site_index
+
+    # bitmask of the sites each job cluster matches
+    cluster_masks={}
+    for schedd in schedds:
+        cluster_masks[schedd]={}
+    for signature in glidein_groups.keys():
+        # evaluate using the first glidein, the result is valid for the whole group
+        (site_bit,glidein)=glidein_groups[signature]
+        for schedd in schedds:
+            cq_dict_clusters_el=cq_dict_clusters[schedd]
+            cluster_masks_el=cluster_masks[schedd]
             condorq=condorq_dict[schedd]
             condorq_data=condorq.fetchStored()
-            schedd_count=0
-            sjobs_arr=[]
             for jh in cq_dict_clusters_el.keys():
-                # get the first job... they are all the same
-                first_jid=cq_dict_clusters_el[jh][0]
-                job=condorq_data[first_jid]
-                if eval(match_obj):
-                    # the first matched... add all jobs in the cluster
-                    cluster_arr=[]
-                    for jid in cq_dict_clusters_el[jh]:
-                        t=(jid[0]*procid_mul+jid[1])*nr_schedds+scheddIdx
-                        cluster_arr.append(t)
-                        schedd_count+=1
-                    # adding a whole cluster much faster
-                    sjobs_arr+=cluster_arr
-                    del cluster_arr
-                    pass
-                pass
-            jobs_arr+=sjobs_arr
-            del sjobs_arr
-            glidein_count+=schedd_count
-            pass    
-        jobs=set(jobs_arr)
-        del jobs_arr
-        list_of_all_jobs.append(jobs)
-        out_glidein_counts[glidename]=glidein_count
-        pass
+                matched=None
+                if match_cache!=None:
+                    matched=match_cache.lookup(signature,jh)
+                if matched==None:
+                    # get the first job... they are all the same
+                    first_jid=cq_dict_clusters_el[jh][0]
+                    job=condorq_data[first_jid]
+                    matched=bool(eval(match_obj))
+                    if match_cache!=None:
+                        match_cache.store(signature,jh,matched)
+                if matched:
+                    # the first matched... the whole cluster does
+                    cluster_masks_el[jh]=cluster_masks_el.get(jh,0L)|site_bit
+
+    nr_clusters=0
+    for schedd in schedds:
+        nr_clusters+=len(cq_dict_clusters[schedd])
+    logSupport.log.debug("Match: %i glideins in %i groups, %i job clusters" % (len(list_of_sites),len(glidein_groups),nr_clusters))
+
+    # propagate the mask to all the jobs of the cluster
+    job_masks={}
+    for schedd in schedds:
+        job_masks[schedd]={}
+        job_masks_el=job_masks[schedd]
+        cq_dict_clusters_el=cq_dict_clusters[schedd]
+        cluster_masks_el=cluster_masks[schedd]
+        for jh in cq_dict_clusters_el.keys():
+            mask=cluster_masks_el.get(jh,0L)
+            for jid in cq_dict_clusters_el[jh]:
+                job_masks_el[jid]=mask
+
+    return (list_of_sites,job_masks)
+
+#
+# Cache of the match results, valid across iterations
+#
+# Keyed by glidein signature (see getPathSignature) and job cluster (see hashJob)
+# Used by getMatchMatrix, that is normally run in a child process;
+# the child sends back get_update(), and the parent merges it with apply_update()
+#
+class MatchCache:
+    def __init__(self,max_size=500000):
+        self.max_size=max_size
+        self.version=None
+        self.data={}      # glidein signature -> {job cluster: bool}
+        self.size=0
+        self.reset_iteration()
+
+    def reset_iteration(self):
+        self.new_data={}  # same as data, only the results computed in this iteration
+        self.used_signatures={}
+        self.hits=0
+        self.misses=0
+
+    def clear(self):
+        self.data={}
+        self.size=0
+
+    # the match expression, or anything else it depends on, changed
+    def check_version(self,version):
+        if version!=self.version:
+            self.clear()
+            self.version=version
+
+    def start_iteration(self,version):
+        self.check_version(version)
+        self.reset_iteration()
+
+    # returns None if not known
+    def lookup(self,signature,cluster_key):
+        self.used_signatures[signature]=True
+        if self.data.has_key(signature):
+            data_el=self.data[signature]
+            if data_el.has_key(cluster_key):
+                self.hits+=1
+                return data_el[cluster_key]
+        self.misses+=1
+        return None
+
+    def store(self,signature,cluster_key,matched):
+        if not self.data.has_key(signature):
+            self.data[signature]={}
+        if not self.data[signature].has_key(cluster_key):
+            self.size+=1
+        self.data[signature][cluster_key]=matched
+        if not self.new_data.has_key(signature):
+            self.new_data[signature]={}
+        self.new_data[signature][cluster_key]=matched
+
+    def get_update(self):
+        return {'version':self.version,
+                'new':self.new_data,
+                'signatures':self.used_signatures.keys(),
+                'hits':self.hits,'misses':self.misses}
+
+    def apply_update(self,update):
+        self.check_version(update['version'])
+        self.reset_iteration()
+        self.hits=update['hits']
+        self.misses=update['misses']
+
+        # forget the glideins that are gone (or whose attributes changed)
+        old_data=self.data
+        self.clear()
+        for signature in update['signatures']:
+            if old_data.has_key(signature):
+                self.data[signature]=old_data[signature]
+                self.size+=len(self.data[signature])
+        del old_data
+
+        new_data=update['new']
+        for signature in new_data.keys():
+            if not self.data.has_key(signature):
+                self.data[signature]={}
+            data_el=self.data[signature]
+            new_el=new_data[signature]
+            for cluster_key in new_el.keys():
+                if not data_el.has_key(cluster_key):
+                    self.size+=1
+                data_el[cluster_key]=new_el[cluster_key]
+
+        if self.size>self.max_size:
+            # jobs that left the queue are never removed, so start from scratch from time to time
+            self.clear()
+
+    def get_stats_str(self):
+        lookups=self.hits+self.misses
+        ratio=0.0
+        if lookups>0:
+            ratio=100.0*self.hits/lookups
+        return "%i hits, %i misses (%.1f%% hit ratio), %i entries" % (self.hits,self.misses,ratio,self.size)
+
+#
+# Find which glidein and job attributes a match expression uses
+#
+# Returns:
+#  (glidein_paths, job_paths)
+#   each a list of subscript paths, e.g. [('attrs','GLIDEIN_Site')] (see exprParser.get_subscript_paths)
+#   or None if it could not be determined
+#
+def getMatchPaths(match_expr):
+    try:
+        match_ast=exprParser.parse(match_expr)
+    except:
+        logSupport.log.exception("Failed to parse the match expression, cannot optimize matching: ")
+        return (None,None)
+    return (exprParser.get_subscript_paths(match_ast,'glidein'),
+            exprParser.get_subscript_paths(match_ast,'job'))
+
+#
+# Convert single element paths into a list of keys
+# Returns None if any path is longer or shorter than that
+#
+def getPathKeys(paths):
+    if paths==None:
+        return None
+    keys=[]
+    for path in paths:
+        if len(path)!=1:
+            return None
+        keys.append(path[0])
+    return keys
+
+#
+# Return a hashable value representing the values of el at the given paths
+# Two elements with the same signature are indistinguishable
+# by any expression that uses only those paths
+#
+def getPathSignature(el,paths):
+    values=[]
+    for path in paths:
+        val=el
+        try:
+            for p in path:
+                val=val[p]
+        except (KeyError,IndexError,TypeError):
+            values.append(('',None)) # no type has an empty name
+            continue
+        values.append(getPlainSignature(val))
+    return tuple(values)
+
+#
+# Return a hashable value made only of the plain values in val
+# Dictionaries are sorted by key, and objects (like PubKeyObj)
+# are skipped, as their repr changes in every iteration
+#
+def getPlainSignature(val):
+    if isinstance(val,(str,unicode,int,long,float,bool,type(None))):
+        # keep the type, as 1, 1.0 and True would look the same otherwise
+        # use the name, so that the signature can be pickled
+        return (type(val).__name__,val)
+    if isinstance(val,(list,tuple)):
+        return (type(val).__name__,tuple(map(getPlainSignature,val)))
+    if isinstance(val,dict):
+        keys=val.keys()
+        keys.sort()
+        items=[]
+        for k in keys:
+            el=getPlainSignature(val[k])
+            if el[0]!='object':
+                items.append((k,el))
+        return ('dict',tuple(items))
+    return ('object',None)
+
+#
+# Same as countMatch, but using the output of getMatchMatrix
+#
+# condorq_dict must be a subset of the one used to create the match_matrix
+#
+def countMatchMatrix(match_matrix, condorq_dict):
+    (list_of_sites,job_masks)=match_matrix
 
-    (outvals,jrange) = uniqueSets(list_of_all_jobs)
-    del list_of_all_jobs
-    count_unmatched=len(cq_jobs-jrange)
+    # jobs are fully characterized by the sites they match
+    # so just count how many jobs have each mask
+    mask_counts={}
+    nr_jobs=0
+    for schedd in condorq_dict.keys():
+        job_masks_el=job_masks[schedd]
+        condorq_data=condorq_dict[schedd].fetchStored()
+        for jid in condorq_data.keys():
+            mask=job_masks_el[jid]
+            if mask:
+                mask_counts[mask]=mask_counts.get(mask,0)+1
+        nr_jobs+=len(condorq_data)
 
+    #new_out_counts: keys are site indexes(numbers), 
+    #elements will be the number of real
+    #idle jobs associated with each site
     #unique_to_site: keys are sites, elements are num of unique jobs
-    unique_to_site = {}
-    #each tuple contains ([list of site_indexes],jobs associated with those sites)
-    #this loop necessary to avoid key error
-    for tuple in outvals:
-        for site_index in tuple[0]:
-            new_out_counts[site_index]=0.0
-            unique_to_site[site_index]=0
-    #for every tuple of([site_index],jobs), cycle through each site index
-    #new_out_counts[site_index] is the number of jobs over the number
-    #of indexes, may not be an integer.
-    for tuple in outvals:
-        for site_index in tuple[0]:
-            new_out_counts[site_index]=new_out_counts[site_index]+(1.0*len(tuple[1])/len(tuple[0]))
-        #if the site has jobs unique to it
-        if len(tuple[0])==1:
-            temp_sites=tuple[0]
-            unique_to_site[temp_sites.pop()]=len(tuple[1])
-    #create a list of all sites, list_of_sites[site_index]=site
-    list_of_sites=[]
-    i=0
-    for glidename in glidein_dict:
-        list_of_sites.append(0)
-        list_of_sites[i]=glidename
-        i=i+1
+    (match_counts,new_out_counts,unique_to_site,count_matched)=countMasks(mask_counts)
+    count_unmatched=nr_jobs-count_matched
+
+    out_glidein_counts={}
     final_out_counts={}
     final_unique={}
     # new_out_counts to final_out_counts
     # unique_to_site to final_unique
     # keys go from site indexes to sites
-    for glidename in glidein_dict:
+    for glidename in list_of_sites:
+        out_glidein_counts[glidename]=0
         final_out_counts[glidename]=0
         final_unique[glidename]=0
     for site_index in new_out_counts:
         site=list_of_sites[site_index]
+        out_glidein_counts[site]=match_counts[site_index]
         final_out_counts[site]=math.ceil(new_out_counts[site_index])
         final_unique[site]=unique_to_site[site_index]
 
@@ -427,19 +879,20 @@ def countCondorStatus(status_dict):
 # If not all the jobs of the schedd has to be considered,
 # specify the appropriate additional constraint
 #
-def getCondorQConstrained(schedd_names, type_constraint, constraint=None, format_list=None):
-    out_condorq_dict = {}
+def getCondorQConstrained(schedd_names, type_constraint, constraint=None, format_list=None, compact_results=False):
+    full_constraint = type_constraint[0:] #make copy
+    if constraint != None:
+        full_constraint = "(%s) && (%s)" % (full_constraint, constraint)
+
+    query_list = []
     for schedd in schedd_names:
         if schedd == '':
             logSupport.log.warning("Skipping empty schedd name")
             continue
-        full_constraint = type_constraint[0:] #make copy
-        if constraint != None:
-            full_constraint = "(%s) && (%s)" % (full_constraint, constraint)
 
         try:
             condorq = condorMonitor.CondorQ(schedd)
-            condorq.load(full_constraint, format_list)
+            condorq.use_compact_results(compact_results)
         except condorExe.ExeError:
             logSupport.log.exception("Condor Error.  Failed to talk to schedd: ")
             continue # if schedd not found it is equivalent to no jobs in the queue        
@@ -448,9 +901,21 @@ def getCondorQConstrained(schedd_names, type_constraint, constraint=None, format
             continue
         except Exception:
             logSupport.log.exception("Unknown Exception.  Failed to talk to schedd: ")
+            continue
+        query_list.append((condorq, full_constraint, format_list))
+
+    # all the schedds are queried in parallel
+    out_condorq_dict = {}
+    errors = condorMonitor.loadMulti(query_list, queryConfig.max_parallel, queryConfig.timeout)
+    for i in range(len(query_list)):
+        condorq = query_list[i][0]
+        if errors[i] != None:
+            # if schedd not found it is equivalent to no jobs in the queue
+            logSupport.log.warning("Condor Error.  Failed to talk to schedd %s: %s" % (condorq.schedd_name, errors[i]))
+            continue
 
         if len(condorq.fetchStored()) > 0:
-            out_condorq_dict[schedd] = condorq
+            out_condorq_dict[condorq.schedd_name] = condorq
             
     return out_condorq_dict
 
@@ -462,23 +927,26 @@ def getCondorQConstrained(schedd_names, type_constraint, constraint=None, format
 # specify the appropriate additional constraint
 #
 def getCondorStatusConstrained(collector_names, type_constraint, constraint=None, format_list=None):
-    out_status_dict = {}
+    full_constraint = type_constraint[0:] #make copy
+    if constraint != None:
+        full_constraint = "(%s) && (%s)" % (full_constraint, constraint)
+
+    query_list = []
     for collector in collector_names:
-        full_constraint = type_constraint[0:] #make copy
-        if constraint != None:
-            full_constraint = "(%s) && (%s)" % (full_constraint, constraint)
+        query_list.append((condorMonitor.CondorStatus(pool_name=collector), full_constraint, format_list))
 
-        try:
-            status = condorMonitor.CondorStatus(pool_name=collector)
-            status.load(full_constraint, format_list)
-        except condorExe.ExeError:
+    # all the collectors are queried in parallel
+    out_status_dict = {}
+    errors = condorMonitor.loadMulti(query_list, queryConfig.max_parallel, queryConfig.timeout)
+    for i in range(len(query_list)):
+        collector = collector_names[i]
+        status = query_list[i][0]
+        if errors[i] != None:
+            # if collector not found it is equivalent to no classads
             if collector != None:
-                logSupport.log.exception("Condor Error. Failed to talk to collector %s: " % collector)
+                logSupport.log.warning("Condor Error. Failed to talk to collector %s: %s" % (collector, errors[i]))
             else:
-                logSupport.log.exception("Condor Error. Failed to talk to collector: ")
-            continue # if collector not found it is equivalent to no classads      
-        except RuntimeError:
-            logSupport.log.exception("Runtime error. Failed to talk to collector: ")
+                logSupport.log.warning("Condor Error. Failed to talk to collector: %s" % errors[i])
             continue
         
         if len(status.fetchStored()) > 0:
@@ -509,71 +977,73 @@ def getCondorStatusConstrained(collector_names, type_constraint, constraint=None
 #
 def uniqueSets(in_sets):
     #sets is a list of sets
-    sorted_sets = []
-    for i in in_sets:
-        common_list = []
-        common = set()
-        new_unique = set()
-        old_unique_list = []
-        old_unique = set()
-        new = []
-        #make a list of the elements common to i
-        #(current iteration of sets) and the existing
-        #sorted sets
-        for k in sorted_sets:
-            #for now, old unique is a set with all elements of
-            #sorted_sets
-            old_unique = old_unique | k
-            common = k & i
-            if common:
-                common_list.append(common)
-            else:
-                pass
-        #figure out which elements in i
-        # and which elements in old_uniques are unique
-        for j in common_list:
-            i = i - j
-            old_unique = old_unique - j
-        #make a list of all the unique elements in sorted_sets
-        for k in sorted_sets:
-            old_unique_list.append(k & old_unique)
-        new_unique = i
-        if new_unique:
-            new.append(new_unique)
-        for o in old_unique_list:
-            if o:
-                new.append(o)
-        for c in common_list:
-            if c:
-                new.append(c)
-        sorted_sets = new
-
-    # set with all unique elements
-    sum_set = set()
-    for s in sorted_sets:
-        sum_set = sum_set | s
-
-
-    sorted_sets.append(sum_set)
-
-    # index_list is a list of lists. Each list corresponds to 
-    # an element in sorted_sets, and contains the indexes of 
-    # that elements shared elements in the initial list of sets
-    index_list = []
-    for s in sorted_sets:
-        indexes = []
-        temp_sets = in_sets[:]
-        for t in temp_sets:
-            if s & t:
-                indexes.append(temp_sets.index(t))
-                temp_sets[temp_sets.index(t)] = set()
-        index_list.append(indexes)
+    # each element is characterized by the bitmask of the sets it belongs to
+    el_masks={}
+    for i in range(len(in_sets)):
+        set_bit=1L<<i
+        for el in in_sets[i]:
+            el_masks[el]=el_masks.get(el,0L)|set_bit
+
+    # elements with the same mask form one of the unique subsets
+    mask_els={}
+    for el in el_masks.keys():
+        mask=el_masks[el]
+        if not mask_els.has_key(mask):
+            mask_els[mask]=[]
+        mask_els[mask].append(el)
 
     # create output
     outvals = []
-    for i in range(len(index_list) - 1): # last one contains all the values
-        outvals.append((set(index_list[i]), sorted_sets[i]))
-    return (outvals, sorted_sets[-1])
+    for mask in mask_els.keys():
+        outvals.append((set(maskIndexes(mask)), set(mask_els[mask])))
+    return (outvals, set(el_masks.keys()))
+
+#
+# Return the list of the indexes of the bits set in mask
+#
+def maskIndexes(mask):
+    indexes=[]
+    i=0
+    while mask:
+        if mask & 0xff:
+            for j in range(8):
+                if (mask>>j) & 1:
+                    indexes.append(i+j)
+        mask>>=8
+        i+=8
+    return indexes
+
+#
+# Share the elements among the sets
+# Input: dictionary, bitmask of the set indexes => number of elements with that mask
+#        (i.e. the sets of uniqueSets, represented by their size)
+# Output: (match_counts, prop_counts, unique_counts, nr_elements)
+#   match_counts: set index => elements in the set
+#   prop_counts: set index => elements in the set, each divided by the number of sets it belongs to
+#   unique_counts: set index => elements belonging only to this set
+#   nr_elements: total number of elements
+#   Only the indexes of non-empty sets are present
+#
+def countMasks(mask_counts):
+    match_counts={}
+    prop_counts={}
+    unique_counts={}
+    nr_elements=0
+    for mask in mask_counts.keys():
+        count=mask_counts[mask]
+        indexes=maskIndexes(mask)
+        share=1.0*count/len(indexes)
+        for i in indexes:
+            if not prop_counts.has_key(i):
+                match_counts[i]=0
+                prop_counts[i]=0.0
+                unique_counts[i]=0
+            match_counts[i]+=count
+            prop_counts[i]+=share
+        if len(indexes)==1:
+            unique_counts[indexes[0]]=count
+        nr_elements+=count
+    return (match_counts,prop_counts,unique_counts,nr_elements)
 
 def hashJob(condorq_el, condorq_match_list=None):
     out=[]
@@ -0,0 +1,592 @@
+#
+# Project:
+#   glideinWMS
+#
+# File Version:
+#
+# Description:
+#   Python side evaluation of ClassAd constraints
+#   Only the subset of the language used in query expressions
+#   (like the frontend JobQueryExpr) is supported;
+#   anything else raises ValueError at parse time,
+#   so the caller can fall back to let condor evaluate it
+#
+#   The ads are dictionaries (or anything with get and keys),
+#   like the elements returned by condorMonitor
+#
+
+import re
+import string
+
+############################################################
+#
+# Special values
+#
+############################################################
+
+class SpecialValue:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+UNDEFINED = SpecialValue("UNDEFINED")
+ERROR = SpecialValue("ERROR")
+
+#
+# The value of an attribute that is itself an expression
+# (sent as <e> in the condor XML); it behaves like the string
+# of the expression, but cannot be evaluated here
+#
+class ExprValue(str):
+    __slots__ = ()
+
+    def __repr__(self):
+        return "ExprValue(%s)" % str.__repr__(self)
+
+#
+# Raised when evaluating a constraint that references an ExprValue
+# The caller should let condor evaluate the constraint instead
+#
+class NotEvaluable(Exception):
+    pass
+
+############################################################
+#
+# Public
+#
+############################################################
+
+#
+# Compiled constraint
+#
+# Can be used directly as a constraint function in condorMonitor,
+# i.e. calling it with an ad returns True or False
+#
+class Constraint:
+    def __init__(self, expr_str):
+        self.expr_str = expr_str
+        parser = ExprParser(expr_str)
+        self.eval_fn = parser.parse()
+        # the attributes referenced by the expression
+        self.attrs = parser.attrs
+
+    # Returns the ClassAd value of the expression
+    # (possibly UNDEFINED or ERROR)
+    def evaluate(self, ad):
+        return self.eval_fn(ad)
+
+    # Returns True only if the expression evaluates to true,
+    # like the condor -constraint option does
+    # Both raise NotEvaluable if a referenced attribute is an expression
+    def __call__(self, ad):
+        return isTrue(self.eval_fn(ad))
+
+    def __repr__(self):
+        return "Constraint(%s)" % repr(self.expr_str)
+
+def isTrue(val):
+    t = type(val)
+    if t == bool:
+        return val
+    if t in NUMBER_TYPES:
+        return val != 0
+    return False
+
+############################################################
+#
+# P R I V A T E, do not use
+#
+############################################################
+
+NUMBER_TYPES = (int, long, float)
+STRING_TYPES = (str, unicode)
+
+# Returns True, False, UNDEFINED or ERROR
+def toBool(val):
+    t = type(val)
+    if t == bool:
+        return val
+    if t in NUMBER_TYPES:
+        return (val != 0)
+    if (val is UNDEFINED) or (val is ERROR):
+        return val
+    return ERROR
+
+# bools are numbers when compared, like in condor
+def isNumber(val):
+    return (type(val) in NUMBER_TYPES) or (type(val) == bool)
+
+def isString(val):
+    return type(val) in STRING_TYPES
+
+# Returns the ClassAd type name, used by =?=
+def typeName(val):
+    t = type(val)
+    if t == bool:
+        return 'bool'
+    if t in (int, long):
+        return 'int'
+    if t == float:
+        return 'real'
+    if t in STRING_TYPES:
+        return 'string'
+    return repr(val)
+
+############################################################
+# Operators
+# All take values, not expressions
+
+def opEqual(l, r):
+    if (l is ERROR) or (r is ERROR):
+        return ERROR
+    if (l is UNDEFINED) or (r is UNDEFINED):
+        return UNDEFINED
+    if isString(l) and isString(r):
+        return l.lower() == r.lower()
+    if isNumber(l) and isNumber(r):
+        return l == r
+    return ERROR
+
+def opNotEqual(l, r):
+    out = opEqual(l, r)
+    if type(out) == bool:
+        return not out
+    return out
+
+def opIs(l, r):
+    lt = typeName(l)
+    if lt != typeName(r):
+        return False
+    if (l is UNDEFINED) or (l is ERROR):
+        return True # same special value
+    return l == r # case sensitive for strings
+
+def opIsnt(l, r):
+    return not opIs(l, r)
+
+def makeCompare(cmp_fn):
+    def compare(l, r):
+        if (l is ERROR) or (r is ERROR):
+            return ERROR
+        if (l is UNDEFINED) or (r is UNDEFINED):
+            return UNDEFINED
+        if isString(l) and isString(r):
+            return cmp_fn(l.lower(), r.lower())
+        if isNumber(l) and isNumber(r):
+            return cmp_fn(l, r)
+        return ERROR
+    return compare
+
+def makeArith(arith_fn):
+    def arith(l, r):
+        if (l is ERROR) or (r is ERROR):
+            return ERROR
+        if (l is UNDEFINED) or (r is UNDEFINED):
+            return UNDEFINED
+        if (type(l) in NUMBER_TYPES) and (type(r) in NUMBER_TYPES):
+            try:
+                return arith_fn(l, r)
+            except ZeroDivisionError:
+                return ERROR
+        return ERROR
+    return arith
+
+def intDiv(l, r):
+    if (type(l) == float) or (type(r) == float):
+        return l / r
+    # C-like, truncate toward zero
+    out = abs(l) // abs(r)
+    if (l < 0) != (r < 0):
+        out = -out
+    return out
+
+def intMod(l, r):
+    if (type(l) == float) or (type(r) == float):
+        raise ZeroDivisionError, "Modulo of reals"
+    return l - r * intDiv(l, r)
+
+BINARY_OPS = {'==':opEqual, '!=':opNotEqual,
+              '=?=':opIs, '=!=':opIsnt,
+              '<':makeCompare(lambda l, r:l < r),
+              '<=':makeCompare(lambda l, r:l <= r),
+              '>':makeCompare(lambda l, r:l > r),
+              '>=':makeCompare(lambda l, r:l >= r),
+              '+':makeArith(lambda l, r:l + r),
+              '-':makeArith(lambda l, r:l - r),
+              '*':makeArith(lambda l, r:l * r),
+              '/':makeArith(intDiv),
+              '%':makeArith(intMod)}
+
+############################################################
+# Functions
+# All take values, not expressions
+
+def fnStringListMember(args, ignore_case):
+    if not (len(args) in (2, 3)):
+        return ERROR
+    for a in args:
+        if a is UNDEFINED:
+            return UNDEFINED
+        if not isString(a):
+            return ERROR
+    s = args[0]
+    str_list = args[1]
+    if len(args) == 3:
+        delims = args[2]
+    else:
+        delims = " ,"
+    if ignore_case:
+        s = s.lower()
+        str_list = str_list.lower()
+    for delim in delims[1:]:
+        str_list = str_list.replace(delim, delims[0])
+    for el in str_list.split(delims[0]):
+        el = el.strip()
+        if (el != "") and (el == s): # like condor, empty items are not members
+            return True
+    return False
+
+REGEXP_OPTIONS = {'i':re.IGNORECASE, 'm':re.MULTILINE, 's':re.DOTALL, 'x':re.VERBOSE}
+
+def fnRegexp(args):
+    if not (len(args) in (2, 3)):
+        return ERROR
+    for a in args:
+        if a is UNDEFINED:
+            return UNDEFINED
+        if not isString(a):
+            return ERROR
+    flags = 0
+    if len(args) == 3:
+        for c in args[2].lower():
+            flags |= REGEXP_OPTIONS.get(c, 0)
+    try:
+        return re.search(args[0], args[1], flags) != None
+    except re.error:
+        return ERROR
+
+def makeTypeCheck(check_fn):
+    def type_check(args):
+        if len(args) != 1:
+            return ERROR
+        return check_fn(args[0])
+    return type_check
+
+def makeStringFn(str_fn):
+    def string_fn(args):
+        if len(args) != 1:
+            return ERROR
+        a = args[0]
+        if a is UNDEFINED:
+            return UNDEFINED
+        if not isString(a):
+            return ERROR
+        return str_fn(a)
+    return string_fn
+
+def fnStrcat(args):
+    out = []
+    for a in args:
+        if a is UNDEFINED:
+            return UNDEFINED
+        if isString(a):
+            out.append(a)
+        elif type(a) == bool:
+            out.append(str(a).lower())
+        elif type(a) in NUMBER_TYPES:
+            out.append(str(a))
+        else:
+            return ERROR
+    return string.join(out, "")
+
+# ifThenElse is special, since it must not evaluate the unused branch
+# The names are lowercase, since function names are case insensitive
+FUNCTIONS = {'stringlistmember':lambda args:fnStringListMember(args, False),
+             'stringlistimember':lambda args:fnStringListMember(args, True),
+             'regexp':fnRegexp,
+             'isundefined':makeTypeCheck(lambda a:a is UNDEFINED),
+             'iserror':makeTypeCheck(lambda a:a is ERROR),
+             'isstring':makeTypeCheck(isString),
+             'isinteger':makeTypeCheck(lambda a:type(a) in (int, long)),
+             'isreal':makeTypeCheck(lambda a:type(a) == float),
+             'isboolean':makeTypeCheck(lambda a:type(a) == bool),
+             'tolower':makeStringFn(lambda a:a.lower()),
+             'toupper':makeStringFn(lambda a:a.upper()),
+             'size':makeStringFn(len),
+             'strcat':fnStrcat}
+
+############################################################
+# Parser
+#
+# Recursive descent, producing a tree of closures
+# Precedence, from the lowest:
+#  ?: || && (== != =?= =!=) (< <= > >=) (+ -) (* / %) unary
+
+TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<real>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+) |
+    (?P<int>\d+) |
+    (?P<string>"(?:[^"\\]|\\.)*") |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*) |
+    (?P<op>=\?=|=!=|==|!=|<=|>=|&&|\|\||[<>!+\-*/%()?:,.])
+    )""", re.VERBOSE)
+
+STRING_ESCAPES = {'n':'\n', 't':'\t', 'r':'\r', '\\':'\\', '"':'"'}
+
+KEYWORDS = {'true':True, 'false':False, 'undefined':UNDEFINED, 'error':ERROR}
+
+def unescapeString(s):
+    out = []
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if (c == '\\') and (i + 1 < len(s)):
+            i += 1
+            c = STRING_ESCAPES.get(s[i], s[i])
+        out.append(c)
+        i += 1
+    return string.join(out, "")
+
+def tokenize(expr_str):
+    tokens = []
+    pos = 0
+    expr_str = expr_str.rstrip()
+    while pos < len(expr_str):
+        m = TOKEN_RE.match(expr_str, pos)
+        if m == None:
+            raise ValueError, "Cannot parse '%s' at position %i" % (expr_str, pos)
+        pos = m.end()
+        for kind in ('real', 'int', 'string', 'name', 'op'):
+            val = m.group(kind)
+            if val != None:
+                if kind == 'real':
+                    val = float(val)
+                elif kind == 'int':
+                    val = int(val)
+                elif kind == 'string':
+                    val = unescapeString(val[1:-1])
+                elif (kind == 'name') and (val.lower() in ('is', 'isnt')):
+                    # keyword versions of the meta operators
+                    kind = 'op'
+                    val = {'is':'=?=', 'isnt':'=!='}[val.lower()]
+                tokens.append((kind, val))
+                break
+    return tokens
+
+class ExprParser:
+    def __init__(self, expr_str):
+        self.expr_str = expr_str
+        self.tokens = tokenize(expr_str)
+        self.pos = 0
+        self.attrs = []
+        self.attrs_lower = {}
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            raise ValueError, "Empty expression"
+        out = self.parseTernary()
+        if self.pos != len(self.tokens):
+            raise ValueError, "Unexpected '%s' in '%s'" % (self.tokens[self.pos][1], self.expr_str)
+        return out
+
+    #
+    # Token helpers
+    #
+
+    def peekOp(self):
+        if (self.pos < len(self.tokens)) and (self.tokens[self.pos][0] == 'op'):
+            return self.tokens[self.pos][1]
+        return None
+
+    def expectOp(self, op):
+        if self.peekOp() != op:
+            raise ValueError, "Expected '%s' in '%s'" % (op, self.expr_str)
+        self.pos += 1
+
+    #
+    # Grammar
+    #
+
+    def parseTernary(self):
+        cond = self.parseOr()
+        if self.peekOp() != '?':
+            return cond
+        self.pos += 1
+        if_true = self.parseTernary()
+        self.expectOp(':')
+        if_false = self.parseTernary()
+        return makeIfThenElse(cond, if_true, if_false)
+
+    def parseOr(self):
+        left = self.parseAnd()
+        while self.peekOp() == '||':
+            self.pos += 1
+            left = makeOr(left, self.parseAnd())
+        return left
+
+    def parseAnd(self):
+        left = self.parseEquality()
+        while self.peekOp() == '&&':
+            self.pos += 1
+            left = makeAnd(left, self.parseEquality())
+        return left
+
+    def parseBinary(self, ops, parse_operand):
+        left = parse_operand()
+        while self.peekOp() in ops:
+            op = self.peekOp()
+            self.pos += 1
+            left = makeBinary(BINARY_OPS[op], left, parse_operand())
+        return left
+
+    def parseEquality(self):
+        return self.parseBinary(('==', '!=', '=?=', '=!='), self.parseRelational)
+
+    def parseRelational(self):
+        return self.parseBinary(('<', '<=', '>', '>='), self.parseAdditive)
+
+    def parseAdditive(self):
+        return self.parseBinary(('+', '-'), self.parseMultiplicative)
+
+    def parseMultiplicative(self):
+        return self.parseBinary(('*', '/', '%'), self.parseUnary)
+
+    def parseUnary(self):
+        op = self.peekOp()
+        if op == '!':
+            self.pos += 1
+            return makeNot(self.parseUnary())
+        elif op == '-':
+            self.pos += 1
+            return makeBinary(BINARY_OPS['-'], lambda ad:0, self.parseUnary())
+        elif op == '+':
+            self.pos += 1
+            return self.parseUnary()
+        return self.parsePrimary()
+
+    def parsePrimary(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError, "Unexpected end of '%s'" % self.expr_str
+        kind, val = self.tokens[self.pos]
+        self.pos += 1
+        if kind in ('int', 'real', 'string'):
+            return lambda ad:val
+        elif kind == 'op':
+            if val != '(':
+                raise ValueError, "Unexpected '%s' in '%s'" % (val, self.expr_str)
+            out = self.parseTernary()
+            self.expectOp(')')
+            return out
+
+        # a name
+        lval = val.lower()
+        if self.peekOp() == '(':
+            self.pos += 1
+            return self.parseCall(lval)
+        if KEYWORDS.has_key(lval):
+            kval = KEYWORDS[lval]
+            return lambda ad:kval
+        if self.peekOp() == '.':
+            # scoped reference; the ad being evaluated is MY
+            if lval != 'my':
+                raise ValueError, "Unsupported scope '%s' in '%s'" % (val, self.expr_str)
+            self.pos += 1
+            if (self.pos >= len(self.tokens)) or (self.tokens[self.pos][0] != 'name'):
+                raise ValueError, "Expected an attribute name in '%s'" % self.expr_str
+            val = self.tokens[self.pos][1]
+            self.pos += 1
+        return self.makeAttr(val)
+
+    def parseCall(self, fname):
+        args = []
+        if self.peekOp() != ')':
+            args.append(self.parseTernary())
+            while self.peekOp() == ',':
+                self.pos += 1
+                args.append(self.parseTernary())
+        self.expectOp(')')
+
+        if fname == 'ifthenelse':
+            if len(args) != 3:
+                raise ValueError, "ifThenElse needs 3 arguments in '%s'" % self.expr_str
+            return makeIfThenElse(args[0], args[1], args[2])
+        if not FUNCTIONS.has_key(fname):
+            raise ValueError, "Unsupported function '%s' in '%s'" % (fname, self.expr_str)
+        fn = FUNCTIONS[fname]
+        return lambda ad:fn([a(ad) for a in args])
+
+    def makeAttr(self, name):
+        lname = name.lower()
+        if not self.attrs_lower.has_key(lname):
+            self.attrs_lower[lname] = name
+            self.attrs.append(name)
+        return makeAttrLookup(name)
+
+############################################################
+# Closure builders
+
+# attribute names are case insensitive
+# try the exact spelling first, since it is the common case
+def makeAttrLookup(name):
+    lname = name.lower()
+    def lookup(ad):
+        val = ad.get(name, UNDEFINED)
+        if val is UNDEFINED:
+            for k in ad.keys():
+                if k.lower() == lname:
+                    val = ad[k]
+                    break
+        if val == None:
+            return UNDEFINED # how condorMonitor stores undefined values
+        if isinstance(val, ExprValue):
+            raise NotEvaluable, "Attribute %s is an expression: %s" % (name, str(val))
+        return val
+    return lookup
+
+def makeBinary(op_fn, left, right):
+    return lambda ad:op_fn(left(ad), right(ad))
+
+def makeNot(arg):
+    def not_fn(ad):
+        val = toBool(arg(ad))
+        if type(val) == bool:
+            return not val
+        return val
+    return not_fn
+
+def makeAnd(left, right):
+    def and_fn(ad):
+        l = toBool(left(ad))
+        if (l is False) or (l is ERROR):
+            return l
+        r = toBool(right(ad))
+        if (r is False) or (r is ERROR):
+            return r
+        if (l is UNDEFINED) or (r is UNDEFINED):
+            return UNDEFINED
+        return True
+    return and_fn
+
+def makeOr(left, right):
+    def or_fn(ad):
+        l = toBool(left(ad))
+        if (l is True) or (l is ERROR):
+            return l
+        r = toBool(right(ad))
+        if (r is True) or (r is ERROR):
+            return r
+        if (l is UNDEFINED) or (r is UNDEFINED):
+            return UNDEFINED
+        return False
+    return or_fn
+
+def makeIfThenElse(cond, if_true, if_false):
+    def if_fn(ad):
+        c = toBool(cond(ad))
+        if c is True:
+            return if_true(ad)
+        elif c is False:
+            return if_false(ad)
+        return c
+    return if_fn
@@ -14,20 +14,22 @@
 
 import os
 import os.path
-import popen2
 import string
 import select
 import cStringIO
 import fcntl
 import time
+import signal
 
 class UnconfigError(RuntimeError):
     def __init__(self,str):
         RuntimeError.__init__(self,str)
 
 class ExeError(RuntimeError):
-    def __init__(self,str):
+    # output_lines is the stdout of the failed command, if available
+    def __init__(self,str,output_lines=None):
         RuntimeError.__init__(self,str)
+        self.output_lines=output_lines
 
 #
 # Configuration
@@ -46,28 +48,52 @@ def set_path(new_condor_bin_path,new_condor_sbin_path=None):
 # Fails if stderr is not empty
 #
 
+# If stdout_callback is defined, stdout is not accumulated
+#  but passed to it chunk by chunk as it arrives, and an empty list is returned
+#
+# args can be either a string, parsed by the shell,
+#  or a list of arguments, executed directly without a shell
+#
 # can throw UnconfigError or ExeError
-def exe_cmd(condor_exe,args,stdin_data=None,env={}):
+def exe_cmd(condor_exe,args,stdin_data=None,env={},stdout_callback=None):
+    cmd=get_exe_cmd(condor_exe,args)
+    return iexe_cmd(cmd,stdin_data,env,stdout_callback)
+
+# Return the command to be used to execute condor_exe,
+# e.g. in ExeCmd
+# A command line string if args is a string, else the argv list
+#
+# can throw UnconfigError
+def get_exe_cmd(condor_exe,args):
     global condor_bin_path
 
     if condor_bin_path==None:
         raise UnconfigError, "condor_bin_path is undefined!"
     condor_exe_path=os.path.join(condor_bin_path,condor_exe)
 
-    cmd="%s %s" % (condor_exe_path,args)
+    return join_exe_cmd(condor_exe_path,args)
 
+def exe_cmd_sbin(condor_exe,args,stdin_data=None,env={}):
+    cmd=get_exe_cmd_sbin(condor_exe,args)
     return iexe_cmd(cmd,stdin_data,env)
 
-def exe_cmd_sbin(condor_exe,args,stdin_data=None,env={}):
+# Same as get_exe_cmd, but relative to $CONDOR_SBIN
+#
+# can throw UnconfigError
+def get_exe_cmd_sbin(condor_exe,args):
     global condor_sbin_path
 
     if condor_sbin_path==None:
         raise UnconfigError, "condor_sbin_path is undefined!"
     condor_exe_path=os.path.join(condor_sbin_path,condor_exe)
 
-    cmd="%s %s" % (condor_exe_path,args)
+    return join_exe_cmd(condor_exe_path,args)
 
-    return iexe_cmd(cmd,stdin_data,env)
+def join_exe_cmd(condor_exe_path,args):
+    if type(args)==type(""):
+        return "%s %s" % (condor_exe_path,args)
+    else:
+        return [condor_exe_path]+list(args)
 
 ############################################################
 #
@@ -76,95 +102,402 @@ def exe_cmd_sbin(condor_exe,args,stdin_data=None,env={}):
 ############################################################
 
 # can throw ExeError
-def iexe_cmd(cmd, stdin_data=None,env={}):
+def iexe_cmd(cmd, stdin_data=None,env={},stdout_callback=None):
     """Fork a process and execute cmd - rewritten to use select to avoid filling
     up stderr and stdout queues.
 
-    @type cmd: string
-    @param cmd: Sting containing the entire command including all arguments
+    @type cmd: string or list
+    @param cmd: Sting containing the entire command including all arguments,
+        executed through /bin/sh, or the argv list, executed directly
     @type stdin_data: string
     @param stdin_data: Data that will be fed to the command via stdin
     @type env: dict
-    @param env: Environment to be set before execution
+    @param env: Environment changes for the command (None means unset);
+        the environment of the calling process is not modified
+    @type stdout_callback: function
+    @param stdout_callback: If defined, called with each stdout chunk as it
+        is read; stdout is then not buffered and [] is returned
     """
-    output_lines = None
-    error_lines = None
-    exitStatus = 0
-    try:
-        saved_env={}
+    out = run_exe_cmds([ExeCmd(cmd, stdin_data, env, stdout_callback)])[0]
+    if isinstance(out, ExeError):
+        raise out
+    return out
+
+class ExeCmd:
+    """
+    A command to be executed, possibly in parallel with others
+    (see run_exe_cmds)
+    The arguments are the same as for iexe_cmd, plus
+
+    @type timeout: int
+    @param timeout: If defined, the command is killed if it runs for longer (in seconds)
+    """
+    def __init__(self, cmd, stdin_data=None, env={}, stdout_callback=None, timeout=None):
+        self.cmd = cmd
+        if type(cmd) == type(""):
+            self.cmd_str = cmd
+        else:
+            self.cmd_str = string.join(cmd, " ") # used in the messages
+        self.stdin_data = stdin_data
+        self.env = env
+        self.stdout_callback = stdout_callback
+        self.timeout = timeout
+
+        self.child = None
+        self.files = {} # fd -> file, for the ones still open
+        self.outdata = None
+        self.errdata = None
+        self.start_time = None
+        self.end_time = None
+
+    # launch the process, do not wait for it
+    # can throw ExeError
+    def start(self):
         try:
-            # save and set the environment
-            for k in env.keys():
-                if os.environ.has_key(k):
-                    saved_env[k]=os.environ[k]
-                    if env[k]==None:
-                        del os.environ[k]
-                else:
-                    saved_env[k]=None
-                if env[k]!=None:
-                    os.environ[k]=env[k]
+            # the changes go to the child only,
+            # the environment of this process is never touched
+            child_env=os.environ.copy()
+            for k in self.env.keys():
+                if self.env[k]!=None:
+                    child_env[k]=self.env[k]
+                elif child_env.has_key(k):
+                    del child_env[k]
 
             # launch process
-            child = popen2.Popen3(cmd, capturestderr=True)
-        finally:
-            # restore the environemnt
-            for k in saved_env.keys():
-                if saved_env[k]==None:
-                    del os.environ[k]
-                else:
-                    os.environ[k]=saved_env[k]
-            
-        if stdin_data != None:
-            child.tochild.write(stdin_data)
-
-        child.tochild.close()
-
-        stdout = child.fromchild
-        stderr = child.childerr
-
-        outfd = stdout.fileno()
-        errfd = stderr.fileno()
-
-        outdata = cStringIO.StringIO()
-        errdata = cStringIO.StringIO()
-
-        fdlist = [outfd, errfd]
-        for fd in fdlist: # make stdout/stderr nonblocking
-            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-
-        while fdlist:
-            time.sleep(.001) # prevent 100% CPU spin
-            ready = select.select(fdlist, [], [])
-            if outfd in ready[0]:
-                outchunk = stdout.read()
-                if outchunk == '':
-                    fdlist.remove(outfd)
-                else:
-                    outdata.write(outchunk)
+            self.start_time = time.time()
+            self.child = ExeChild(self.cmd, child_env)
+
+            if self.stdin_data != None:
+                self.child.tochild.write(self.stdin_data)
+
+            self.child.tochild.close()
+
+            self.outdata = cStringIO.StringIO()
+            self.errdata = cStringIO.StringIO()
+            for f in (self.child.fromchild, self.child.childerr): # make stdout/stderr nonblocking
+                fd = f.fileno()
+                fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+                self.files[fd] = f
+        except Exception, ex:
+            self.kill()
+            raise ExeError, "Unexpected Error running '%s'\nException OSError: %s" % (self.cmd_str, ex)
+
+    # the fds still to be read
+    def get_fds(self):
+        return self.files.keys()
+
+    # read whatever is available on fd
+    # can throw ExeError
+    def read(self, fd):
+        try:
+            f = self.files[fd]
+            chunk = f.read()
+            if chunk == '':
+                del self.files[fd] # EOF
+            elif f is self.child.childerr:
+                self.errdata.write(chunk)
+            elif self.stdout_callback != None:
+                self.stdout_callback(chunk)
+            else:
+                self.outdata.write(chunk)
+        except Exception, ex:
+            self.kill()
+            raise ExeError, "Unexpected Error running '%s'\nStdout:%s\nStderr:%s\n" \
+                "Exception OSError: %s" % (self.cmd_str, self.outdata.getvalue(), self.errdata.getvalue(), ex)
+
+    def is_done(self):
+        return len(self.files) == 0
+
+    def is_expired(self, now):
+        return (self.timeout != None) and ((now - self.start_time) > self.timeout)
+
+    # wait for the process to end, once all its output has been read
+    # Returns the output lines
+    # can throw ExeError
+    def finish(self):
+        exitStatus = self.child.wait()
+        self.end_time = time.time()
+        self.outdata.seek(0)
+        self.errdata.seek(0)
+        output_lines = self.outdata.readlines()
+        error_lines = self.errdata.readlines()
+
+        if exitStatus:
+            raise ExeError("Error running '%s'\ncode %i:%s" % (self.cmd_str, os.WEXITSTATUS(exitStatus), "".join(error_lines)),
+                           output_lines)
+
+        return output_lines
+
+    # hard kill the process, if still running
+    def kill(self):
+        self.files = {}
+        if self.child == None:
+            return # not started
+        try:
+            os.kill(self.child.pid, signal.SIGKILL)
+        except OSError:
+            pass # already dead
+        for f in (self.child.tochild, self.child.fromchild, self.child.childerr):
+            if f != None:
+                f.close()
+        self.child.wait()
+        self.end_time = time.time()
+
+    # elapsed time, in seconds
+    def get_duration(self):
+        if self.end_time == None:
+            return None
+        return self.end_time - self.start_time
+
+class ExeChild:
+    """
+    Same as popen2.Popen3(cmd, capturestderr=True),
+    but the child gets env as its environment
+    If cmd is a list, it is executed directly, without a shell
+    """
+    def __init__(self, cmd, env):
+        if type(cmd) == type(""):
+            argv = ['/bin/sh', '-c', cmd]
+        else:
+            argv = cmd
+        p2cread, p2cwrite = os.pipe()
+        c2pread, c2pwrite = os.pipe()
+        errread, errwrite = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # this is the child
+            # keep the work before exec to the minimum
+            try:
+                try:
+                    os.dup2(p2cread, 0)
+                    os.dup2(c2pwrite, 1)
+                    os.dup2(errwrite, 2)
+                    close_child_fds()
+                    os.execvpe(argv[0], argv, env)
+                except Exception, e:
+                    os.write(2, "Failed to execute %s: %s\n" % (argv[0], e))
+            finally:
+                os._exit(127)
+        os.close(p2cread)
+        os.close(c2pwrite)
+        os.close(errwrite)
+        self.tochild = os.fdopen(p2cwrite, 'w')
+        self.fromchild = os.fdopen(c2pread, 'r')
+        self.childerr = os.fdopen(errread, 'r')
+        self.sts = -1
+
+    # Returns the exit status, as returned by os.waitpid
+    def wait(self):
+        if self.sts < 0:
+            pid, self.sts = os.waitpid(self.pid, 0)
+        return self.sts
+
+try:
+    MAXFD = os.sysconf('SC_OPEN_MAX')
+except (AttributeError, ValueError):
+    MAXFD = 256
+
+# Close all the fds but stdin/out/err
+# Only the open ones are closed if /proc is available,
+# since MAXFD can be very large
+def close_child_fds():
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        os.closerange(3, MAXFD)
+        return
+    for fd in fds:
+        fd = int(fd)
+        if fd > 2:
+            try:
+                os.close(fd)
+            except OSError:
+                pass # e.g. the one used by listdir
 
-            if errfd in ready[0]:
-                errchunk = stderr.read()
-                if errchunk == '':
-                    fdlist.remove(errfd)
-                else:
-                    errdata.write(errchunk)
+def run_exe_cmds(exe_cmds, max_parallel=None, targets=None, max_per_target=None):
+    """
+    Run the ExeCmd objects, at most max_parallel at a time
+    (None means all at once), multiplexing their output with select.
+    The commands taking longer than their timeout are killed.
+
+    If targets is defined, it lists the target of each command
+    (e.g. the schedd or collector it talks to), and at most
+    max_per_target commands run against the same target at a time
 
-        exitStatus = child.wait()
-        outdata.seek(0)
-        errdata.seek(0)
-        output_lines = outdata.readlines()
-        error_lines = errdata.readlines()
+    Returns a list with, for each command, either its output lines
+    or the ExeError describing why it failed
+    """
+    results = [None] * len(exe_cmds)
+    pending = range(len(exe_cmds))
+    running = {} # index -> ExeCmd
+    fd_idx = {}  # fd -> index
+    target_count = {} # target -> nr running
 
-    except Exception, ex:
-        raise ExeError, "Unexpected Error running '%s'\nStdout:%s\nStderr:%s\n" \
-            "Exception OSError: %s" % (cmd, str(output_lines), str(error_lines), ex)
+    def get_target(i):
+        if targets == None:
+            return None
+        return targets[i]
 
-    if exitStatus:
-        raise ExeError, "Error running '%s'\ncode %i:%s" % (cmd, os.WEXITSTATUS(exitStatus), "".join(error_lines))
+    def stop_running(i):
+        del running[i]
+        target_count[get_target(i)] -= 1
+
+    try:
+        while (len(pending) > 0) or (len(running) > 0):
+            pending_idx = 0
+            while (pending_idx < len(pending)) and ((max_parallel == None) or (len(running) < max_parallel)):
+                i = pending[pending_idx]
+                target = get_target(i)
+                if (max_per_target != None) and (target_count.get(target, 0) >= max_per_target):
+                    pending_idx += 1 # target busy, try the next one
+                    continue
+                del pending[pending_idx]
+                try:
+                    exe_cmds[i].start()
+                except ExeError, e:
+                    results[i] = e
+                    continue
+                running[i] = exe_cmds[i]
+                target_count[target] = target_count.get(target, 0) + 1
+                for fd in exe_cmds[i].get_fds():
+                    fd_idx[fd] = i
+
+            # wait for output, or for the first timeout
+            select_timeout = None
+            now = time.time()
+            for exe_cmd in running.values():
+                if exe_cmd.timeout != None:
+                    remaining = max(exe_cmd.start_time + exe_cmd.timeout - now, 0)
+                    if (select_timeout == None) or (remaining < select_timeout):
+                        select_timeout = remaining
+            if len(fd_idx) > 0:
+                ready = select.select(fd_idx.keys(), [], [], select_timeout)[0]
+            else:
+                ready = []
+
+            for fd in ready:
+                i = fd_idx[fd]
+                if not running.has_key(i):
+                    continue # already failed
+                try:
+                    running[i].read(fd)
+                except ExeError, e:
+                    results[i] = e
+                    stop_running(i)
 
-    return output_lines
+            now = time.time()
+            for i in running.keys():
+                exe_cmd = running[i]
+                if exe_cmd.is_done():
+                    try:
+                        results[i] = exe_cmd.finish()
+                    except ExeError, e:
+                        results[i] = e
+                    except Exception, e:
+                        results[i] = ExeError("Error processing the output of '%s': %s" % (exe_cmd.cmd_str, e))
+                    stop_running(i)
+                elif exe_cmd.is_expired(now):
+                    exe_cmd.kill()
+                    results[i] = ExeError("Timeout running '%s', killed after %is" % (exe_cmd.cmd_str, exe_cmd.timeout))
+                    stop_running(i)
+
+            # forget the fds of the ones that ended
+            for fd in fd_idx.keys():
+                i = fd_idx[fd]
+                if (not running.has_key(i)) or (not (fd in running[i].get_fds())):
+                    del fd_idx[fd]
+    finally:
+        # only on abnormal exit, like a signal
+        for exe_cmd in running.values():
+            exe_cmd.kill()
+
+    return results
+
+
+class ExeResult:
+    """
+    The outcome of a command run in an ExeBatch
 
+    output is the list of output lines, or None if it failed,
+    error is the ExeError if it failed, else None,
+    duration is the run time in seconds (None if it never started)
+    """
+    def __init__(self, key, target, exe_cmd, out):
+        self.key = key
+        self.target = target
+        self.cmd_str = exe_cmd.cmd_str
+        self.duration = exe_cmd.get_duration()
+        if isinstance(out, ExeError):
+            self.output = None
+            self.error = out
+        else:
+            self.output = out
+            self.error = None
+
+    def is_ok(self):
+        return self.error == None
+
+class ExeBatch:
+    """
+    A batch of commands to be run in parallel
+
+    At most max_parallel commands run at the same time,
+    and at most max_per_target against the same target
+    (e.g. the schedd or the collector the command talks to);
+    None means no limit
+
+    Usage:
+      batch = ExeBatch(max_per_target=4)
+      batch.add(ExeCmd(...), target=schedd_name, key=jid)
+      ...
+      batch.run()
+      errors = batch.get_errors() # e.g. for MultiExeError
+    """
+    def __init__(self, max_parallel=None, max_per_target=None):
+        self.max_parallel = max_parallel
+        self.max_per_target = max_per_target
+        self.exe_cmds = []
+        self.targets = []
+        self.keys = []
+        self.results = None
+
+    # key identifies the command in the results, by default its position
+    def add(self, exe_cmd, target=None, key=None):
+        if key == None:
+            key = len(self.exe_cmds)
+        self.exe_cmds.append(exe_cmd)
+        self.targets.append(target)
+        self.keys.append(key)
+
+    def __len__(self):
+        return len(self.exe_cmds)
+
+    # Run all the commands, and return the list of ExeResult objects,
+    # in the same order as they were added
+    def run(self):
+        outs = run_exe_cmds(self.exe_cmds, self.max_parallel,
+                            self.targets, self.max_per_target)
+        self.results = []
+        for i in range(len(self.exe_cmds)):
+            self.results.append(ExeResult(self.keys[i], self.targets[i], self.exe_cmds[i], outs[i]))
+        return self.results
+
+    # The ExeError of the commands that failed, in order
+    def get_errors(self):
+        errors = []
+        for r in self.results:
+            if r.error != None:
+                errors.append(r.error)
+        return errors
+
+    # The keys of the commands that succeeded, in order
+    def get_ok_keys(self):
+        keys = []
+        for r in self.results:
+            if r.error == None:
+                keys.append(r.key)
+        return keys
 
 #
 # Set condor_bin_path
@@ -24,6 +24,7 @@ import re
 import mmap
 import time
 import cPickle
+import cStringIO
 import sets
 
 # -------------- Single Log classes ------------------------
@@ -44,6 +45,8 @@ class cachedLogClass:
             self.cachename=logname+cache_ext
         else:
             self.cachename=os.path.join(cache_dir,os.path.basename(logname)+cache_ext)
+        # the state of the incremental parser
+        self.statename=self.cachename+".state"
 
     def has_changed(self):
         """
@@ -75,16 +78,21 @@ class cachedLogClass:
         """
         if not self.has_changed():
             # cache is newer, just load the cache
-            return self.loadCache()
+            try:
+                return self.loadCache()
+            except:
+                pass # unreadable cache, recreate it
 
         while 1: #could need more than one loop if the log file is changing
             fstat = os.lstat(self.logname)
             start_logtime = fstat[stat.ST_MTIME]
+            header = {'inode':fstat[stat.ST_INO],
+                      'size':fstat[stat.ST_SIZE]}
             del fstat
             
             self.loadFromLog()
             try:
-                self.saveCache()
+                self.saveCache(header)
             except IOError:
                 return # silently ignore, this was a load in the end
             # the log may have changed -> check
@@ -105,10 +113,62 @@ class cachedLogClass:
         raise RuntimeError('loadFromLog not implemented!')
     
     ####### PRIVATE ###########
-    def saveCache(self):
-        saveCache(self.cachename, self.data)
+    def saveCache(self, header=None):
+        saveCache(self.cachename, self.data, header)
         return
 
+    def loadIncr(self, parse_func, empty_state):
+        """
+        Parse the log file incrementally.
+        The parser state and the offset of the last complete event
+        are saved in self.statename, so that next time only the new events
+        are parsed. If the log was truncated or rotated (different inode,
+        or smaller than the offset), it is parsed from the beginning.
+
+        @param parse_func: def parse_func(fname, state, start_idx) returning (state, end_idx)
+        @param empty_state: the state before reading anything
+        @return: the parser state, for the whole log file
+        """
+        fstat = os.stat(self.logname)
+        state = empty_state
+        start_idx = 0
+        try:
+            header, saved_state = loadCacheWithHeader(self.statename)
+            if ((header != None) and
+                (header['inode'] == fstat[stat.ST_INO]) and
+                (header['offset'] <= fstat[stat.ST_SIZE])):
+                state = saved_state
+                start_idx = header['offset']
+        except:
+            pass # missing or corrupted, parse the whole file
+
+        state, end_idx = parse_func(self.logname, state, start_idx)
+
+        if end_idx != start_idx:
+            try:
+                saveCache(self.statename, state,
+                          {'inode':fstat[stat.ST_INO],
+                           'size':fstat[stat.ST_SIZE],
+                           'offset':end_idx})
+            except IOError:
+                pass # silently ignore, will parse the whole file next time
+        return state
+
+    def loadRawJobs(self):
+        """
+        Incremental version of parseSubmitLogFastRaw(self.logname)
+        """
+        return self.loadIncr(parseSubmitLogFastRawIncr, {})
+
+    def loadRawJobsTimings(self):
+        """
+        Incremental version of parseSubmitLogFastRawTimings(self.logname)
+        """
+        def parse_func(fname, state, start_idx):
+            jobs, first_time, last_time, end_idx = parseSubmitLogFastRawTimingsIncr(fname, state[0], state[1], state[2], start_idx)
+            return (jobs, first_time, last_time), end_idx
+        return self.loadIncr(parse_func, ({}, None, None))
+
         
 class logSummary(cachedLogClass):
     """
@@ -127,7 +187,7 @@ class logSummary(cachedLogClass):
         Parse the condor activity log and interpret the globus status code.
         Stores in self.data
         """
-        jobs = parseSubmitLogFastRaw(self.logname)
+        jobs = self.loadRawJobs()
         self.data = listAndInterpretRawStatuses(jobs, listStatuses)
         return
 
@@ -228,7 +288,7 @@ class logCompleted(cachedLogClass):
         Finally, parse and add counts.
         """
         tmpdata={}
-        jobs = parseSubmitLogFastRaw(self.logname)
+        jobs = self.loadRawJobs()
         status  = listAndInterpretRawStatuses(jobs, listStatuses)
         counts = {}
         for s in status.keys():
@@ -338,7 +398,7 @@ class logCounts(cachedLogClass):
         self.clInit(logname,cache_dir,".clcpk")
 
     def loadFromLog(self):
-        jobs = parseSubmitLogFastRaw(self.logname)
+        jobs = self.loadRawJobs()
         self.data = countAndInterpretRawStatuses(jobs)
         return
 
@@ -419,7 +479,7 @@ class logSummaryTimings(cachedLogClass):
         self.clInit(logname,cache_dir,".ctstpk")
 
     def loadFromLog(self):
-        jobs, self.startTime, self.endTime = parseSubmitLogFastRawTimings(self.logname)
+        jobs, self.startTime, self.endTime = self.loadRawJobsTimings()
         self.data = listAndInterpretRawStatuses(jobs, listStatusesTimings)
         return
 
@@ -602,7 +662,7 @@ declared inactive
         return ch
 
     
-    def load(self,active_only=True):
+    def load(self,active_only=True,nr_workers=1):
         """
         For each file in the filelist, call the appropriate load()
         function for that file.  Merge all the data from all the files
@@ -610,6 +670,10 @@ declared inactive
         It will save the list of inactive_files it finds in a cache
         for quick access.
 
+        The files can be loaded by nr_workers forked processes
+        (None means one per core). How long it took is kept in
+        self.load_stats.
+
         This function should set self.data.
         """
 
@@ -620,19 +684,28 @@ declared inactive
         fnames = self.getFileList(active_only)
 
         now = time.time()
-        # load and merge data
-        for fname in fnames:
-            absfname=os.path.join(self.dirname,fname)
-            if os.path.getsize(absfname)<1:
-                continue # skip empty files
-            last_mod=os.path.getmtime(absfname)
-            obj=self.logClass(absfname,self.cache_dir)
-            obj.load()
+        if nr_workers==None:
+            nr_workers=get_nr_cpus()
+        nr_workers=min(nr_workers,len(fnames))
+        if nr_workers>1:
+            results=self.loadFilesParallel(fnames,nr_workers)
+        else:
+            results=map(self.loadFile,fnames)
+
+        # merge data
+        file_durations={}
+        for fname,last_mod,obj,duration in results:
+            file_durations[fname]=duration
+            if obj==None:
+                continue # empty file
             mydata = obj.merge(mydata)
             if ( ((now-last_mod) > self.inactive_timeout) and 
                  (not obj.isActive()) ):
                 new_inactives.append(fname)
         self.data = mydata
+        self.load_stats={'nr_workers':max(nr_workers,1),
+                         'duration':time.time()-now,
+                         'files':file_durations}
 
         # try to save inactive files in the cache
         # if one was looking at inactive only
@@ -645,6 +718,88 @@ declared inactive
 
         return
 
+    def loadFile(self,fname):
+        """
+        Load a single log file
+
+        @return: (fname,last_mod,obj,duration), obj is None if the file is empty
+        """
+        start_time=time.time()
+        absfname=os.path.join(self.dirname,fname)
+        if os.path.getsize(absfname)<1:
+            return (fname,None,None,time.time()-start_time) # skip empty files
+        last_mod=os.path.getmtime(absfname)
+        obj=self.logClass(absfname,self.cache_dir)
+        obj.load()
+        return (fname,last_mod,obj,time.time()-start_time)
+
+    def loadFilesParallel(self,fnames,nr_workers):
+        """
+        Load the files using nr_workers forked processes.
+        Each worker returns the data of its files through a pipe;
+        the files a worker could not load are loaded by this process.
+
+        @return: same as map(self.loadFile,fnames)
+        """
+        workers=[]
+        for i in range(nr_workers):
+            chunk=fnames[i::nr_workers]
+            r,w=os.pipe()
+            try:
+                pid=os.fork()
+            except OSError:
+                os.close(r)
+                os.close(w)
+                break # will load the rest here
+            if pid==0:
+                # child, only the data goes back
+                try:
+                    os.close(r)
+                    out=[]
+                    for fname in chunk:
+                        try:
+                            fname,last_mod,obj,duration=self.loadFile(fname)
+                        except:
+                            continue # the parent will try again
+                        if obj!=None:
+                            out.append((fname,last_mod,True,obj.data,duration))
+                        else:
+                            out.append((fname,last_mod,False,None,duration))
+                    fd=os.fdopen(w,"w")
+                    cPickle.dump(out,fd,cPickle.HIGHEST_PROTOCOL)
+                    fd.close()
+                finally:
+                    os._exit(0) # no cleanup, the parent owns all the state
+            os.close(w)
+            workers.append((pid,r))
+
+        loaded={}
+        for pid,r in workers:
+            fd=os.fdopen(r,"r")
+            try:
+                try:
+                    out=cPickle.load(fd)
+                except:
+                    out=[] # worker died, will load its files here
+            finally:
+                fd.close()
+                os.waitpid(pid,0)
+            for fname,last_mod,has_data,data,duration in out:
+                if has_data:
+                    obj=self.logClass(os.path.join(self.dirname,fname),self.cache_dir)
+                    obj.data=data
+                else:
+                    obj=None
+                loaded[fname]=(fname,last_mod,obj,duration)
+
+        results=[]
+        for fname in fnames:
+            if loaded.has_key(fname):
+                results.append(loaded[fname])
+            else:
+                results.append(self.loadFile(fname))
+        return results
+
     def diff(self,other):
         """
         Diff self data with other info
@@ -756,6 +911,15 @@ class dirSummaryTimings(cacheDirClass):
 #
 ##############################################################################
 
+def get_nr_cpus():
+    """
+    @return: number of online CPUs, 1 if unknown
+    """
+    try:
+        return max(os.sysconf('SC_NPROCESSORS_ONLN'),1)
+    except (ValueError,OSError):
+        return 1
+
 ################################
 #  Condor log parsing functions
 ################################
@@ -837,18 +1001,28 @@ def parseSubmitLogFastRaw(fname):
     @return: a dictionary of jobStrings each having the last statusString
     For example {'1583.004': '000', '3616.008': '009'}
     """
+    jobs, end_idx = parseSubmitLogFastRawIncr(fname, {}, 0)
+    return jobs
+
+def parseSubmitLogFastRawIncr(fname, jobs, start_idx):
+    """
+    Continue reading a condor submit log from start_idx,
+    updating jobs (as returned by parseSubmitLogFastRaw).
+    Only complete events are taken into account.
+
+    @return: (jobs, end_idx), end_idx being the end of the last complete event
+    """
 
-    jobs={}
-    
     size = os.path.getsize(fname)
-    if size==0:
-        # nothing to read, if empty
-        return jobs
+    if size<=start_idx:
+        # nothing new to read
+        return jobs, start_idx
     
     fd=open(fname,"r")
     buf=mmap.mmap(fd.fileno(),size,access=mmap.ACCESS_READ)
 
-    idx = 0
+    idx = start_idx
+    end_idx = start_idx
 
     while (idx+5) < size: # else we are at the end of the file
         # format
@@ -864,19 +1038,20 @@ def parseSubmitLogFastRaw(fname):
         jobid = buf[idx:i1-4]
         idx = i1 + 1
 
+        i1 = buf.find("...", idx)
+        if i1 < 0:
+            break # partial event, will be read next time
+        idx = i1 + 4 #the 3 dots plus newline
+        end_idx = min(idx, size)
+
         if jobs.has_key(jobid):
             jobs[jobid] = get_new_status(jobs[jobid], status)
         else:
             jobs[jobid] = status
 
-        i1 = buf.find("...", idx)
-        if i1 < 0:
-            break
-        idx = i1 + 4 #the 3 dots plus newline
-
     buf.close()
     fd.close()
-    return jobs
+    return jobs, end_idx
 
 def parseSubmitLogFastRawTimings(fname):
     """
@@ -888,21 +1063,28 @@ def parseSubmitLogFastRawTimings(fname):
 
     @return: a dictionary of jobStrings
     """
+    jobs, first_time, last_time, end_idx = parseSubmitLogFastRawTimingsIncr(fname, {}, None, None, 0)
+    return jobs, first_time, last_time
 
-    jobs = {}
+def parseSubmitLogFastRawTimingsIncr(fname, jobs, first_time, last_time, start_idx):
+    """
+    Continue reading a condor submit log from start_idx,
+    updating the values returned by parseSubmitLogFastRawTimings.
+    Only complete events are taken into account.
+
+    @return: (jobs, first_time, last_time, end_idx), end_idx being the end of the last complete event
+    """
 
-    first_time = None
-    last_time = None
-    
     size = os.path.getsize(fname)
-    if size==0:
-        # nothing to read, if empty
-        return jobs,first_time,last_time
+    if size<=start_idx:
+        # nothing new to read
+        return jobs,first_time,last_time,start_idx
     
     fd=open(fname,"r")
     buf=mmap.mmap(fd.fileno(),size,access=mmap.ACCESS_READ)
 
-    idx = 0
+    idx = start_idx
+    end_idx = start_idx
 
     while (idx + 5) < size: # else we are at the end of the file
         # format
@@ -921,6 +1103,12 @@ def parseSubmitLogFastRawTimings(fname):
         line_time = buf[idx:idx+14]
         idx += 16
 
+        i1 = buf.find("...", idx)
+        if i1 < 0:
+            break # partial event, will be read next time
+        idx = i1 + 4 #the 3 dots plus newline
+        end_idx = min(idx, size)
+
         if first_time == None:
             first_time = line_time
         last_time = line_time
@@ -934,14 +1122,9 @@ def parseSubmitLogFastRawTimings(fname):
         else:
             jobs[jobid] = (status, line_time, '', line_time)
 
-        i1 = buf.find("...", idx)
-        if i1 < 0:
-            break
-        idx = i1 + 4 #the 3 dots plus newline
-
     buf.close()
     fd.close()
-    return jobs, first_time, last_time
+    return jobs, first_time, last_time, end_idx
 
 def parseSubmitLogFastRawCallback(fname, callback):
     """
@@ -1278,30 +1461,77 @@ def parseSubmitLogFastTimings(fname,year=None):
 #  Cache handling functions
 ################################
 
+# Format of the cache files
+#  a first line with "GWMSLPC <version>"
+#  followed by the header and the data, pickled with the highest protocol
+# The header describes the source of the data, e.g.
+#  {'inode':...,'size':...,'offset':...}
+# Files without the first line are old text pickles,
+# they are converted when read
+CACHE_MAGIC="GWMSLPC"
+CACHE_VERSION=2
+
 def loadCache(fname):
     """
-    Loads a pickle file from a filename and returns the resulting data.
+    Loads a cache file from a filename and returns the resulting data.
 
     @param fname: Filename to load
     @return: data retrieved from file
     """
-    fd=open(fname,"r")
-    data=cPickle.load(fd)
-    fd.close()
+    header,data=loadCacheWithHeader(fname)
     return data
 
-def saveCache(fname,data):
+def loadCacheWithHeader(fname):
+    """
+    Loads a cache file, old caches are converted to the current format
+
+    @param fname: Filename to load
+    @return: (header,data), header is None if not saved or for old caches
+    """
+    fd=open(fname,"rb")
+    try:
+        larr=fd.readline().split()
+        if (len(larr)!=2) or (larr[0]!=CACHE_MAGIC):
+            # old format, a text pickle
+            fd.seek(0)
+            data=cPickle.load(fd)
+            header=None
+            is_old=True
+        else:
+            if int(larr[1])!=CACHE_VERSION:
+                raise ValueError, "Unsupported cache version %s in %s"%(larr[1],fname)
+            # unpickling from a string is much faster than from a file
+            buf=cStringIO.StringIO(fd.read())
+            header=cPickle.load(buf)
+            data=cPickle.load(buf)
+            is_old=False
+    finally:
+        fd.close()
+
+    if is_old:
+        try:
+            saveCache(fname,data)
+        except (IOError,OSError):
+            pass # silently ignore, will try again next time
+    return header,data
+
+def saveCache(fname,data,header=None):
     """
     Creates a temporary file to store data in, then moves the file into 
     the correct place.  Uses pickle to store data.
 
     @param fname: Filename to write to.
     @param data: data to store in pickle format
+    @param header: description of the data source
     """
     tmpname=fname+(".tmp_%i"%os.getpid())
-    fd=open(tmpname,"w")
-    cPickle.dump(data,fd)
-    fd.close()
+    fd=open(tmpname,"wb")
+    try:
+        fd.write("%s %i\n"%(CACHE_MAGIC,CACHE_VERSION))
+        fd.write(cPickle.dumps(header,cPickle.HIGHEST_PROTOCOL))
+        fd.write(cPickle.dumps(data,cPickle.HIGHEST_PROTOCOL))
+    finally:
+        fd.close()
 
     try:
         os.remove(fname)
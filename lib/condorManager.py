@@ -13,6 +13,7 @@
 
 import re
 import string
+import time
 import condorMonitor
 import condorExe
 
@@ -40,6 +41,49 @@ def cached_exe_cmd(cmd, arg_str,
     opts="%s%s%s"%(pool2str(pool_name),schedd_str,arg_str)
     return condorExe.exe_cmd(cmd,opts,env=env)
 
+# The lines printed by condor_rm/condor_release for each job acted upon, e.g.
+#   Job 12.0 marked for removal
+# they complain on stderr about the others
+RM_DONE_RE=re.compile(r"^Job (\S+) (marked for removal|removed locally)")
+RELEASE_DONE_RE=re.compile(r"^Job (\S+) released")
+
+# Run cmd on the ids in id_list, max_chunk at a time,
+# sleeping sleep_time seconds between the commands
+# done_re must match the success lines, with the id as the first group
+#
+# Returns (done_list, error_list)
+def cached_exe_bulk_cmd(cmd, arg_str, id_list, max_chunk, done_re, sleep_time,
+                        schedd_name, pool_name, schedd_lookup_cache):
+    done_list=[]
+    error_list=[]
+    for start in range(0,len(id_list),max_chunk):
+        if (start>0) and (sleep_time>0):
+            time.sleep(sleep_time)
+        chunk=id_list[start:start+max_chunk]
+        try:
+            out=cached_exe_cmd(cmd,"%s%s"%(arg_str,string.join(chunk," ")),
+                               schedd_name, pool_name, schedd_lookup_cache)
+        except condorExe.ExeError, e:
+            error_list.append(e)
+            out=e.output_lines
+            if out==None:
+                continue
+        done_list+=extract_ids(out,chunk,done_re)
+    return done_list,error_list
+
+# find which of the ids have a success line in the output
+def extract_ids(lines,id_list,done_re):
+    found={}
+    for line in lines:
+        m=done_re.match(line)
+        if m!=None:
+            found[m.group(1)]=True
+    done_list=[]
+    for el in id_list:
+        if found.has_key(el):
+            done_list.append(el)
+    return done_list
+
 ##############################################
 #
 # Submit a new job, given a submit file
@@ -86,6 +130,26 @@ def condorRemoveOne(cluster_or_uname,schedd_name=None,pool_name=None,
     return cached_exe_cmd("condor_rm",opts,
                           schedd_name, pool_name, schedd_lookup_cache)
 
+##############################################
+#
+# Remove a list of jobs from the queue,
+# with one condor_rm every max_chunk jobs,
+# sleeping sleep_time seconds between them
+#
+# Returns (removed_list, error_list):
+#  the job ids condor_rm reported as removed,
+#  and the ExeError of the failed commands
+#
+def condorRemoveList(cluster_or_uname_list,schedd_name=None,pool_name=None,
+                     do_forcex=False,max_chunk=100,sleep_time=0,
+                     schedd_lookup_cache=condorMonitor.local_schedd_cache):
+    opts=""
+    if do_forcex:
+        opts+="-forcex "
+    return cached_exe_bulk_cmd("condor_rm",opts,cluster_or_uname_list,max_chunk,
+                               RM_DONE_RE,sleep_time,
+                               schedd_name, pool_name, schedd_lookup_cache)
+
 ##############################################
 #
 # Hold a set of jobs from the queue
@@ -126,6 +190,21 @@ def condorReleaseOne(cluster_or_uname,schedd_name=None,pool_name=None,
     return cached_exe_cmd("condor_release",opts,
                           schedd_name, pool_name, schedd_lookup_cache)
 
+##############################################
+#
+# Release a list of jobs from the queue,
+# with one condor_release every max_chunk jobs,
+# sleeping sleep_time seconds between them
+#
+# Returns (released_list, error_list), see condorRemoveList
+#
+def condorReleaseList(cluster_or_uname_list,schedd_name=None,pool_name=None,
+                      max_chunk=100,sleep_time=0,
+                      schedd_lookup_cache=condorMonitor.local_schedd_cache):
+    return cached_exe_bulk_cmd("condor_release","",cluster_or_uname_list,max_chunk,
+                               RELEASE_DONE_RE,sleep_time,
+                               schedd_name, pool_name, schedd_lookup_cache)
+
 ##############################################
 #
 # Issue a condor_reschedule
@@ -157,5 +236,16 @@ def ismulti2str(is_multi):
 #
 def condorAdvertise(classad_fname,command,
                     use_tcp=False,is_multi=False,pool_name=None):
-    cmd_opts="%s%s%s%s %s"%(pool2str(pool_name),usetcp2str(use_tcp),ismulti2str(is_multi),command,classad_fname)
-    return condorExe.exe_cmd_sbin("condor_advertise",cmd_opts)
+    # pass the argv, no need for a shell
+    return condorExe.exe_cmd_sbin("condor_advertise",advertise2args(classad_fname,command,use_tcp,is_multi,pool_name))
+
+# Same as condorAdvertise, but return the condorExe.ExeCmd
+# can throw UnconfigError
+def condorAdvertiseCmd(classad_fname,command,
+                       use_tcp=False,is_multi=False,pool_name=None):
+    cmd=condorExe.get_exe_cmd_sbin("condor_advertise",advertise2args(classad_fname,command,use_tcp,is_multi,pool_name))
+    return condorExe.ExeCmd(cmd)
+
+def advertise2args(classad_fname,command,use_tcp,is_multi,pool_name):
+    cmd_opts="%s%s%s%s"%(pool2str(pool_name),usetcp2str(use_tcp),ismulti2str(is_multi),command)
+    return string.split(cmd_opts)+[classad_fname]
@@ -15,6 +15,7 @@
 
 import condorExe
 import condorSecurity
+import classadExpr
 import os
 import string
 import copy
@@ -152,6 +153,138 @@ def condorq_attrs(q_constraint, attribute_list):
                             
     return q_proxy_list
     
+#
+# Compact result classes
+#
+# Instead of one dictionary per classad, all the classads of a query
+# share a single schema (the list of attribute names, interned)
+# and each one only stores an array of values
+#
+# The rows behave like read/write dictionaries, so they can be used
+# anywhere the output of fetch/fetchStored is expected
+#
+
+# Marker for attributes not present in a row
+# A class, so that it survives pickling
+class CompactMissing:
+    pass
+
+class CompactSchema:
+    def __init__(self, attrs=()):
+        self.attrs = []   # position => attribute name
+        self.idx = {}     # attribute name => position
+        for attr in attrs:
+            self.add(attr)
+
+    # return the position of the attribute, adding it if needed
+    def add(self, attr):
+        if self.idx.has_key(attr):
+            return self.idx[attr]
+        try:
+            attr = intern(str(attr))
+        except UnicodeError:
+            pass # cannot intern non ascii names, keep as they are
+        pos = len(self.attrs)
+        self.attrs.append(attr)
+        self.idx[attr] = pos
+        return pos
+
+    # only the names are pickled, the index is rebuilt on load
+    def __getstate__(self):
+        return self.attrs
+
+    def __setstate__(self, attrs):
+        self.__init__(attrs)
+
+class CompactClassAd(object):
+    __slots__ = ('schema', 'vals')
+
+    def __init__(self, schema, vals=None):
+        self.schema = schema
+        if vals == None:
+            vals = []
+        self.vals = vals
+
+    def __getstate__(self):
+        return (self.schema, self.vals)
+
+    def __setstate__(self, state):
+        self.schema, self.vals = state
+
+    # return the position of the attribute, or -1 if not present
+    def find(self, k):
+        pos = self.schema.idx.get(k, -1)
+        if (pos >= len(self.vals)) or ((pos >= 0) and (self.vals[pos] is CompactMissing)):
+            return -1
+        return pos
+
+    def __getitem__(self, k):
+        pos = self.find(k)
+        if pos < 0:
+            raise KeyError, k
+        return self.vals[pos]
+
+    def __setitem__(self, k, val):
+        pos = self.schema.add(k)
+        vals = self.vals
+        if pos >= len(vals):
+            vals.extend([CompactMissing] * (pos + 1 - len(vals)))
+        vals[pos] = val
+
+    def __delitem__(self, k):
+        pos = self.find(k)
+        if pos < 0:
+            raise KeyError, k
+        self.vals[pos] = CompactMissing
+
+    def has_key(self, k):
+        return (self.find(k) >= 0)
+
+    __contains__ = has_key
+
+    def get(self, k, default=None):
+        pos = self.find(k)
+        if pos < 0:
+            return default
+        return self.vals[pos]
+
+    def iteritems(self):
+        attrs = self.schema.attrs
+        vals = self.vals
+        for pos in range(len(vals)):
+            if vals[pos] is not CompactMissing:
+                yield (attrs[pos], vals[pos])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return [k for k, v in self.iteritems()]
+
+    def values(self):
+        return [v for k, v in self.iteritems()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    # plain dictionary copy
+    def copy(self):
+        return dict(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, CompactClassAd):
+            other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.copy())
+
 #
 # Condor monitoring classes
 #
@@ -176,9 +309,40 @@ class AbstractQuery: # pure virtual, just to have a minimum set of methods defin
 class StoredQuery(AbstractQuery): # still virtual, only fetchStored defined
     stored_data = {}
     
+    # equality indexes
+    #   index_defs - tuple of attribute tuples
+    #   index_data - dictionary of attribute tuple => {value tuple => {key => el}}
+    #   index_src  - the stored_data index_data was built from
+    index_defs = ()
+    index_data = None
+    index_src = None
+
     def fetchStored(self,constraint_func=None):
         return applyConstraint(self.stored_data,constraint_func)
 
+    # declare an equality index on attr_list
+    # The index is built on first use, and rebuilt every time new data is loaded
+    def index_on(self,attr_list):
+        attr_list=tuple(attr_list)
+        if not (attr_list in self.index_defs):
+            self.index_defs=self.index_defs+(attr_list,)
+
+    # same output as fetchStored, but limited to the elements
+    # where the attributes in attr_list are equal to vals
+    # Elements missing any of the attributes are never returned
+    #
+    # Use the index on attr_list (will declare it if needed)
+    # The returned dictionary is shared with the index, do not modify it
+    def fetchStoredIndexed(self,attr_list,vals):
+        attr_list=tuple(attr_list)
+        self.index_on(attr_list)
+        if (self.index_src is not self.stored_data) or (self.index_data==None):
+            self.index_data={}
+            self.index_src=self.stored_data
+        if not self.index_data.has_key(attr_list):
+            self.index_data[attr_list]=buildIndex(self.stored_data,attr_list)
+        return self.index_data[attr_list].get(tuple(vals),{})
+
 #
 # format_list is a list of
 #  (attr_name, attr_type)
@@ -209,6 +373,13 @@ class QueryExe(StoredQuery): # first fully implemented one, execute commands
         else:
             self.security_obj=condorSecurity.ProtoRequest()
 
+        self.compact_results=False
+
+    # if enabled, fetch will return CompactClassAd elements
+    # sharing a single schema, instead of one dictionary per classad
+    def use_compact_results(self,enable=True):
+        self.compact_results=enable
+
     def require_integrity(self,requested_integrity): # if none, dont change, else forse that one
         if requested_integrity==None:
             condor_val=None
@@ -244,41 +415,134 @@ class QueryExe(StoredQuery): # first fully implemented one, execute commands
         return (condor_val=='REQUIRED')
 
     def fetch(self,constraint=None,format_list=None):
-        if constraint==None:
-            constraint_str=""
-        else:
-            constraint_str="-constraint '%s'"%constraint
+        out=condorExe.run_exe_cmds([self.getFetchCmd(constraint,format_list)])[0]
+        if isinstance(out,condorExe.ExeError):
+            raise out
+        return out
 
-        full_xml=(format_list==None)
+    # Returns a condorExe.ExeCmd that, once run, returns the same output as fetch
+    # Used to run many queries in parallel (see fetchMulti)
+    def getFetchCmd(self,constraint=None,format_list=None,timeout=None):
+        # build the argv directly, no need for a shell
+        args=string.split(self.resource_str)
         if format_list!=None:
-            format_arr=[]
             for format_el in format_list:
                 attr_name,attr_type=format_el
                 attr_format={'s':'%s','i':'%i','r':'%f','b':'%i'}[attr_type]
-                format_arr.append('-format "%s" "%s"'%(attr_format,attr_name))
-            format_str=string.join(format_arr," ")
+                args+=['-format',attr_format,attr_name]
+        args.append('-xml')
+        args+=string.split(self.pool_str)
+        if constraint!=None:
+            args+=['-constraint',constraint]
 
-        # set environment for security settings
-        self.security_obj.save_state()
-        self.security_obj.enforce_requests()
+        cmd=condorExe.get_exe_cmd(self.exe_name,args)
 
-        if full_xml:
-            xml_data = condorExe.exe_cmd(self.exe_name,"%s -xml %s %s"%(self.resource_str,self.pool_str,constraint_str),env=self.env);
+        if self.compact_results:
+            if type(self.group_attribute) in (type([]), type((1, 2))):
+                group_attrs = self.group_attribute
+            else:
+                group_attrs = [self.group_attribute]
+            if format_list!=None:
+                schema = CompactSchema([a for a,t in format_list if not (a in group_attrs)])
+            else:
+                schema = CompactSchema()
         else:
-            xml_data = condorExe.exe_cmd(self.exe_name,"%s %s -xml %s %s"%(self.resource_str,format_str,self.pool_str,constraint_str),env=self.env);
-
-        # restore old values
-        self.security_obj.restore_state()
-
-        list_data = xml2list(xml_data)
-        del xml_data
-        dict_data = list2dict(list_data, self.group_attribute)
-        return dict_data
+            schema = None
+        # the security settings are passed to the command only,
+        # so many queries can run at the same time
+        env=self.security_obj.get_env()
+        env.update(self.env)
+        return QueryFetchCmd(cmd,env,self.group_attribute,schema,timeout)
 
     def load(self, constraint=None, format_list=None):
         self.stored_data = self.fetch(constraint, format_list)
 
 
+#
+# The command used by QueryExe
+#
+# The output is parsed as it arrives,
+# so the raw XML is never kept in memory as a whole
+# finish() returns the parsed data
+#
+class QueryFetchCmd(condorExe.ExeCmd):
+    # schema - if not None, return CompactClassAd elements using it
+    def __init__(self,cmd,env,group_attribute,schema=None,timeout=None):
+        condorExe.ExeCmd.__init__(self,cmd,env=env,stdout_callback=self.parse_chunk,timeout=timeout)
+        self.group_attribute=group_attribute
+        self.schema=schema
+        self.parser=Xml2ListParser()
+        self.dict_data={}
+        self.parse_error=None # the first parsing problem, if any
+
+    def parse_chunk(self,chunk):
+        if self.parse_error!=None:
+            return # already broken, just drain the output
+        try:
+            for list_el in self.parser.feed(chunk):
+                self.add_el(list_el)
+        except Exception, e:
+            self.parse_error=e
+
+    def add_el(self,list_el):
+        if self.schema!=None:
+            addList2Compact(self.dict_data, list_el, self.group_attribute, self.schema)
+        else:
+            addList2Dict(self.dict_data, list_el, self.group_attribute)
+
+    # Malformed or truncated output is reported as an ExeError,
+    # like any other failure of the command
+    def finish(self):
+        condorExe.ExeCmd.finish(self)
+        if self.parse_error==None:
+            try:
+                for list_el in self.parser.close():
+                    self.add_el(list_el)
+            except Exception, e:
+                self.parse_error=e
+        if self.parse_error!=None:
+            raise condorExe.ExeError, "Invalid output from '%s': %s"%(self.cmd_str,self.parse_error)
+        return self.dict_data
+
+#
+# Run the fetch of many queries in parallel
+#
+# query_list - list of (query,constraint,format_list)
+# max_parallel - at most these many at the same time (None means all at once)
+# timeout - in seconds, the queries taking longer are killed (None means no limit)
+#
+# Returns a list with, for each query, either the fetched data
+# or the exception that prevented it (partial results are never returned)
+#
+def fetchMulti(query_list,max_parallel=None,timeout=None):
+    out=[None]*len(query_list)
+    fetch_cmds=[]
+    fetch_idxs=[]
+    for i in range(len(query_list)):
+        query,constraint,format_list=query_list[i]
+        try:
+            fetch_cmds.append(query.getFetchCmd(constraint,format_list,timeout))
+            fetch_idxs.append(i)
+        except condorExe.UnconfigError, e:
+            out[i]=e
+    results=condorExe.run_exe_cmds(fetch_cmds,max_parallel)
+    for j in range(len(results)):
+        out[fetch_idxs[j]]=results[j]
+    return out
+
+# Same as fetchMulti, but load the data in the query objects
+# Returns a list with, for each query, either None or the exception that prevented the load
+def loadMulti(query_list,max_parallel=None,timeout=None):
+    results=fetchMulti(query_list,max_parallel,timeout)
+    out=[]
+    for i in range(len(query_list)):
+        if isinstance(results[i],Exception):
+            out.append(results[i])
+        else:
+            query_list[i][0].stored_data=results[i]
+            out.append(None)
+    return out
+
 #
 # Fully usable query functions
 #
@@ -295,11 +559,11 @@ class CondorQ(QueryExe):
 
         QueryExe.__init__(self,"condor_q",schedd_str,["ClusterId","ProcId"],pool_name,security_obj,env)
 
-    def fetch(self, constraint=None, format_list=None):
+    def getFetchCmd(self, constraint=None, format_list=None, timeout=None):
         if format_list != None:
             # check that ClusterId and ProcId are present, and if not add them
             format_list = complete_format_list(format_list, [("ClusterId", 'i'), ("ProcId", 'i')])
-        return QueryExe.fetch(self, constraint=constraint, format_list=format_list)
+        return QueryExe.getFetchCmd(self, constraint, format_list, timeout)
 
 
 # condor_q, where we have only one ProcId x ClusterId
@@ -314,11 +578,11 @@ class CondorQLite(QueryExe):
 
         QueryExe.__init__(self,"condor_q",schedd_str,"ClusterId",pool_name,security_obj,env)
 
-    def fetch(self, constraint=None, format_list=None):
+    def getFetchCmd(self, constraint=None, format_list=None, timeout=None):
         if format_list != None:
             # check that ClusterId is present, and if not add it
             format_list = complete_format_list(format_list, [("ClusterId", 'i')])
-        return QueryExe.fetch(self, constraint=constraint, format_list=format_list)
+        return QueryExe.getFetchCmd(self, constraint, format_list, timeout)
 
 
 # condor_status
@@ -331,11 +595,11 @@ class CondorStatus(QueryExe):
 
         QueryExe.__init__(self,"condor_status",subsystem_str,"Name",pool_name,security_obj,{})
 
-    def fetch(self, constraint=None, format_list=None):
+    def getFetchCmd(self, constraint=None, format_list=None, timeout=None):
         if format_list != None:
             # check that Name present and if not, add it
             format_list = complete_format_list(format_list, [("Name",'s')])
-        return QueryExe.fetch(self, constraint=constraint, format_list=format_list)
+        return QueryExe.getFetchCmd(self, constraint, format_list, timeout)
 
 #
 # Subquery classes
@@ -368,6 +632,21 @@ class SubQuery(BaseSubQuery):
     def __init__(self, query, constraint_func=None):
         BaseSubQuery.__init__(self, query, lambda d:applyConstraint(d, constraint_func))
 
+# Same as a SubQuery with an equality constraint on attr_list,
+# but load will just pick the matching bucket from the query index
+# (see StoredQuery.fetchStoredIndexed)
+class IndexedSubQuery(BaseSubQuery):
+    def __init__(self, query, attr_list, vals):
+        self.attr_list = tuple(attr_list)
+        self.vals = tuple(vals)
+        BaseSubQuery.__init__(self, query, lambda d:buildIndex(d, self.attr_list).get(self.vals, {}))
+
+    def load(self, constraint=None):
+        if constraint != None:
+            BaseSubQuery.load(self, constraint)
+        else:
+            self.stored_data = self.query.fetchStoredIndexed(self.attr_list, self.vals)
+
 class Group(BaseSubQuery):
     #  group_key_func  - Key extraction function
     #                      One argument: classad dictionary
@@ -407,6 +686,16 @@ class Summarize:
         data = self.query.fetchStored(constraint_func)
         return fetch2count(data, self.getHash(hash_func))
 
+    # Use data pre-stored in query
+    # Same as countStored, but done for each group of elements
+    # with the same values of group_attrs, in a single pass
+    # Returns a dictionary of group values (a tuple if more than one attr)
+    #    Elements are the same as returned by countStored
+    #    Elements missing any of group_attrs are not counted
+    def countStoredGroups(self, group_attrs, constraint_func=None, hash_func=None):
+        data = self.query.fetchStored(constraint_func)
+        return fetch2groupcount(data, group_attrs, self.getHash(hash_func))
+
     # Parameters, same as count
     # Returns a dictionary of hash values
     #    Elements are lists of keys (or more dictionaries if hash returns lists)
@@ -503,131 +792,201 @@ def complete_format_list(in_format_list, req_format_els):
 #</classads>
 #
 
-# 3 xml2list XML handler functions
-def xml2list_start_element(name, attrs):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-    if name == "c":
-        xml2list_inclassad = {}
-    elif name == "a":
-        xml2list_inattr = {"name": attrs["n"], "val": ""}
-        xml2list_intype = "s"
-    elif name == "i":
-        xml2list_intype = "i"
-    elif name == "r":
-        xml2list_intype = "r"
-    elif name == "b":
-        xml2list_intype = "b"
-        if attrs.has_key('v'):
-            xml2list_inattr["val"] = (attrs["v"] in ('T', 't', '1'))
-        else:
-            # extended syntax... value in text area
-            xml2list_inattr["val"] = None
-    elif name == "un":
-        xml2list_intype = "un"
-        xml2list_inattr["val"] = None
-    elif name in ("s", "e"):
-        pass # nothing to do
-    elif name == "classads":
-        pass # top element, nothing to do
-    else:
-        raise TypeError, "Unsupported type: %s" % name
-        
-def xml2list_end_element(name):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-    if name == "c":
-        xml2list_data.append(xml2list_inclassad)
-        xml2list_inclassad = None
-    elif name == "a":
-        xml2list_inclassad[xml2list_inattr["name"]] = xml2list_inattr["val"]
-        xml2list_inattr = None
-    elif name in ("i", "b", "un", "r"):
-        xml2list_intype = "s"
-    elif name in ("s", "e"):
-        pass # nothing to do
-    elif name == "classads":
-        pass # top element, nothing to do
-    else:
-        raise TypeError, "Unexpected type: %s" % name
-    
-def xml2list_char_data(data):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-    if xml2list_inattr == None:
-        # only process when in attribute
-        return
-
-    if xml2list_intype == "i":
-        xml2list_inattr["val"] = int(data)
-    elif xml2list_intype == "r":
-        xml2list_inattr["val"] = float(data)
-    elif xml2list_intype == "b":
-        if xml2list_inattr["val"] != None:
-            #nothing to do, value was in attribute
-            pass
+#
+# Streaming parser
+# Each object has its own state, so several can be used at the same time
+#
+# Usage:
+#   p=Xml2ListParser()
+#   for chunk in chunks:
+#     for classad in p.feed(chunk):
+#       ...
+#   for classad in p.close():
+#       ...
+#
+# Any text before the xml header is ignored
+#
+class Xml2ListParser:
+    def __init__(self):
+        self.ready_list = []      # classads completed but not yet returned
+        self.inclassad = None
+        self.inattr = None        # (name,type,value)
+        self.intext = None        # list of text chunks of the current attr
+        self.found_xml = False
+        self.pre_xml = ""         # data received before the xml header
+
+        self.p = xml.parsers.expat.ParserCreate()
+        self.p.buffer_text = True
+        self.p.StartElementHandler = self.start_element
+        self.p.EndElementHandler = self.end_element
+        self.p.CharacterDataHandler = self.char_data
+
+    # Parse a chunk of data
+    # Returns the list of classads completed by this chunk
+    def feed(self, data):
+        if not self.found_xml:
+            data = self.find_xml(data)
+            if data == None:
+                return []
+        self.parse(data, 0)
+        return self.pop_ready()
+
+    # Signal there is no more data
+    # Returns the list of remaining classads
+    def close(self):
+        if self.found_xml:
+            self.parse("", 1)
+        # else no xml, so nothing to return
+        return self.pop_ready()
+
+    ##########################################
+    # INTERNAL
+
+    # return the data from the xml header on, or None if not found yet
+    def find_xml(self, data):
+        data = self.pre_xml + data
+        if data[:5] == "<?xml":
+            idx = 0
         else:
-            xml2list_inattr["val"] = (data[0] in ('T', 't', '1'))
-    elif xml2list_intype == "un":
-        #nothing to do, value was in attribute
-        pass
-    else:
-        unescaped_data = string.replace(data, '\\"', '"')
-        xml2list_inattr["val"] += unescaped_data
-
-def xml2list(xml_data):
-    global xml2list_data, xml2list_inclassad, xml2list_inattr, xml2list_intype
-
-    xml2list_data = []
-    xml2list_inclassad = None
-    xml2list_inattr = None
-    xml2list_intype = None
-    
-    p = xml.parsers.expat.ParserCreate()
-    p.StartElementHandler = xml2list_start_element
-    p.EndElementHandler = xml2list_end_element
-    p.CharacterDataHandler = xml2list_char_data
-
-    found_xml = -1
-    for line in range(len(xml_data)):
-        # look for the xml header
-        if xml_data[line][:5] == "<?xml":
-            found_xml = line
-            break
+            idx = data.find("\n<?xml")
+            if idx < 0:
+                # keep only the last (possibly incomplete) line
+                self.pre_xml = data[data.rfind("\n") + 1:]
+                return None
+            idx += 1
+        self.found_xml = True
+        self.pre_xml = None
+        return data[idx:]
 
-    if found_xml >= 0:
+    def parse(self, data, is_final):
         try:
-            p.Parse(string.join(xml_data[found_xml:]), 1)
+            self.p.Parse(data, is_final)
         except TypeError, e:
             raise RuntimeError, "Failed to parse XML data, TypeError: %s" % e
         except:
             raise RuntimeError, "Failed to parse XML data, generic error"
-    # else no xml, so return an empty list
-    
-    return xml2list_data
+
+    def pop_ready(self):
+        out = self.ready_list
+        self.ready_list = []
+        return out
+
+    # XML handler functions
+    def start_element(self, name, attrs):
+        if name == "c":
+            self.inclassad = {}
+        elif name == "a":
+            self.inattr = [attrs["n"], "s", None]
+            self.intext = []
+        elif name in ("i", "r"):
+            self.inattr[1] = name
+            self.intext = []
+        elif name == "b":
+            self.inattr[1] = "b"
+            self.intext = []
+            if attrs.has_key('v'):
+                self.inattr[2] = (attrs["v"] in ('T', 't', '1'))
+            # else extended syntax... value in text area
+        elif name == "un":
+            self.inattr[1] = "un"
+        elif name == "e":
+            self.inattr[1] = "e"
+        elif name == "s":
+            pass # nothing to do
+        elif name == "classads":
+            pass # top element, nothing to do
+        else:
+            raise TypeError, "Unsupported type: %s" % name
+
+    def end_element(self, name):
+        if name == "c":
+            self.ready_list.append(self.inclassad)
+            self.inclassad = None
+        elif name == "a":
+            attr_name, attr_type, val = self.inattr
+            data = string.join(self.intext, "")
+            if attr_type == "i":
+                val = int(data)
+            elif attr_type == "r":
+                val = float(data)
+            elif attr_type == "b":
+                data = data.strip()
+                if (val == None) and (data != ""):
+                    val = (data[0] in ('T', 't', '1'))
+                # else value was in attribute
+            elif attr_type == "un":
+                pass # nothing to do, None
+            elif attr_type == "e":
+                # keep track it is an expression, not a string
+                val = classadExpr.ExprValue(string.replace(data, '\\"', '"'))
+            else:
+                val = string.replace(data, '\\"', '"')
+            self.inclassad[attr_name] = val
+            self.inattr = None
+            self.intext = None
+        elif name in ("i", "b", "un", "r", "s", "e"):
+            pass # value will be converted when closing the attribute
+        elif name == "classads":
+            pass # top element, nothing to do
+        else:
+            raise TypeError, "Unexpected type: %s" % name
+
+    def char_data(self, data):
+        if self.intext != None:
+            # only process when in attribute
+            self.intext.append(data)
+
+def xml2list(xml_data):
+    p = Xml2ListParser()
+    out = []
+    for line in xml_data:
+        out.extend(p.feed(line))
+    out.extend(p.close())
+    return out
 
 #
 # Convert a list to a dictionary
 #
 def list2dict(list_data, attr_name):
+    dict_data = {}
+    for list_el in list_data:
+        addList2Dict(dict_data, list_el, attr_name)
+    return dict_data
+
+# Add a single classad to the dictionary
+def addList2Dict(dict_data, list_el, attr_name):
     if type(attr_name) in (type([]), type((1, 2))):
         attr_list = attr_name
+        dict_name = []
+        for an in attr_name:
+            dict_name.append(list_el[an])
+        dict_name = tuple(dict_name)
     else:
         attr_list = [attr_name]
-    
-    dict_data = {}
-    for list_el in list_data:
-        if type(attr_name) in (type([]), type((1, 2))):
-            dict_name = []
-            for an in attr_name:
-                dict_name.append(list_el[an])
-            dict_name = tuple(dict_name)
-        else:
-            dict_name = list_el[attr_name]
-        # dict_el will have all the elements but those in attr_list
-        dict_el = {}
-        for a in list_el:
-            if not (a in attr_list):
-                dict_el[a] = list_el[a]
-        dict_data[dict_name] = dict_el
-    return dict_data
+        dict_name = list_el[attr_name]
+    # dict_el will have all the elements but those in attr_list
+    dict_el = {}
+    for a in list_el:
+        if not (a in attr_list):
+            dict_el[a] = list_el[a]
+    dict_data[dict_name] = dict_el
+
+# Same as addList2Dict, but store a CompactClassAd using the shared schema
+def addList2Compact(dict_data, list_el, attr_name, schema):
+    if type(attr_name) in (type([]), type((1, 2))):
+        attr_list = attr_name
+        dict_name = []
+        for an in attr_name:
+            dict_name.append(list_el[an])
+        dict_name = tuple(dict_name)
+    else:
+        attr_list = [attr_name]
+        dict_name = list_el[attr_name]
+    dict_el = CompactClassAd(schema)
+    for a in list_el:
+        if not (a in attr_list):
+            dict_el[a] = list_el[a]
+    dict_data[dict_name] = dict_el
 
 
 def applyConstraint(data, constraint_func):
@@ -641,6 +1000,30 @@ def applyConstraint(data, constraint_func):
     return outdata
 
 
+#
+# Build an equality index on attr_list
+# Returns a dictionary of
+#   value tuple => {key => el}
+# Elements missing any of the attributes are not indexed
+#
+def buildIndex(data, attr_list):
+    index = {}
+    for k in data.keys():
+        el = data[k]
+        vals = []
+        for attr in attr_list:
+            if not el.has_key(attr):
+                break
+            vals.append(el[attr])
+        else:
+            vals = tuple(vals)
+            if index.has_key(vals):
+                index[vals][k] = el
+            else:
+                index[vals] = {k:el}
+    return index
+
+
 def doGroup(indata, group_key_func, group_data_func):
     gdata = {}
     for k in indata.keys():
@@ -679,25 +1062,63 @@ def fetch2count(data, hash_func):
             # hash tells us it does not want to count this
             continue
 
-        # cel will point to the real counter
-        cel = count
+        add2count(count, hid)
+            
+    return count
 
-        # check if it is a list
-        if (type(hid) == type([])):
-            # have to create structure inside count
-            for h in hid[:-1]:
-                if not cel.has_key(h):
-                    cel[h] = {}
-                cel = cel[h]
-            hid = hid[-1]
+#
+# Same as fetch2count, but with a separate count
+# for each set of values of group_attrs
+#
+# Returns a dictionary of group values (tuples if len(group_attrs)>1)
+#    Elements are the same as returned by fetch2count
+def fetch2groupcount(data, group_attrs, hash_func):
+    counts = {}
+    for k in data.keys():
+        el = data[k]
 
-        if cel.has_key(hid):
-            count_el = cel[hid] + 1
+        group = []
+        for attr in group_attrs:
+            if not el.has_key(attr):
+                break
+            group.append(el[attr])
+        if len(group) != len(group_attrs):
+            continue # not in any group
+        if len(group) == 1:
+            group = group[0]
         else:
-            count_el = 1
-        cel[hid] = count_el
-            
-    return count
+            group = tuple(group)
+
+        hid = hash_func(el)
+        if hid == None:
+            # hash tells us it does not want to count this
+            continue
+
+        if not counts.has_key(group):
+            counts[group] = {}
+        add2count(counts[group], hid)
+
+    return counts
+
+# increment the counter of hid in count
+def add2count(count, hid):
+    # cel will point to the real counter
+    cel = count
+
+    # check if it is a list
+    if (type(hid) == type([])):
+        # have to create structure inside count
+        for h in hid[:-1]:
+            if not cel.has_key(h):
+                cel[h] = {}
+            cel = cel[h]
+        hid = hid[-1]
+
+    if cel.has_key(hid):
+        count_el = cel[hid] + 1
+    else:
+        count_el = 1
+    cel[hid] = count_el
 
 #
 # Inputs
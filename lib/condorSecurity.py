@@ -147,19 +147,37 @@ class SecEnvRequest:
 
     # you should call save_state before this one,
     # if you want to ever get back
+    #
+    # Changes the environment of the whole process;
+    # prefer passing get_env() to the command instead
     def enforce_requests(self):
+        env=self.get_env()
+        for env_key in env.keys():
+            val=env[env_key]
+            if val!=None:
+                os.environ[env_key]=val
+            else:
+                # unset -> make sure it is not in the env after the call
+                if os.environ.has_key(env_key):
+                    del os.environ[env_key]
+        return
+
+    # Returns the environment changes needed to enforce the requests,
+    # as a new dictionary of env_key:val, with val==None meaning unset
+    # To be passed to the commands (see condorExe.ExeCmd),
+    # so the environment of the process is never touched
+    def get_env(self):
+        env={}
         for context in self.requests.keys():
             for feature in self.requests[context].keys():
                 condor_key="SEC_%s_%s"%(context,feature)
                 env_key="_CONDOR_%s"%condor_key
                 val=self.requests[context][feature]
                 if val!=UNSET_VALUE:
-                    os.environ[env_key]=val
+                    env[env_key]=val
                 else:
-                    # unset -> make sure it is not in the env after the call
-                    if os.environ.has_key(env_key):
-                        del os.environ[env_key]
-        return
+                    env[env_key]=None
+        return env
 
 ########################################################################
 #
@@ -290,6 +308,7 @@ class GSIRequest(ProtoRequest):
 
 
     ##############################################
-    def enforce_requests(self):
-        ProtoRequest.enforce_requests(self)
-        os.environ['X509_USER_PROXY']=self.x509_proxy
+    def get_env(self):
+        env=ProtoRequest.get_env(self)
+        env['X509_USER_PROXY']=self.x509_proxy
+        return env
@@ -0,0 +1,53 @@
+#
+# Project:
+#   glideinWMS
+#
+# File Version:
+#
+# Description:
+#   Process-wide cache of parsed configuration files
+#   A file is parsed again only when its mtime or size changes
+#
+
+import os
+
+class ConfigCache:
+    def __init__(self):
+        self.entries = {}      # (fname, key) -> (mtime, size, value)
+        self.hits = 0
+        self.reloads = 0
+        self.file_reloads = {} # fname -> number of times it was parsed
+
+    # Returns the parsed value of fname
+    # parse_func(fname) is called only if the file is new or changed
+    # key distinguishes different ways of parsing the same file
+    # The returned value is shared, the caller must not modify it
+    def get(self, fname, parse_func, key=None):
+        fname = os.path.abspath(fname)
+        st = os.stat(fname) # taken before reading, so changes while parsing are seen next time
+        ckey = (fname, key)
+        if self.entries.has_key(ckey):
+            mtime, size, value = self.entries[ckey]
+            if (mtime == st.st_mtime) and (size == st.st_size):
+                self.hits += 1
+                return value
+
+        value = parse_func(fname)
+        self.entries[ckey] = (st.st_mtime, st.st_size, value)
+        self.reloads += 1
+        self.file_reloads[fname] = self.file_reloads.get(fname, 0) + 1
+        return value
+
+    def get_reloads(self, fname):
+        return self.file_reloads.get(os.path.abspath(fname), 0)
+
+    def clear(self):
+        self.entries = {}
+
+# Returns a key for the function that is the same for every call
+# (lambdas are new objects every time, but share the code)
+def func_key(func):
+    return getattr(func, 'func_code', func)
+
+# global cache of the process
+config_cache = ConfigCache()
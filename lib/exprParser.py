@@ -161,3 +161,44 @@ def unparse(obj,raise_on_unknown=False):
             raise TypeError, "Unsupported instance type: %s"%repr(obj)
         else:
             return "<unknown>"
+
+# find all the ways a variable is accessed in an ast object
+# returns the list of constant subscript paths applied to the variable,
+#  e.g. [('attrs','GLIDEIN_Site')] for glidein['attrs']['GLIDEIN_Site']
+#  an empty path means the variable is used as a whole
+# returns None if the variable is (re)bound inside the expression
+def get_subscript_paths(obj,var_name):
+    paths=[]
+    if not _find_subscript_paths(obj,var_name,paths):
+        return None
+    return paths
+
+# if obj is a chain of constant subscripts applied to var_name,
+# return the path, else None
+def _get_subscript_path(obj,var_name):
+    if isinstance(obj, Name):
+        if obj.name==var_name:
+            return ()
+        return None
+    elif isinstance(obj, Subscript):
+        if (obj.flags=='OP_APPLY') and (len(obj.subs)==1) and isinstance(obj.subs[0],Const):
+            path=_get_subscript_path(obj.expr,var_name)
+            if path!=None:
+                return path+(obj.subs[0].value,)
+    return None
+
+# returns False if the variable is (re)bound
+def _find_subscript_paths(obj,var_name,paths):
+    path=_get_subscript_path(obj,var_name)
+    if path!=None:
+        if not (path in paths):
+            paths.append(path)
+        return True
+    if isinstance(obj, Lambda) and (var_name in obj.argnames):
+        return False
+    if isinstance(obj, compiler.ast.AssName) and (obj.name==var_name):
+        return False
+    for n in obj.getChildNodes():
+        if not _find_subscript_paths(n,var_name,paths):
+            return False
+    return True
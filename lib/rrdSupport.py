@@ -483,55 +483,32 @@ class DummyDiskLock:
 def dummy_disk_lock():
     return DummyDiskLock()
 
-#################################
-def string_quote_join(arglist):
-    l2 = []
-    for e in arglist:
-        l2.append('"%s"' % e)
-    return string.join(l2)
-
 #################################
 # this class is used in place of the rrdtool
 # python module, if that one is not available
 class rrdtool_exe:
     def __init__(self):
-        import popen2
-        self.popen2_obj = popen2
+        import condorExe
+        self.condorExe_obj = condorExe
         self.rrd_bin = self.iexe_cmd("which rrdtool")[0][:-1]
 
     def create(self, *args):
-        cmdline = '%s create %s' % (self.rrd_bin, string_quote_join(args))
-        self.iexe_cmd(cmdline)
+        self.iexe_cmd([self.rrd_bin, 'create'] + list(args))
         return
 
     def update(self, *args):
-        cmdline = '%s update %s' % (self.rrd_bin, string_quote_join(args))
-        self.iexe_cmd(cmdline)
+        self.iexe_cmd([self.rrd_bin, 'update'] + list(args))
         return
 
     def graph(self, *args):
-        cmdline = '%s graph %s' % (self.rrd_bin, string_quote_join(args))
-        self.iexe_cmd(cmdline)
+        self.iexe_cmd([self.rrd_bin, 'graph'] + list(args))
         return
 
     ##########################################
+    # cmd is executed directly, without a shell, if it is a list
     def iexe_cmd(self, cmd):
-        child=self.popen2_obj.Popen3(cmd,True)
-        child.tochild.close()
-        tempOut = child.fromchild.readlines()
-        child.fromchild.close()
-        tempErr = child.childerr.readlines()
-        child.childerr.close()
         try:
-            errcode = child.wait()
-        except OSError, e:
-            if len(tempOut) != 0:
-                # if there was some output, it is probably just a problem of timing
-                # have seen a lot of those when running very short processes
-                errcode = 0
-            else:
-                raise RuntimeError, "Error running '%s'\nStdout:%s\nStderr:%s\nException OSError: %s" % (cmd, tempOut, tempErr, e)
-        if (errcode != 0):
-            raise RuntimeError, "Error running '%s'\ncode %i:%s" % (cmd, errcode, tempErr)
-        return tempOut
+            return self.condorExe_obj.iexe_cmd(cmd)
+        except self.condorExe_obj.ExeError, e:
+            raise RuntimeError, str(e)
 
@@ -0,0 +1,122 @@
+#
+# Project:
+#   glideinWMS
+#
+# File Version:
+#
+# Description:
+#   Token buckets shared between processes
+#   The state is kept in a small file, updated under an exclusive lock,
+#   so any process using the same file draws from the same bucket
+#
+
+import os
+import time
+import fcntl
+import string
+
+# the rate is never reduced below this fraction of the configured one
+MIN_RATE_FRACTION = 0.1
+
+# weight of the newest latency in the running average
+LATENCY_WEIGHT = 0.3
+
+class SharedTokenBucket:
+    """
+    rate tokens per second are added to the bucket, up to burst
+
+    If target_latency is defined, the rate is reduced proportionally
+    when the reported latencies are above it
+    """
+    def __init__(self, fname, rate, burst, target_latency=None):
+        self.fname = fname
+        self.rate = rate
+        self.burst = burst
+        self.target_latency = target_latency
+
+    # Take up to nr tokens from the bucket, without waiting
+    # Returns the number of tokens obtained
+    def acquire(self, nr, now=None):
+        if now == None:
+            now = time.time()
+        fd = self.lock()
+        try:
+            tokens, last_time, latency = self.read(fd, now)
+            tokens = self.refill(tokens, last_time, latency, now)
+            granted = max(min(nr, int(tokens)), 0)
+            self.write(fd, tokens - granted, now, latency)
+        finally:
+            fd.close()
+        return granted
+
+    # Give back unused tokens, e.g. if the action failed to start
+    def release(self, nr, now=None):
+        if now == None:
+            now = time.time()
+        fd = self.lock()
+        try:
+            tokens, last_time, latency = self.read(fd, now)
+            tokens = self.refill(tokens, last_time, latency, now)
+            self.write(fd, min(tokens + nr, self.burst), now, latency)
+        finally:
+            fd.close()
+
+    # Report how long an action took, in seconds
+    def report_latency(self, new_latency, now=None):
+        if now == None:
+            now = time.time()
+        fd = self.lock()
+        try:
+            tokens, last_time, latency = self.read(fd, now)
+            tokens = self.refill(tokens, last_time, latency, now)
+            if latency == None:
+                latency = new_latency
+            else:
+                latency = LATENCY_WEIGHT * new_latency + (1 - LATENCY_WEIGHT) * latency
+            self.write(fd, tokens, now, latency)
+        finally:
+            fd.close()
+
+    # The rate in use, given the average latency
+    def get_rate(self, latency):
+        if (self.target_latency == None) or (latency == None) or (latency <= self.target_latency):
+            return self.rate
+        return max(self.rate * self.target_latency / latency, self.rate * MIN_RATE_FRACTION)
+
+    ##############################################
+    # INTERNAL
+
+    def refill(self, tokens, last_time, latency, now):
+        elapsed = max(now - last_time, 0) # protect against clock changes
+        return min(tokens + elapsed * self.get_rate(latency), self.burst)
+
+    # Returns the locked file
+    def lock(self):
+        try:
+            fd = open(self.fname, "r+")
+        except IOError:
+            fd = open(self.fname, "a+") # create it
+        fcntl.flock(fd, fcntl.LOCK_EX) # released by close
+        return fd
+
+    # Returns (tokens, last_time, latency)
+    # A new (or corrupted) bucket is full
+    def read(self, fd, now):
+        fd.seek(0)
+        arr = string.split(fd.read())
+        try:
+            tokens = float(arr[0])
+            last_time = float(arr[1])
+            if arr[2] == "None":
+                latency = None
+            else:
+                latency = float(arr[2])
+        except (IndexError, ValueError):
+            return (self.burst, now, None)
+        return (tokens, last_time, latency)
+
+    def write(self, fd, tokens, now, latency):
+        fd.seek(0)
+        fd.truncate()
+        fd.write("%f %f %s\n" % (tokens, now, latency))
+        fd.flush()
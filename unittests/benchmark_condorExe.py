@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Micro-benchmark of the per-command overhead of the condorExe launcher
+#
+# Usage: benchmark_condorExe.py [nr_runs]
+#
+# Each command is run nr_runs times:
+#  popen2 - the old launcher, popen2.Popen3 through the shell
+#  shell  - ExeCmd, with a command line (through /bin/sh)
+#  argv   - ExeCmd, with the argv list (no shell)
+# The commands not found in the PATH (or condor bin/sbin) are skipped
+#
+
+import os
+import sys
+import time
+import popen2
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+import unittest_utils
+
+import condorExe
+
+# name, args
+BENCH_CMDS = [('condor_q', ['-version']),
+              ('condor_advertise', ['-version']),
+              ('rrdtool', ['info', '/dev/null']),
+              ('true', [])]
+
+def find_exe(name):
+    path_list = os.environ.get('PATH', '').split(':')
+    for p in (condorExe.condor_bin_path, condorExe.condor_sbin_path):
+        if p != None:
+            path_list.insert(0, p)
+    for p in path_list:
+        fname = os.path.join(p, name)
+        if os.access(fname, os.X_OK):
+            return fname
+    return None
+
+def run_popen2(cmd):
+    child = popen2.Popen3(cmd, True)
+    child.tochild.close()
+    child.fromchild.read()
+    child.childerr.read()
+    child.fromchild.close()
+    child.childerr.close()
+    child.wait()
+
+def run_exe_cmd(cmd):
+    try:
+        condorExe.iexe_cmd(cmd)
+    except condorExe.ExeError:
+        pass # only the overhead is of interest
+
+# Returns the average time per run, in ms
+def bench(function, cmd, nr_runs):
+    start_time = time.time()
+    for i in range(nr_runs):
+        function(cmd)
+    return (time.time() - start_time) * 1000.0 / nr_runs
+
+def main(argv):
+    nr_runs = 100
+    if len(argv) > 1:
+        nr_runs = int(argv[1])
+
+    print "%-18s %10s %10s %10s   (ms per command, %i runs)" % ("command", "popen2", "shell", "argv", nr_runs)
+    for name, args in BENCH_CMDS:
+        exe = find_exe(name)
+        if exe == None:
+            print "%-18s %10s" % (name, "not found")
+            continue
+        argv_cmd = [exe] + args
+        str_cmd = " ".join(argv_cmd)
+        print "%-18s %10.2f %10.2f %10.2f" % (name,
+                                              bench(run_popen2, str_cmd, nr_runs),
+                                              bench(run_exe_cmd, str_cmd, nr_runs),
+                                              bench(run_exe_cmd, argv_cmd, nr_runs))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import os
+import sys
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import condorMonitor
+import classadExpr
+
+class TestConstraint(unittest.TestCase):
+    """
+    Test the python evaluation of ClassAd constraints
+    """
+    def setUp(self):
+        self.ad = {'JobUniverse': 5, 'Owner': 'Alice', 'DESIRED_Sites': 'A, B,C',
+                   'Remaps': None, 'Rank': 2.5, 'WantGlidein': True}
+
+    def evaluate(self, expr_str):
+        return classadExpr.Constraint(expr_str).evaluate(self.ad)
+
+    def test_query_expr(self):
+        c = classadExpr.Constraint('(JobUniverse==5)&&(GLIDEIN_Is_Monitor =!= TRUE)&&(JOB_Is_Monitor =!= TRUE)')
+        self.failUnless(c(self.ad))
+        self.assertEqual(c.attrs, ['JobUniverse', 'GLIDEIN_Is_Monitor', 'JOB_Is_Monitor'])
+        self.ad['JOB_Is_Monitor'] = True
+        self.failIf(c(self.ad))
+
+    def test_case(self):
+        # attribute names are case insensitive, and so is == on strings
+        self.assertEqual(self.evaluate('jobuniverse == 5'), True)
+        self.assertEqual(self.evaluate('Owner == "alice"'), True)
+        self.assertEqual(self.evaluate('Owner =?= "alice"'), False)
+        self.assertEqual(self.evaluate('MY.Owner is "Alice"'), True)
+
+    def test_undefined(self):
+        self.assertEqual(self.evaluate('Missing == 3'), classadExpr.UNDEFINED)
+        self.assertEqual(self.evaluate('!(Missing == 3)'), classadExpr.UNDEFINED)
+        self.assertEqual(self.evaluate('(Missing == 3) || true'), True)
+        self.assertEqual(self.evaluate('(Missing == 3) && false'), False)
+        self.assertEqual(self.evaluate('Remaps =?= UNDEFINED'), True)
+        self.assertEqual(self.evaluate('isUndefined(Missing) ? 1 : 2'), 1)
+        self.failIf(classadExpr.Constraint('Missing == 3')(self.ad))
+
+    def test_arithmetic(self):
+        self.assertEqual(self.evaluate('Rank * 2 > 4'), True)
+        self.assertEqual(self.evaluate('-7 / 2'), -3)
+        self.assertEqual(self.evaluate('7 % 3'), 1)
+        self.assertEqual(self.evaluate('1 / 0'), classadExpr.ERROR)
+        self.assertEqual(self.evaluate('Owner + 1'), classadExpr.ERROR)
+
+    def test_functions(self):
+        self.assertEqual(self.evaluate('stringListMember("B", DESIRED_Sites)'), True)
+        self.assertEqual(self.evaluate('stringListMember("b", DESIRED_Sites)'), False)
+        self.assertEqual(self.evaluate('StringListIMember("b", DESIRED_Sites)'), True)
+        # empty items are not members
+        self.assertEqual(self.evaluate('stringListMember("", "a, b")'), False)
+        self.assertEqual(self.evaluate('stringListMember("", "a,,b")'), False)
+        self.assertEqual(self.evaluate('stringListMember("b", "a,,b")'), True)
+        self.assertEqual(self.evaluate('regexp("^al", Owner, "i")'), True)
+        self.assertEqual(self.evaluate('ifThenElse(WantGlidein, strcat(Owner, "-", JobUniverse), "no")'), 'Alice-5')
+
+    def test_expr_value(self):
+        # attributes that are expressions cannot be evaluated here
+        self.ad['RequestMemory'] = classadExpr.ExprValue('ifThenElse(MemoryUsage =!= UNDEFINED, MemoryUsage, 1000)')
+        self.assertEqual(self.ad['RequestMemory'], 'ifThenElse(MemoryUsage =!= UNDEFINED, MemoryUsage, 1000)')
+        self.assertRaises(classadExpr.NotEvaluable, classadExpr.Constraint('RequestMemory <= 2000'), self.ad)
+        self.assertEqual(self.evaluate('JobUniverse == 5'), True)
+
+    def test_unsupported(self):
+        for expr_str in ('TARGET.Memory > 1', 'foo(1)', '(1', '1 +', 'Attr[1]', '1 | 2', ''):
+            self.assertRaises(ValueError, classadExpr.Constraint, expr_str)
+
+    def test_compact(self):
+        data = {}
+        schema = condorMonitor.CompactSchema(['JobUniverse', 'Owner'])
+        for i in range(30):
+            el = {'ClusterId': i, 'ProcId': 0, 'JobUniverse': 5 + (i % 2)}
+            if i % 3 == 0:
+                el['Owner'] = 'user%i' % (i % 2)
+            condorMonitor.addList2Compact(data, el, ["ClusterId", "ProcId"], schema)
+        c = classadExpr.Constraint('(JobUniverse == 5) && (owner =!= "user0")')
+        self.assertEqual(len(condorMonitor.applyConstraint(data, c)), 10)
+
+def main():
+    return runTest(TestConstraint)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os
 import sys
+import time
 import unittest
 
 # unittest_utils will handle putting the appropriate directories on the python
@@ -93,6 +94,73 @@ class TestCondorExe(unittest.TestCase):
         for script in self.abnormal_exit_scripts:
             self.failUnlessRaises(ExeError, exe_cmd_sbin, script, self.dummy_args)
 
+    def test_run_exe_cmds(self):
+        """
+        run_exe_cmds runs the commands in parallel, and returns either the
+        output or the error of each; the slow ones are killed
+        """
+        exe_cmds = [condorExe.ExeCmd("sleep 1; echo one"),
+                    condorExe.ExeCmd("sleep 1; echo two"),
+                    condorExe.ExeCmd(os.path.join(condorExe.condor_bin_path, 'write_exit_1.sh')),
+                    condorExe.ExeCmd("sleep 10", timeout=1)]
+        start_time = time.time()
+        results = condorExe.run_exe_cmds(exe_cmds)
+        self.failUnless(time.time() - start_time < 5)
+        self.assertEqual(results[0], ["one\n"])
+        self.assertEqual(results[1], ["two\n"])
+        self.failUnless(isinstance(results[2], ExeError))
+        self.failUnless(isinstance(results[3], ExeError))
+        self.failUnless(exe_cmds[0].get_duration() >= 1)
+
+        # the limit on the parallelism is respected
+        exe_cmds = [condorExe.ExeCmd("sleep 1") for i in range(3)]
+        start_time = time.time()
+        results = condorExe.run_exe_cmds(exe_cmds, max_parallel=1)
+        self.failUnless(time.time() - start_time >= 3)
+        self.assertEqual(results, [[], [], []])
+
+    def test_exe_batch(self):
+        """
+        ExeBatch limits the commands running against the same target,
+        and collects the result, error and duration of each
+        """
+        batch = condorExe.ExeBatch(max_per_target=1)
+        batch.add(condorExe.ExeCmd("sleep 1; echo a1"), target="a", key="a1")
+        batch.add(condorExe.ExeCmd("sleep 1; echo a2"), target="a", key="a2")
+        batch.add(condorExe.ExeCmd("sleep 1; echo b1"), target="b", key="b1")
+        batch.add(condorExe.ExeCmd(["false"]), target="b", key="b2")
+        start_time = time.time()
+        results = batch.run()
+        duration = time.time() - start_time
+        self.failUnless((duration >= 2) and (duration < 3))
+        self.assertEqual([r.key for r in results], ["a1", "a2", "b1", "b2"])
+        self.assertEqual(results[1].output, ["a2\n"])
+        self.failUnless(results[0].duration >= 1)
+        self.failIf(results[3].is_ok())
+        self.assertEqual(batch.get_ok_keys(), ["a1", "a2", "b1"])
+        self.assertEqual(len(batch.get_errors()), 1)
+
+    def test_env(self):
+        """
+        The env changes are seen by the command only
+        """
+        os.environ['TEST_CONDOREXE_UNSET'] = 'old'
+        try:
+            env = {'TEST_CONDOREXE_SET': 'new', 'TEST_CONDOREXE_UNSET': None}
+            self.assertEqual(iexe_cmd('echo "$TEST_CONDOREXE_SET-${TEST_CONDOREXE_UNSET-unset}"', env=env), ["new-unset\n"])
+            self.failIf(os.environ.has_key('TEST_CONDOREXE_SET'))
+            self.assertEqual(os.environ['TEST_CONDOREXE_UNSET'], 'old')
+        finally:
+            del os.environ['TEST_CONDOREXE_UNSET']
+
+    def test_argv(self):
+        """
+        A list is executed directly, so the arguments are passed as they are
+        """
+        self.assertEqual(iexe_cmd(["echo", "a  b", "'c'", "$HOME"]), ["a  b 'c' $HOME\n"])
+        self.failUnlessRaises(ExeError, iexe_cmd, [os.path.join(condorExe.condor_bin_path, "missing.sh")])
+        self.failUnlessRaises(ExeError, exe_cmd, "write_exit_1.sh", [self.dummy_args])
+
 def main():
     return runTest(TestCondorExe)
 
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+import os
+import sys
+import cPickle
+import shutil
+import tempfile
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import condorLogParser
+
+def event(status, jobid, ev_time="09/28 01:38:53"):
+    return "%s (%s.000) %s Event\n    some details\n...\n" % (status, jobid, ev_time)
+
+class TestIncrementalParsing(unittest.TestCase):
+    """
+    Test that parsing only the new events of a log
+    gives the same result as parsing the whole log
+    """
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.logname = os.path.join(self.work_dir, "condor_activity_test.log")
+        self.write("")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write(self, text, mode="w"):
+        fd = open(self.logname, mode)
+        fd.write(text)
+        fd.close()
+
+    def check(self):
+        summary = condorLogParser.logSummary(self.logname, self.work_dir)
+        summary.loadFromLog()
+        ref = condorLogParser.listAndInterpretRawStatuses(condorLogParser.parseSubmitLogFastRaw(self.logname),
+                                                          condorLogParser.listStatuses)
+        self.assertEqual(summary.data, ref)
+
+        timings = condorLogParser.logSummaryTimings(self.logname, self.work_dir)
+        timings.loadFromLog()
+        jobs, start_time, end_time = condorLogParser.parseSubmitLogFastRawTimings(self.logname)
+        self.assertEqual(timings.data, condorLogParser.listAndInterpretRawStatuses(jobs, condorLogParser.listStatusesTimings))
+        self.assertEqual((timings.startTime, timings.endTime), (start_time, end_time))
+        return summary.data
+
+    def test_append(self):
+        self.check()
+        self.write(event("000", "001.000") + event("000", "001.001", "09/28 01:39:00"), "a")
+        self.assertEqual(self.check(), {'Wait': ['001.000', '001.001']})
+        self.write(event("001", "001.000", "09/28 02:00:00") + event("020", "001.001"), "a")
+        self.check()
+        # the partial events are read once they are complete
+        self.write(event("021", "001.001")[:20], "a")
+        self.check()
+        self.write(event("021", "001.001")[20:] + event("005", "001.000", "09/28 03:00:00"), "a")
+        self.assertEqual(self.check(), {'Completed': ['001.000'], 'Idle': ['001.001']})
+
+        header, state = condorLogParser.loadCacheWithHeader(condorLogParser.logSummary(self.logname, self.work_dir).statename)
+        self.assertEqual(header['offset'], os.path.getsize(self.logname))
+
+    def test_truncate(self):
+        self.write(event("000", "001.000") + event("001", "001.000") + event("005", "001.000"))
+        self.assertEqual(self.check(), {'Completed': ['001.000']})
+        # a new, shorter log must not reuse the old state
+        self.write(event("000", "002.000"))
+        self.assertEqual(self.check(), {'Wait': ['002.000']})
+        # same for a rotated one, even if longer
+        os.rename(self.logname, self.logname + ".old")
+        self.write(event("000", "003.000") + event("001", "003.000") + event("000", "003.001"))
+        self.assertEqual(self.check(), {'Running': ['003.000'], 'Wait': ['003.001']})
+
+class TestDirLoad(unittest.TestCase):
+    """
+    Test that loading the log files in parallel
+    gives the same result as loading them one by one
+    """
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        for i in range(7):
+            fd = open(os.path.join(self.work_dir, "condor_activity_%i.log" % i), "w")
+            for j in range(i * 10):
+                fd.write(event("000", "%03i.%03i" % (i, j)))
+                if j % 3 == 0:
+                    fd.write(event("001", "%03i.%03i" % (i, j)))
+            fd.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def load(self, nr_workers):
+        for fname in os.listdir(self.work_dir):
+            if fname[-4:] != ".log":
+                os.unlink(os.path.join(self.work_dir, fname)) # caches
+        dir_summary = condorLogParser.dirSummaryTimings(self.work_dir, "condor_activity_")
+        dir_summary.load(nr_workers=nr_workers)
+        return dir_summary
+
+    def test_parallel(self):
+        serial = self.load(1)
+        self.assertEqual(serial.load_stats['nr_workers'], 1)
+        self.assertEqual(len(serial.data['Running']), 72) # every 3rd job of each file
+        for nr_workers in (3, None):
+            parallel = self.load(nr_workers)
+            self.assertEqual(parallel.data, serial.data)
+            self.assertEqual(sorted(parallel.load_stats['files'].keys()), sorted(serial.load_stats['files'].keys()))
+
+class TestCacheFormat(unittest.TestCase):
+    """
+    Test the cache files, and the conversion of the old ones
+    """
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.work_dir, "condor_activity_test.log.cstpk")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_save_load(self):
+        data = {'Running': [('001.000', '09/28 01:38:53', '', '09/28 01:38:53')], 'Idle': []}
+        header = {'inode': 12, 'size': 345, 'offset': 345}
+        condorLogParser.saveCache(self.fname, data, header)
+        self.assertEqual(condorLogParser.loadCacheWithHeader(self.fname), (header, data))
+        self.assertEqual(condorLogParser.loadCache(self.fname), data)
+
+        condorLogParser.saveCache(self.fname, data)
+        self.assertEqual(condorLogParser.loadCacheWithHeader(self.fname), (None, data))
+
+    def test_old_format(self):
+        data = ['condor_activity_1.log', 'condor_activity_2.log']
+        fd = open(self.fname, "w")
+        cPickle.dump(data, fd)
+        fd.close()
+        self.assertEqual(condorLogParser.loadCache(self.fname), data)
+        # it was converted
+        fd = open(self.fname, "rb")
+        self.failUnless(fd.readline().startswith(condorLogParser.CACHE_MAGIC))
+        fd.close()
+        self.assertEqual(condorLogParser.loadCache(self.fname), data)
+
+def main():
+    r1 = runTest(TestIncrementalParsing)
+    r2 = runTest(TestDirLoad)
+    r3 = runTest(TestCacheFormat)
+    return r1 or r2 or r3
+
+if __name__ == '__main__':
+    sys.exit(main())
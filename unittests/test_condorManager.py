@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import condorExe
+import condorManager
+
+# behaves like condor_rm/condor_release, but fails on the jobs of cluster 9
+# the error is also on stdout, to make sure it is not taken for a success
+FAKE_CONDOR_CMD = """#!/bin/sh
+echo "$*" >> "$0.log"
+case "$0" in
+  *release) word="released";;
+  *) word="marked for removal";;
+esac
+rc=0
+for a in "$@"; do
+  case "$a" in
+    9.*) echo "Job $a not found"; rc=1;;
+    [0-9]*.[0-9]*) echo "Job $a $word";;
+  esac
+done
+exit $rc
+"""
+
+class TestBulkCmd(unittest.TestCase):
+    """
+    Test the bulk condor_rm/condor_release
+    """
+    def setUp(self):
+        self.bin_dir = tempfile.mkdtemp()
+        for cmd in ("condor_rm", "condor_release"):
+            fname = os.path.join(self.bin_dir, cmd)
+            fd = open(fname, "w")
+            fd.write(FAKE_CONDOR_CMD)
+            fd.close()
+            os.chmod(fname, 0755)
+        self.old_bin_path = condorExe.condor_bin_path
+        condorExe.condor_bin_path = self.bin_dir
+
+    def tearDown(self):
+        condorExe.condor_bin_path = self.old_bin_path
+        shutil.rmtree(self.bin_dir)
+
+    def get_calls(self, cmd):
+        fd = open(os.path.join(self.bin_dir, "%s.log" % cmd))
+        lines = fd.readlines()
+        fd.close()
+        return [line.strip() for line in lines]
+
+    def test_chunks(self):
+        id_list = ["1.0", "1.1", "2.0", "3.0", "3.1"]
+        sleeps = []
+        orig_sleep = condorManager.time.sleep
+        condorManager.time.sleep = sleeps.append
+        try:
+            done_list, error_list = condorManager.condorRemoveList(id_list, max_chunk=2, sleep_time=0.5, schedd_lookup_cache=None)
+        finally:
+            condorManager.time.sleep = orig_sleep
+        self.assertEqual(done_list, id_list)
+        self.assertEqual(error_list, [])
+        self.assertEqual(self.get_calls("condor_rm"), ["1.0 1.1", "2.0 3.0", "3.1"])
+        # only between the commands
+        self.assertEqual(sleeps, [0.5, 0.5])
+
+        done_list, error_list = condorManager.condorRemoveList(["4.0"], do_forcex=True, schedd_lookup_cache=None)
+        self.assertEqual(done_list, ["4.0"])
+        self.assertEqual(self.get_calls("condor_rm")[-1], "-forcex 4.0")
+
+    def test_partial_failure(self):
+        id_list = ["1.0", "9.0", "2.0", "9.1", "3.0"]
+        done_list, error_list = condorManager.condorReleaseList(id_list, max_chunk=3, schedd_lookup_cache=None)
+        self.assertEqual(done_list, ["1.0", "2.0", "3.0"])
+        self.assertEqual(len(error_list), 2)
+        self.assertEqual(len(self.get_calls("condor_release")), 2)
+
+    def test_extract_ids(self):
+        lines = ["Job 1.0 marked for removal\n",
+                 "Job 2.0 removed locally (remote state unknown)\n",
+                 "Couldn't find/remove all jobs matching 3.0\n",
+                 "Job 4.0 released\n"]
+        self.assertEqual(condorManager.extract_ids(lines, ["1.0", "2.0", "3.0", "4.0"], condorManager.RM_DONE_RE), ["1.0", "2.0"])
+        self.assertEqual(condorManager.extract_ids(lines, ["1.0", "2.0", "3.0", "4.0"], condorManager.RELEASE_DONE_RE), ["4.0"])
+
+def main():
+    return runTest(TestBulkCmd)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import cPickle
+import tempfile
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import condorExe
+import condorMonitor
+import classadExpr
+
+class TestXml2List(unittest.TestCase):
+    """
+    Test the streaming ClassAd XML parser used by condorMonitor
+    """
+    def setUp(self):
+        self.xml_lines = ['Some warning printed before the XML\n',
+                          '<?xml version="1.0"?>\n',
+                          '<!DOCTYPE classads SYSTEM "classads.dtd">\n',
+                          '<classads>\n']
+        for i in range(50):
+            self.xml_lines += ['<c>\n',
+                               '    <a n="ClusterId"><i>%i</i></a>\n' % (100 + i),
+                               '    <a n="ProcId"><i>0</i></a>\n',
+                               '    <a n="Owner"><s>user\\"%i</s></a>\n' % i,
+                               '    <a n="Rank"><r>%i.5</r></a>\n' % i,
+                               '    <a n="OnExitRemove"><b v="t"/></a>\n',
+                               '    <a n="ExitBySignal"><b v="f"/></a>\n',
+                               '    <a n="Remaps"><un/></a>\n',
+                               '    <a n="RequestMemory"><e>ifThenElse(MemoryUsage =!= UNDEFINED, MemoryUsage, 1000)</e></a>\n',
+                               '</c>\n']
+        self.xml_lines.append('</classads>\n')
+        self.xml_str = "".join(self.xml_lines)
+
+    def check_list(self, data):
+        self.assertEqual(len(data), 50)
+        for i in range(50):
+            el = data[i]
+            self.assertEqual(el['ClusterId'], 100 + i)
+            self.assertEqual(el['ProcId'], 0)
+            self.assertEqual(el['Owner'], 'user"%i' % i)
+            self.assertEqual(el['Rank'], i + 0.5)
+            self.assertEqual(el['OnExitRemove'], True)
+            self.assertEqual(el['ExitBySignal'], False)
+            self.assertEqual(el['Remaps'], None)
+            self.assertEqual(el['RequestMemory'], 'ifThenElse(MemoryUsage =!= UNDEFINED, MemoryUsage, 1000)')
+            self.failUnless(isinstance(el['RequestMemory'], classadExpr.ExprValue))
+
+    def test_xml2list(self):
+        self.check_list(condorMonitor.xml2list(self.xml_lines))
+
+    def test_no_xml(self):
+        self.assertEqual(condorMonitor.xml2list(['Nothing here\n']), [])
+
+    def test_chunks(self):
+        """
+        Feed the data in small chunks, splitting the header and the values
+        at arbitrary places, and interleave two parsers to make sure
+        they do not share any state.
+        """
+        for chunk_size in (1, 7, 64, 4096):
+            p1 = condorMonitor.Xml2ListParser()
+            p2 = condorMonitor.Xml2ListParser()
+            out1 = []
+            out2 = []
+            for start in range(0, len(self.xml_str), chunk_size):
+                chunk = self.xml_str[start:start + chunk_size]
+                out1.extend(p1.feed(chunk))
+                out2.extend(p2.feed(chunk))
+            out1.extend(p1.close())
+            out2.extend(p2.close())
+            self.check_list(out1)
+            self.check_list(out2)
+
+    def test_list2dict(self):
+        data = condorMonitor.list2dict(condorMonitor.xml2list(self.xml_lines),
+                                       ["ClusterId", "ProcId"])
+        self.assertEqual(len(data), 50)
+        self.assertEqual(data[(120, 0)]['Owner'], 'user"20')
+        self.failIf(data[(120, 0)].has_key('ClusterId'))
+
+class TestCompactClassAd(unittest.TestCase):
+    """
+    Test the compact representation of query results
+    """
+    def setUp(self):
+        self.data = {}
+        self.schema = condorMonitor.CompactSchema(['JobStatus', 'Owner'])
+        for i in range(100):
+            list_el = {u'ClusterId': i, u'ProcId': 0, u'JobStatus': 1 + (i % 2)}
+            if i % 3 == 0:
+                list_el[u'Owner'] = u'user%i' % (i % 5)
+            condorMonitor.addList2Compact(self.data, list_el,
+                                          ["ClusterId", "ProcId"], self.schema)
+
+    def test_dict_api(self):
+        el = self.data[(3, 0)]
+        self.assertEqual(el['JobStatus'], 2)
+        self.assertEqual(el['Owner'], 'user3')
+        self.failUnless(el.has_key('Owner'))
+        self.failIf(el.has_key('ClusterId'))
+        self.assertEqual(el.get('Missing', 5), 5)
+        self.assertRaises(KeyError, lambda: el['Missing'])
+        self.assertEqual(el.copy(), {'JobStatus': 2, 'Owner': 'user3'})
+
+        el = self.data[(4, 0)]
+        self.assertEqual(el.keys(), ['JobStatus'])
+        self.assertEqual(len(el), 1)
+        self.failIf('Owner' in el)
+
+        # new attributes can be added, like for a dictionary
+        el['RunningOn'] = 'UNKNOWN'
+        self.assertEqual(el['RunningOn'], 'UNKNOWN')
+        self.failIf(self.data[(5, 0)].has_key('RunningOn'))
+        del el['RunningOn']
+        self.failIf(el.has_key('RunningOn'))
+
+    def test_constraint(self):
+        sq = condorMonitor.applyConstraint(self.data, lambda el:(el.has_key('Owner') and (el['JobStatus'] == 1)))
+        self.assertEqual(len(sq), 17)
+
+    def test_pickle(self):
+        for protocol in (0, cPickle.HIGHEST_PROTOCOL):
+            data = cPickle.loads(cPickle.dumps(self.data, protocol))
+            self.assertEqual(len(data), 100)
+            for k in self.data.keys():
+                self.assertEqual(data[k], self.data[k])
+            # the schema is still shared after the transfer
+            self.failUnless(data[(3, 0)].schema is data[(4, 0)].schema)
+
+class TestStoredQueryIndex(unittest.TestCase):
+    """
+    Test the equality indexes of StoredQuery and IndexedSubQuery
+    """
+    def setUp(self):
+        self.query = condorMonitor.StoredQuery()
+        data = {}
+        for i in range(200):
+            el = {'JobStatus': 1 + (i % 3), 'GlideinCredentialIdentifier': 'cred%i' % (i % 4)}
+            if i % 10 != 0:
+                el['GlideinFrontendName'] = 'fe%i:sc' % (i % 7)
+            data[(i, 0)] = el
+        self.query.stored_data = data
+
+    def test_indexed_subquery(self):
+        for fe in ('fe0:sc', 'fe3:sc', 'missing'):
+            for cred in ('cred1', 'cred2'):
+                sq = condorMonitor.IndexedSubQuery(self.query,
+                                                   ['GlideinFrontendName', 'GlideinCredentialIdentifier'],
+                                                   [fe, cred])
+                sq.load()
+                ref = condorMonitor.SubQuery(self.query, lambda d:(d.has_key('GlideinFrontendName') and (d['GlideinFrontendName'] == fe) and (d['GlideinCredentialIdentifier'] == cred)))
+                ref.load()
+                self.assertEqual(sq.fetchStored(), ref.fetchStored())
+
+    def test_reload(self):
+        self.query.index_on(['JobStatus'])
+        self.assertEqual(len(self.query.fetchStoredIndexed(['JobStatus'], [1])), 67)
+        # new data must invalidate the index
+        self.query.stored_data = {(1, 0): {'JobStatus': 1}}
+        self.assertEqual(self.query.fetchStoredIndexed(['JobStatus'], [1]).keys(), [(1, 0)])
+        self.assertEqual(self.query.fetchStoredIndexed(['JobStatus'], [2]), {})
+
+    def test_count_groups(self):
+        hash_func = lambda el:el['JobStatus']
+        counts = condorMonitor.Summarize(self.query, hash_func).countStoredGroups(['GlideinFrontendName'])
+        self.assertEqual(len(counts), 7)
+        for fe in counts.keys():
+            ref = condorMonitor.SubQuery(self.query, lambda d:(d.get('GlideinFrontendName') == fe))
+            ref.load()
+            self.assertEqual(counts[fe], condorMonitor.Summarize(ref, hash_func).countStored())
+
+        # with many attributes, the groups are tuples
+        counts = condorMonitor.Summarize(self.query, hash_func).countStoredGroups(['GlideinFrontendName', 'GlideinCredentialIdentifier'])
+        self.assertEqual(len(counts), 28)
+        ref = condorMonitor.SubQuery(self.query, lambda d:((d.get('GlideinFrontendName') == 'fe1:sc') and (d['GlideinCredentialIdentifier'] == 'cred1')))
+        ref.load()
+        self.assertEqual(counts[('fe1:sc', 'cred1')], condorMonitor.Summarize(ref, hash_func).countStored())
+
+# prints a good answer, or a truncated one if the constraint contains "bad"
+FAKE_CONDOR_STATUS = """#!/bin/sh
+echo '<?xml version="1.0"?>'
+echo '<!DOCTYPE classads SYSTEM "classads.dtd">'
+echo '<classads>'
+echo '<c>'
+echo '    <a n="Name"><s>slot1@host</s></a>'
+case "$*" in
+  *bad*) exit 0;;
+esac
+echo '</c>'
+echo '</classads>'
+"""
+
+class TestFetchMulti(unittest.TestCase):
+    """
+    Test that a query returning invalid output fails alone
+    """
+    def setUp(self):
+        self.bin_dir = tempfile.mkdtemp()
+        fname = os.path.join(self.bin_dir, "condor_status")
+        fd = open(fname, "w")
+        fd.write(FAKE_CONDOR_STATUS)
+        fd.close()
+        os.chmod(fname, 0755)
+        self.old_bin_path = condorExe.condor_bin_path
+        condorExe.condor_bin_path = self.bin_dir
+
+    def tearDown(self):
+        condorExe.condor_bin_path = self.old_bin_path
+        shutil.rmtree(self.bin_dir)
+
+    def test_truncated(self):
+        query_list = [(condorMonitor.CondorStatus(), 'good', None),
+                      (condorMonitor.CondorStatus(), 'bad', None)]
+        results = condorMonitor.fetchMulti(query_list)
+        self.assertEqual(results[0].keys(), ['slot1@host'])
+        self.failUnless(isinstance(results[1], condorExe.ExeError))
+
+def main():
+    r1 = runTest(TestXml2List)
+    r2 = runTest(TestCompactClassAd)
+    r3 = runTest(TestStoredQueryIndex)
+    r4 = runTest(TestFetchMulti)
+    return r1 or r2 or r3 or r4
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import configCache
+import glideFactoryConfig
+
+class TestConfigCache(unittest.TestCase):
+    """
+    Test the cache of the parsed config files
+    """
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.work_dir, "job.descript")
+        self.write("# comment\nSchedd schedd_glideins1@localhost\nMaxRunning 10\n\n")
+        configCache.config_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write(self, text, mtime=None):
+        fd = open(self.fname, "w")
+        fd.write(text)
+        fd.close()
+        if mtime != None:
+            os.utime(self.fname, (mtime, mtime))
+
+    def test_reload(self):
+        cache = configCache.config_cache
+        reloads = cache.get_reloads(self.fname)
+        conf1 = glideFactoryConfig.ConfigFile(self.fname, repr)
+        conf2 = glideFactoryConfig.ConfigFile(self.fname, repr)
+        self.assertEqual(conf1.data, {'Schedd': 'schedd_glideins1@localhost', 'MaxRunning': '10'})
+        self.assertEqual(conf2.data, conf1.data)
+        self.assertEqual(cache.get_reloads(self.fname), reloads + 1)
+
+        # the objects do not share the data
+        conf2.data['MaxRunning'] = None
+        self.assertEqual(glideFactoryConfig.ConfigFile(self.fname, repr).data['MaxRunning'], '10')
+
+        # a different conversion is a different entry
+        self.assertEqual(glideFactoryConfig.ConfigFile(self.fname, lambda s:repr(s.upper())).data['Schedd'], 'SCHEDD_GLIDEINS1@LOCALHOST')
+        self.assertEqual(cache.get_reloads(self.fname), reloads + 2)
+
+        # changing the file is noticed, even if the size is the same
+        self.write("# comment\nSchedd schedd_glideins2@localhost\nMaxRunning 10\n\n", time.time() + 10)
+        self.assertEqual(glideFactoryConfig.ConfigFile(self.fname, repr).data['Schedd'], 'schedd_glideins2@localhost')
+        self.assertEqual(cache.get_reloads(self.fname), reloads + 3)
+
+def main():
+    return runTest(TestConfigCache)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import os
+import sys
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import glideFactoryInterface
+
+class FakeKey:
+    def __init__(self, key_id):
+        self.key_id = key_id
+        self.extracted = 0
+
+    def get_pub_key_id(self):
+        return self.key_id
+
+    def extract_sym_key(self, enc_sym_key):
+        if enc_sym_key == 'bad':
+            raise ValueError, "cannot decrypt"
+        self.extracted += 1
+        return (self.key_id, enc_sym_key)
+
+class TestSymKeyCache(unittest.TestCase):
+    """
+    Test the LRU cache of the extracted sym keys
+    """
+    def test_hits(self):
+        cache = glideFactoryInterface.SymKeyCache(10)
+        k1 = FakeKey('k1')
+        k2 = FakeKey('k2')
+        for i in range(5):
+            self.assertEqual(cache.extract_sym_key(k1, 'code'), ('k1', 'code'))
+            self.assertEqual(cache.extract_sym_key(k2, 'code'), ('k2', 'code'))
+        self.assertEqual(k1.extracted, 1)
+        self.assertEqual(k2.extracted, 1)
+        self.assertEqual((cache.hits, cache.misses), (8, 2))
+
+    def test_lru(self):
+        cache = glideFactoryInterface.SymKeyCache(3)
+        k = FakeKey('k')
+        for code in ('a', 'b', 'c'):
+            cache.extract_sym_key(k, code)
+        cache.extract_sym_key(k, 'a') # now b is the least recently used
+        cache.extract_sym_key(k, 'd')
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(k.extracted, 4)
+        cache.extract_sym_key(k, 'a')
+        cache.extract_sym_key(k, 'c')
+        cache.extract_sym_key(k, 'd')
+        self.assertEqual(k.extracted, 4)
+        cache.extract_sym_key(k, 'b')
+        self.assertEqual(k.extracted, 5)
+        self.assertEqual(len(cache), 3)
+
+    def test_failure(self):
+        cache = glideFactoryInterface.SymKeyCache(3)
+        k = FakeKey('k')
+        self.assertRaises(ValueError, cache.extract_sym_key, k, 'bad')
+        self.assertEqual(len(cache), 0)
+
+def main():
+    return runTest(TestSymKeyCache)
+
+if __name__ == '__main__':
+    sys.exit(main())
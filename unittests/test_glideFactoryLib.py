@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+from unittest_utils import FakeLogger
+
+import logSupport
+import condorExe
+import condorMonitor
+import tokenBucket
+import condorPrivsep
+import glideFactoryConfig
+import glideFactoryLib
+
+# logs its environment, one repr per line,
+# and fails the clusters of size FAKE_FAIL_COUNT
+FAKE_CONDOR_SUBMIT = """#!/usr/bin/env python
+import os, sys
+fd = open(sys.argv[0] + ".log", "a")
+fd.write(repr(dict(os.environ)) + "\\n")
+fd.close()
+if os.environ.get('FAKE_FAIL_COUNT') == os.environ['GLIDEIN_COUNT']:
+    sys.stderr.write("ERROR: Failed to connect to local queue manager\\n")
+    sys.exit(1)
+sys.stdout.write("Submitting job(s).\\n")
+sys.stdout.write("%s job(s) submitted to cluster %i.\\n" % (os.environ['GLIDEIN_COUNT'], os.getpid()))
+"""
+
+# fails on the jobs of cluster 9
+FAKE_CONDOR_RM = """#!/bin/sh
+rc=0
+for a in "$@"; do
+  case "$a" in
+    9.*) echo "Job $a not found" 1>&2; rc=1;;
+    [0-9]*.[0-9]*) echo "Job $a marked for removal";;
+  esac
+done
+exit $rc
+"""
+
+class FakeCredentials:
+    def __init__(self, username):
+        self.username = username
+        self.id = "cred1"
+        self.security_class = "frontend"
+
+class FakeJobDescript:
+    def __init__(self, entry_name):
+        self.data = {'Schedd': 'schedd_glideins1@localhost'}
+
+class TestSubmitGlideins(unittest.TestCase):
+    """
+    Test the submit environment cache, and the submission of the clusters
+    """
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.bin_dir = tempfile.mkdtemp()
+        fname = os.path.join(self.bin_dir, "condor_submit")
+        fd = open(fname, "w")
+        fd.write(FAKE_CONDOR_SUBMIT)
+        fd.close()
+        os.chmod(fname, 0755)
+        self.old_bin_path = condorExe.condor_bin_path
+        condorExe.condor_bin_path = self.bin_dir
+
+        self.env_calls = []
+        self.exe_env = ['GLIDEIN_ENTRY_NAME=entry1', 'GLIDEIN_CLIENT=client1']
+        self.orig_get_submit_environment = glideFactoryLib.get_submit_environment
+        glideFactoryLib.get_submit_environment = self.get_submit_environment
+        self.orig_JobDescript = glideFactoryConfig.JobDescript
+        glideFactoryConfig.JobDescript = FakeJobDescript
+        self.orig_max_cluster_size = glideFactoryLib.factoryConfig.max_cluster_size
+        glideFactoryLib.factoryConfig.max_cluster_size = 2
+        glideFactoryLib.clear_submit_env_cache()
+
+    def tearDown(self):
+        condorExe.condor_bin_path = self.old_bin_path
+        glideFactoryLib.get_submit_environment = self.orig_get_submit_environment
+        glideFactoryConfig.JobDescript = self.orig_JobDescript
+        glideFactoryLib.factoryConfig.max_cluster_size = self.orig_max_cluster_size
+        glideFactoryLib.clear_submit_env_cache()
+        shutil.rmtree(self.bin_dir)
+
+    def get_submit_environment(self, entry_name, client_name, submit_credentials, client_web, params):
+        self.env_calls.append((entry_name, client_name))
+        return self.exe_env
+
+    def submit(self, nr_glideins, username=glideFactoryLib.MY_USERNAME):
+        return glideFactoryLib.submitGlideins("entry1", "client1", nr_glideins, "frontend1",
+                                              FakeCredentials(username), None, {'GLIDEIN_Collector': 'host'})
+
+    def get_submit_envs(self):
+        fd = open(os.path.join(self.bin_dir, "condor_submit.log"))
+        lines = fd.readlines()
+        fd.close()
+        return [eval(line) for line in lines]
+
+    def test_env_cache(self):
+        credentials = FakeCredentials("user1")
+        env1 = glideFactoryLib.get_cached_submit_environment("entry1", "client1", credentials, None, {'a': 1})
+        env1.append('GLIDEIN_COUNT=1') # the caller can extend it
+        env2 = glideFactoryLib.get_cached_submit_environment("entry1", "client1", credentials, None, {'a': 1})
+        self.assertEqual(env2, self.exe_env)
+        self.assertEqual(len(self.env_calls), 1)
+
+        glideFactoryLib.get_cached_submit_environment("entry1", "client1", credentials, None, {'a': 2})
+        self.assertEqual(len(self.env_calls), 2)
+
+        # a new cycle starts from scratch
+        glideFactoryLib.clear_submit_env_cache()
+        glideFactoryLib.get_cached_submit_environment("entry1", "client1", credentials, None, {'a': 1})
+        self.assertEqual(len(self.env_calls), 3)
+
+    def test_same_env(self):
+        # the privsep branch gets a list
+        privsep_envs = []
+        def condor_execute(username, submit_dir, cmd, args, env):
+            privsep_envs.append(env)
+            return ["1 job(s) submitted to cluster 12.\n"]
+        orig_condor_execute = condorPrivsep.condor_execute
+        condorPrivsep.condor_execute = condor_execute
+        try:
+            self.submit(1, "otheruser")
+        finally:
+            condorPrivsep.condor_execute = orig_condor_execute
+
+        # the direct one passes a dict to condor_submit
+        self.assertEqual(len(self.submit(1)), 1)
+
+        self.assertEqual(len(privsep_envs), 1)
+        privsep_env = glideFactoryLib.env_list2dict(privsep_envs[0])
+        submit_env = self.get_submit_envs()[0]
+        for k in privsep_env.keys():
+            self.assertEqual((k, submit_env.get(k)), (k, privsep_env[k]))
+        self.assertEqual(submit_env['GLIDEIN_COUNT'], '1')
+        self.assertEqual(submit_env['GLIDEIN_FRONTEND_NAME'], 'frontend1')
+
+    def test_failed_clusters(self):
+        # 5 glideins in clusters of 2, 2 and 1; the two of size 2 fail
+        self.exe_env = self.exe_env + ['FAKE_FAIL_COUNT=2']
+        try:
+            self.submit(5)
+        except RuntimeError, e:
+            self.failUnless(str(e).startswith("condor_submit failed 2 times"))
+            self.assertEqual(str(e).count("Failed to connect to local queue manager"), 2)
+        else:
+            self.fail("RuntimeError not raised")
+        self.assertEqual(len(self.get_submit_envs()), 3)
+
+class TestScheddLimits(unittest.TestCase):
+    """
+    Test the factory-wide limits per schedd
+    """
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.work_dir = tempfile.mkdtemp()
+        fname = os.path.join(self.work_dir, "condor_rm")
+        fd = open(fname, "w")
+        fd.write(FAKE_CONDOR_RM)
+        fd.close()
+        os.chmod(fname, 0755)
+        self.old_bin_path = condorExe.condor_bin_path
+        condorExe.condor_bin_path = self.work_dir
+        condorMonitor.local_schedd_cache.disable() # no schedd to look up
+        self.old_config = glideFactoryLib.factoryConfig
+        glideFactoryLib.factoryConfig = glideFactoryLib.FactoryConfig()
+        glideFactoryLib.factoryConfig.schedd_limits_dir = self.work_dir
+
+    def tearDown(self):
+        condorExe.condor_bin_path = self.old_bin_path
+        condorMonitor.local_schedd_cache.enable()
+        glideFactoryLib.factoryConfig = self.old_config
+        shutil.rmtree(self.work_dir)
+
+    def test_not_configured(self):
+        for action in ("submit", "remove", "release"):
+            self.assertEqual(glideFactoryLib.get_schedd_bucket(action, "schedd1"), None)
+            self.assertEqual(glideFactoryLib.request_schedd_capacity(action, "schedd1", 1000), 1000)
+
+    def test_remove_failures(self):
+        glideFactoryLib.factoryConfig.schedd_remove_rate = 0.0001 # no refill during the test
+        glideFactoryLib.factoryConfig.schedd_remove_burst = 10
+        glideFactoryLib.factoryConfig.max_removes = 5
+        bucket = glideFactoryLib.get_schedd_bucket("remove", "schedd1")
+        self.failUnless(isinstance(bucket, tokenBucket.SharedTokenBucket))
+
+        # the two failed ones are given back
+        glideFactoryLib.removeGlideins("schedd1", [(1, 0), (9, 0), (2, 0), (9, 1), (3, 0)])
+        self.assertEqual(bucket.acquire(100), 7)
+
+def main():
+    r1 = runTest(TestSubmitGlideins)
+    r2 = runTest(TestScheddLimits)
+    return r1 or r2
+
+if __name__ == '__main__':
+    sys.exit(main())
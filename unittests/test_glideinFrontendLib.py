@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import cPickle
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+from unittest_utils import FakeLogger
+
+import logSupport
+import condorMonitor
+import classadExpr
+import glideinFrontendLib
+
+#
+# The original pairwise implementation of uniqueSets,
+# used as reference
+#
+def refUniqueSets(in_sets):
+    sorted_sets = []
+    for i in in_sets:
+        common_list = []
+        common = set()
+        old_unique_list = []
+        old_unique = set()
+        new = []
+        for k in sorted_sets:
+            old_unique = old_unique | k
+            common = k & i
+            if common:
+                common_list.append(common)
+        for j in common_list:
+            i = i - j
+            old_unique = old_unique - j
+        for k in sorted_sets:
+            old_unique_list.append(k & old_unique)
+        if i:
+            new.append(i)
+        for o in old_unique_list:
+            if o:
+                new.append(o)
+        for c in common_list:
+            if c:
+                new.append(c)
+        sorted_sets = new
+
+    sum_set = set()
+    for s in sorted_sets:
+        sum_set = sum_set | s
+    sorted_sets.append(sum_set)
+
+    index_list = []
+    for s in sorted_sets:
+        indexes = []
+        temp_sets = in_sets[:]
+        for t in temp_sets:
+            if s & t:
+                indexes.append(temp_sets.index(t))
+                temp_sets[temp_sets.index(t)] = set()
+        index_list.append(indexes)
+
+    outvals = []
+    for i in range(len(index_list) - 1):
+        outvals.append((set(index_list[i]), sorted_sets[i]))
+    return (outvals, sorted_sets[-1])
+
+def normalize(outvals):
+    out = []
+    for (indexes, vals) in outvals:
+        i = list(indexes)
+        i.sort()
+        l = list(vals)
+        l.sort()
+        out.append((tuple(i), tuple(l)))
+    out.sort()
+    return out
+
+def randomSets(rnd):
+    nr_sets = rnd.randint(0, 40)
+    nr_elements = rnd.randint(1, 200)
+    in_sets = []
+    for i in range(nr_sets):
+        if in_sets and rnd.random() < 0.1:
+            in_sets.append(set(rnd.choice(in_sets))) # duplicates happen
+        else:
+            density = rnd.random()
+            s = set()
+            for el in range(nr_elements):
+                if rnd.random() < density:
+                    s.add(el)
+            in_sets.append(s)
+    return in_sets
+
+class TestUniqueSets(unittest.TestCase):
+    """
+    Compare the bitmask based partitioning with the original implementation
+    """
+    def test_example(self):
+        in_sets = [set(range(1, 11)), set(range(1, 11)), set(range(1, 36)), set(range(11, 31))]
+        (outvals, sum_set) = glideinFrontendLib.uniqueSets(in_sets)
+        self.assertEqual(sum_set, set(range(1, 36)))
+        self.assertEqual(normalize(outvals),
+                         normalize([(set([2]), set(range(31, 36))),
+                                    (set([0, 1, 2]), set(range(1, 11))),
+                                    (set([2, 3]), set(range(11, 31)))]))
+
+    def test_random(self):
+        rnd = random.Random(1234)
+        for i in range(200):
+            in_sets = randomSets(rnd)
+            (outvals, sum_set) = glideinFrontendLib.uniqueSets(in_sets)
+            (ref_outvals, ref_sum_set) = refUniqueSets(in_sets)
+            self.assertEqual(sum_set, ref_sum_set)
+            self.assertEqual(normalize(outvals), normalize(ref_outvals))
+
+    def test_counts(self):
+        rnd = random.Random(4321)
+        for i in range(200):
+            in_sets = randomSets(rnd)
+            (ref_outvals, ref_sum_set) = refUniqueSets(in_sets)
+            ref_prop = {}
+            ref_unique = {}
+            for (indexes, vals) in ref_outvals:
+                for site_index in indexes:
+                    ref_prop[site_index] = ref_prop.get(site_index, 0.0) + (1.0 * len(vals) / len(indexes))
+                    ref_unique.setdefault(site_index, 0)
+                if len(indexes) == 1:
+                    ref_unique[list(indexes)[0]] = len(vals)
+
+            mask_counts = {}
+            for (indexes, vals) in ref_outvals:
+                mask = 0L
+                for site_index in indexes:
+                    mask |= 1L << site_index
+                mask_counts[mask] = len(vals)
+            (match, prop, unique, nr_elements) = glideinFrontendLib.countMasks(mask_counts)
+            self.assertEqual(nr_elements, len(ref_sum_set))
+            for site_index in range(len(in_sets)):
+                if in_sets[site_index]:
+                    self.assertEqual(match[site_index], len(in_sets[site_index]))
+                else:
+                    self.failIf(match.has_key(site_index))
+            self.assertEqual(unique, ref_unique)
+            self.assertEqual(prop.keys(), ref_prop.keys())
+            for site_index in prop.keys():
+                self.assertAlmostEqual(prop[site_index], ref_prop[site_index])
+
+class TestCountMatch(unittest.TestCase):
+    def setUp(self):
+        logSupport.log = FakeLogger()
+
+    def test_count_match(self):
+        condorq = condorMonitor.StoredQuery()
+        condorq.stored_data = {}
+        for i in range(30):
+            condorq.stored_data[(i, 0)] = {'Site': i % 3}
+        # glidein 'a' takes sites 0 and 1, 'b' site 1 and 'c' nothing
+        glidein_dict = {('f', 'a', 'x'): {'attrs': {'Sites': [0, 1]}},
+                        ('f', 'b', 'x'): {'attrs': {'Sites': [1]}},
+                        ('f', 'c', 'x'): {'attrs': {'Sites': []}}}
+        match_obj = compile("job['Site'] in glidein['attrs']['Sites']", "<string>", "eval")
+        (count, prop, unique) = glideinFrontendLib.countMatch(match_obj, {'schedd': condorq}, glidein_dict, {})
+        self.assertEqual(count, {('f', 'a', 'x'): 20, ('f', 'b', 'x'): 10, ('f', 'c', 'x'): 0, (None, None, None): 10})
+        self.assertEqual(prop, {('f', 'a', 'x'): 15, ('f', 'b', 'x'): 5, ('f', 'c', 'x'): 0, (None, None, None): 10})
+        self.assertEqual(unique, {('f', 'a', 'x'): 10, ('f', 'b', 'x'): 0, ('f', 'c', 'x'): 0, (None, None, None): 10})
+
+    def test_match_matrix(self):
+        """
+        Counting a subset with the matrix of all the jobs must give
+        the same result as matching the subset directly
+        """
+        rnd = random.Random(99)
+        condorq_dict = {}
+        for schedd in ('s1', 's2'):
+            condorq = condorMonitor.StoredQuery()
+            condorq.stored_data = {}
+            for i in range(200):
+                condorq.stored_data[(i, rnd.randint(0, 2))] = {'Site': rnd.randint(0, 9), 'JobStatus': rnd.randint(1, 2)}
+            condorq_dict[schedd] = condorq
+        glidein_dict = {}
+        for g in range(12):
+            glidein_dict[('f', 'g%i' % g, 'x')] = {'attrs': {'Sites': rnd.sample(range(10), rnd.randint(0, 4))}}
+        match_obj = compile("job['Site'] in glidein['attrs']['Sites']", "<string>", "eval")
+
+        match_matrix = glideinFrontendLib.getMatchMatrix(match_obj, condorq_dict, glidein_dict, {}, ['Site'])
+        for subset in (condorq_dict, glideinFrontendLib.getIdleCondorQ(condorq_dict), glideinFrontendLib.getRunningCondorQ(condorq_dict)):
+            self.assertEqual(glideinFrontendLib.countMatchMatrix(match_matrix, subset),
+                             glideinFrontendLib.countMatch(match_obj, subset, glidein_dict, {}, ['Site']))
+
+    def test_match_paths(self):
+        """
+        Grouping glideins and jobs by the attributes used in the expression
+        must not change the result
+        """
+        rnd = random.Random(7)
+        condorq = condorMonitor.StoredQuery()
+        condorq.stored_data = {}
+        for i in range(300):
+            condorq.stored_data[(i, 0)] = {'DESIRED_Sites': rnd.choice(['A', 'A,B', 'C', 'B,C']),
+                                           'RequestMemory': rnd.choice([1000, 2000, 4000]),
+                                           'Owner': 'user%i' % rnd.randint(0, 20)}
+        glidein_dict = {}
+        for g in range(40):
+            attrs = {'GLIDEIN_Site': rnd.choice(['A', 'B', 'C', 'D']),
+                     'GLIDEIN_CE': 'ce%i' % g}
+            if rnd.random() < 0.8:
+                attrs['GLIDEIN_MaxMemMBs'] = rnd.choice([1500, 2500, 5000])
+            glidein_dict[('f', 'g%i' % g, 'x')] = {'attrs': attrs}
+        match_expr = "(glidein['attrs']['GLIDEIN_Site'] in job['DESIRED_Sites'].split(',')) and (job['RequestMemory'] <= glidein['attrs'].get('GLIDEIN_MaxMemMBs', 2000))"
+        match_obj = compile(match_expr, "<string>", "eval")
+        match_list = ['DESIRED_Sites', 'RequestMemory', 'Owner']
+
+        match_paths = glideinFrontendLib.getMatchPaths(match_expr)
+        self.assertEqual(match_paths, ([('attrs', 'GLIDEIN_Site'), ('attrs',)], [('DESIRED_Sites',), ('RequestMemory',)]))
+        for paths in (match_paths, ([('attrs', 'GLIDEIN_Site'), ('attrs', 'GLIDEIN_MaxMemMBs')], [('DESIRED_Sites',), ('RequestMemory',)])):
+            match_matrix = glideinFrontendLib.getMatchMatrix(match_obj, {'s': condorq}, glidein_dict, {}, match_list, paths)
+            self.assertEqual(glideinFrontendLib.countMatchMatrix(match_matrix, {'s': condorq}),
+                             glideinFrontendLib.countMatch(match_obj, {'s': condorq}, glidein_dict, {}, match_list))
+
+    def test_match_cache(self):
+        """
+        Simulate a few iterations, with the cache going back and forth
+        as it would between the element and its children
+        """
+        condorq = condorMonitor.StoredQuery()
+        condorq.stored_data = {}
+        for i in range(100):
+            condorq.stored_data[(i, 0)] = {'Site': i % 5}
+        glidein_dict = {}
+        for g in range(10):
+            glidein_dict[('f', 'g%i' % g, 'x')] = {'attrs': {'Site': g % 5}}
+        match_expr = "job['Site'] == glidein['attrs']['Site']"
+        match_obj = compile(match_expr, "<string>", "eval")
+        match_paths = glideinFrontendLib.getMatchPaths(match_expr)
+        cache = glideinFrontendLib.MatchCache()
+
+        def iteration():
+            child_cache = cPickle.loads(cPickle.dumps(cache)) # the child has a copy
+            match_matrix = glideinFrontendLib.getMatchMatrix(match_obj, {'s': condorq}, glidein_dict, {}, ['Site'], match_paths, child_cache)
+            cache.apply_update(cPickle.loads(cPickle.dumps(child_cache.get_update())))
+            out = glideinFrontendLib.countMatchMatrix(match_matrix, {'s': condorq})
+            self.assertEqual(out, glideinFrontendLib.countMatch(match_obj, {'s': condorq}, glidein_dict, {}, ['Site']))
+
+        iteration()
+        self.assertEqual((cache.hits, cache.misses, cache.size), (0, 25, 25))
+        iteration()
+        self.assertEqual((cache.hits, cache.misses, cache.size), (25, 0, 25))
+
+        # a changed entry invalidates only its own results
+        # (g5 still has the old values)
+        glidein_dict[('f', 'g0', 'x')]['attrs']['Site'] = 7
+        iteration()
+        self.assertEqual((cache.hits, cache.misses, cache.size), (25, 5, 30))
+
+        # a new job cluster needs to be matched against all
+        condorq.stored_data[(200, 0)] = {'Site': 7}
+        iteration()
+        self.assertEqual((cache.hits, cache.misses, cache.size), (30, 6, 36))
+
+        # entries that are gone are forgotten
+        del glidein_dict[('f', 'g0', 'x')]
+        iteration()
+        self.assertEqual((cache.hits, cache.misses, cache.size), (30, 0, 30))
+
+        # without the paths the whole glidein is used,
+        # but objects in it must not prevent the reuse
+        for g in glidein_dict.keys():
+            glidein_dict[g]['attrs']['PubKeyObj'] = object()
+        iteration()
+        for g in glidein_dict.keys():
+            glidein_dict[g]['attrs']['PubKeyObj'] = object()
+        match_paths = None
+        iteration()
+        for g in glidein_dict.keys():
+            glidein_dict[g]['attrs']['PubKeyObj'] = object()
+        iteration()
+        self.assertEqual((cache.hits, cache.misses, cache.size), (30, 0, 30))
+
+        # but a different expression invalidates all
+        match_obj = compile("job['Site'] != glidein['attrs']['Site']", "<string>", "eval")
+        iteration()
+        self.assertEqual(cache.hits, 0)
+
+class TestCondorQSnapshot(unittest.TestCase):
+    def setUp(self):
+        logSupport.log = FakeLogger()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.condorq = condorMonitor.StoredQuery()
+        self.condorq.stored_data = {}
+        for i in range(100):
+            self.condorq.stored_data[(i, 0)] = {'JobStatus': 1 + (i % 2), 'JobUniverse': 5 + (i % 3), 'Owner': 'user%i' % (i % 4)}
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_snapshot(self):
+        glideinFrontendLib.writeCondorQSnapshot(self.snapshot_dir, 's1', [('JobUniverse', 'i'), ('Owner', 's')], self.condorq, time.time())
+        condorq_dict = glideinFrontendLib.getCondorQFromSnapshots(self.snapshot_dir, 60, ['s1'],
+                                                                  '(JobUniverse == 5) && (Owner =!= "user0")', [('Owner', 's')])
+        self.assertEqual(condorq_dict.keys(), ['s1'])
+        ref = condorMonitor.applyConstraint(self.condorq.stored_data, lambda el:(el['JobUniverse'] == 5) and (el['Owner'] != 'user0'))
+        self.assertEqual(condorq_dict['s1'].fetchStored(), ref)
+
+    def test_expr_value(self):
+        # jobs with expressions in the constraint attributes need condor
+        self.condorq.stored_data[(3, 0)]['JobUniverse'] = classadExpr.ExprValue('ifThenElse(true, 5, 7)')
+        glideinFrontendLib.writeCondorQSnapshot(self.snapshot_dir, 's1', [('JobUniverse', 'i'), ('Owner', 's')], self.condorq, time.time())
+        queried = []
+        orig_getCondorQ = glideinFrontendLib.getCondorQ
+        glideinFrontendLib.getCondorQ = lambda schedd_names, constraint, format_list, compact_results:(queried.extend(schedd_names) or {})
+        try:
+            condorq_dict = glideinFrontendLib.getCondorQFromSnapshots(self.snapshot_dir, 60, ['s1'], 'JobUniverse == 5', [('Owner', 's')])
+        finally:
+            glideinFrontendLib.getCondorQ = orig_getCondorQ
+        self.assertEqual(queried, ['s1'])
+        self.assertEqual(condorq_dict, {})
+
+    def test_request(self):
+        fname = os.path.join(self.snapshot_dir, "request.pkl")
+        glideinFrontendLib.writeCondorQRequest(fname, ['s1'], 'JobUniverse == 5', [('Owner', 's')], {})
+        request = glideinFrontendLib.loadCondorQRequest(fname)
+        self.assertEqual(request['schedds'], ['s1'])
+        attrs = [el[0] for el in request['format_list']]
+        for attr in ('Owner', 'JobUniverse', 'JobStatus', 'ServerTime'):
+            self.failUnless(attr in attrs)
+        # a constraint that cannot be evaluated locally withdraws the request
+        glideinFrontendLib.writeCondorQRequest(fname, ['s1'], 'TARGET.Memory > 1', [('Owner', 's')], {})
+        self.assertEqual(glideinFrontendLib.loadCondorQRequest(fname), None)
+
+    def test_env(self):
+        # groups with different mapfiles must not share the jobs
+        env_a = {'_CONDOR_CERTIFICATE_MAPFILE': '/etc/gwms/group_a.map', 'X509_USER_PROXY': '/tmp/proxy'}
+        env_b = {'_CONDOR_CERTIFICATE_MAPFILE': '/etc/gwms/group_b.map', 'X509_USER_PROXY': '/tmp/proxy'}
+        requests = {}
+        for group_name, env, attr in (('a', env_a, 'Owner'), ('b', env_b, 'JobUniverse'), ('c', dict(env_a), 'JobUniverse')):
+            fname = os.path.join(self.snapshot_dir, "request_%s.pkl" % group_name)
+            glideinFrontendLib.writeCondorQRequest(fname, ['s1'], None, [(attr, 's')], env)
+            requests[group_name] = glideinFrontendLib.loadCondorQRequest(fname)
+        merged = glideinFrontendLib.mergeCondorQRequests(requests)
+        self.assertEqual(len(merged), 2)
+        by_groups = {}
+        for request in merged.values():
+            by_groups[tuple(request['groups'])] = request
+        self.assertEqual(by_groups[('a', 'c')]['env'], env_a)
+        self.assertEqual(by_groups[('b',)]['env'], env_b)
+        attrs = [el[0] for el in by_groups[('a', 'c')]['format_list']]
+        self.failUnless(('Owner' in attrs) and ('JobUniverse' in attrs))
+
+        # a snapshot taken for group a is not used by group b
+        glideinFrontendLib.writeCondorQSnapshot(self.snapshot_dir, 's1', [('JobUniverse', 'i'), ('Owner', 's')], self.condorq, time.time(), env_a)
+        queried = []
+        orig_getCondorQ = glideinFrontendLib.getCondorQ
+        glideinFrontendLib.getCondorQ = lambda schedd_names, constraint, format_list, compact_results:(queried.extend(schedd_names) or {})
+        try:
+            condorq_dict = glideinFrontendLib.getCondorQFromSnapshots(self.snapshot_dir, 60, ['s1'], None, [('Owner', 's')], env=env_a)
+            self.assertEqual(queried, [])
+            self.assertEqual(condorq_dict['s1'].fetchStored(), self.condorq.stored_data)
+            condorq_dict = glideinFrontendLib.getCondorQFromSnapshots(self.snapshot_dir, 60, ['s1'], None, [('Owner', 's')], env=env_b)
+            self.assertEqual(queried, ['s1'])
+        finally:
+            glideinFrontendLib.getCondorQ = orig_getCondorQ
+
+def main():
+    r1 = runTest(TestUniqueSets)
+    r2 = runTest(TestCountMatch)
+    r3 = runTest(TestCondorQSnapshot)
+    return r1 or r2 or r3
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# unittest_utils will handle putting the appropriate directories on the python
+# path for us.
+from unittest_utils import runTest
+
+import tokenBucket
+
+class TestSharedTokenBucket(unittest.TestCase):
+    """
+    Test the token bucket shared through a file
+    """
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.work_dir, "bucket")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_acquire(self):
+        bucket = tokenBucket.SharedTokenBucket(self.fname, 2, 10)
+        self.assertEqual(bucket.acquire(4, now=100), 4) # starts full
+        self.assertEqual(bucket.acquire(10, now=100), 6)
+        self.assertEqual(bucket.acquire(10, now=100), 0)
+        self.assertEqual(bucket.acquire(10, now=103), 6)
+        self.assertEqual(bucket.acquire(20, now=1000), 10) # never above burst
+        bucket.release(3, now=1000)
+        self.assertEqual(bucket.acquire(10, now=1000), 3)
+
+    def test_shared(self):
+        # two processes (or objects) using the same file share the tokens
+        bucket1 = tokenBucket.SharedTokenBucket(self.fname, 1, 5)
+        bucket2 = tokenBucket.SharedTokenBucket(self.fname, 1, 5)
+        self.assertEqual(bucket1.acquire(3, now=100), 3)
+        self.assertEqual(bucket2.acquire(3, now=100), 2)
+        self.assertEqual(bucket1.acquire(3, now=101), 1)
+
+    def test_latency(self):
+        bucket = tokenBucket.SharedTokenBucket(self.fname, 10, 100, target_latency=2)
+        self.assertEqual(bucket.acquire(100, now=100), 100)
+        bucket.report_latency(8, now=100)
+        # 4 times slower than the target -> a quarter of the rate
+        self.assertEqual(bucket.acquire(100, now=110), 25)
+        self.assertEqual(bucket.get_rate(1000), 1)
+        self.assertEqual(bucket.get_rate(1), 10)
+
+    def test_corrupted(self):
+        fd = open(self.fname, "w")
+        fd.write("garbage")
+        fd.close()
+        bucket = tokenBucket.SharedTokenBucket(self.fname, 1, 5)
+        self.assertEqual(bucket.acquire(10, now=100), 5)
+
+def main():
+    return runTest(TestSharedTokenBucket)
+
+if __name__ == '__main__':
+    sys.exit(main())